@@ -4,130 +4,59 @@
 # processed by RTKLIB (RTKCONV and RTKPLOT).
 # The .pos file from RTKPLOT is converted to .csv by POS_to_CSV.py and contains
 # only x,y,z ECEF coordinates for data points with a Q of 1
+# The .npy written by POS_to_CSV.py -f npy can be used instead: it is memory-mapped,
+# so large surveys load instantly. (.parquet files work too if pyarrow is installed.)
+# .pos files can also be fitted directly (solutions with a Q of 1, or -q).
+
+# Any number of files (or directories of them) can be fitted in one go, in parallel.
+# A summary table (center, radius, normal, the latitude and longitude where the circle would
+# be horizontal, residual statistics) is printed and can be saved with -o.
+# The fits are done in a local east, north, up frame (Circle_Fitting.LocalFrame) so the
+# millimetres aren't lost in the ECEF coordinates; the summary also has the center's
+# latitude, longitude and height, its standard errors in ENU and the tilt of the circle.
+# Plots are only drawn on request: --plots DIRECTORY saves them as .png files (with the
+# non-interactive Agg backend, so no display is needed); --show opens them in windows.
+# Above --max-points points, the 2D views are drawn as density plots (hexbin) and the
+# 3D view (and the 2D views with --lod decimate) show a sample of the points stratified
+# by angle around the circle, so long surveys plot quickly.
+# fit_file() and fit_files() can be used from other scripts.
+
+# Usage: python CSV_Circle_Fitting.py [-p processes] [-r huber|ransac] [-t threshold] [-q Q[,Q...]]
+#                                     [-o summary.csv] [--plots DIRECTORY] [--show] [--max-points N]
+#                                     [--lod hexbin|decimate] [filename or directory ...]
+# With no filenames, you are asked for one and its plots are shown
 
 # This code is based extensively on work by Miki at Meshlogic
 # https://meshlogic.github.io/posts/jupyter/curve-fitting/fitting-a-circle-to-cluster-of-3d-points/
 
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d.axes3d import Axes3D
 import sys
 import os
-import string
 import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-print('CSV Circle Fitting')
+import POS_to_CSV
+from Circle_Fitting import generate_circle_by_vectors, rodrigues_rot, fit_circle
 
-filename = ''
+EXTENSIONS = ('.csv', '.npy', '.parquet', '.pos')
 
-if filename == '':
-    # Check if the CSV filename was passed in argv
-    if len(sys.argv) > 1: filename = sys.argv[1]
+# Summary table columns
+SUMMARY_FIELDS = ('filename', 'points', 'inliers', 'x', 'y', 'z', 'radius', 'nx', 'ny', 'nz',
+                  'x_se', 'y_se', 'z_se', 'radius_se', 'tilt_se', 'latitude', 'longitude',
+                  'center_lat', 'center_lon', 'center_height', 'east_se', 'north_se', 'up_se', 'tilt',
+                  'mean_dist', 'std_dist', 'rms_radial', 'rms_normal', 'max_dist', 'iterations',
+                  'converged', 'seconds', 'error')
 
-firstfile = ''
-for root, dirs, files in os.walk("."):
-    if len(files) > 0:
-        if root == ".":
-            for afile in files:
-                if afile[-4:] == '.csv':
-                    if firstfile == '': firstfile = afile
+MAX_PLOT_POINTS = 20000 # Point budget for each plot
+LOD_MODES = ('hexbin', 'decimate')
 
-if filename == '': filename = raw_input('Enter the .csv filename (default: ' + firstfile + '): ') # Get the filename
-if filename == '': filename = firstfile
-
-print('Processing %s'%filename)
-
-# Load the data
-P = np.genfromtxt(filename,delimiter=',')
-
-#-------------------------------------------------------------------------------
-# Generate points on circle
-# P(t) = r*cos(t)*u + r*sin(t)*(n x u) + C
-#-------------------------------------------------------------------------------
-def generate_circle_by_vectors(t, C, r, n, u):
-    n = n/np.linalg.norm(n)
-    u = u/np.linalg.norm(u)
-    P_circle = r*np.cos(t)[:,np.newaxis]*u + r*np.sin(t)[:,np.newaxis]*np.cross(n,u) + C
-    return P_circle
-
-def generate_circle_by_angles(t, C, r, theta, phi):
-    # Orthonormal vectors n, u, <n,u>=0
-    n = np.array([np.cos(phi)*np.sin(theta), np.sin(phi)*np.sin(theta), np.cos(theta)])
-    u = np.array([-np.sin(phi), np.cos(phi), 0.])
-    
-    # P(t) = r*cos(t)*u + r*sin(t)*(n x u) + C
-    P_circle = r*np.cos(t)[:,np.newaxis]*u + r*np.sin(t)[:,np.newaxis]*np.cross(n,u) + C
-    return P_circle
-
-#-------------------------------------------------------------------------------
-# FIT CIRCLE 2D
-# - Find center [xc, yc] and radius r of circle fitting to set of 2D points
-# - Optionally specify weights for points
-#
-# - Implicit circle function:
-#   (x-xc)^2 + (y-yc)^2 = r^2
-#   (2*xc)*x + (2*yc)*y + (r^2-xc^2-yc^2) = x^2+y^2
-#   c[0]*x + c[1]*y + c[2] = x^2+y^2
-#
-# - Solution by method of least squares:
-#   A*c = b, c' = argmin(||A*c - b||^2)
-#   A = [x y 1], b = [x^2+y^2]
-#-------------------------------------------------------------------------------
-def fit_circle_2d(x, y, w=[]):
-    
-    A = np.array([x, y, np.ones(len(x))]).T
-    b = (x**2.) + (y**2.)
-    
-    # Modify A,b for weighted least squares
-    if len(w) == len(x):
-        W = np.diag(w)
-        A = np.dot(W,A)
-        b = dnp.ot(W,b)
-    
-    # Solve by method of least squares
-    c = np.linalg.lstsq(A,b)[0]
-    
-    # Get circle parameters from solution c
-    xc = c[0]/2.
-    yc = c[1]/2.
-    r = np.sqrt(c[2] + (xc**2.) + (yc**2.))
-    return xc, yc, r
-
-#-------------------------------------------------------------------------------
-# RODRIGUES ROTATION
-# - Rotate given points based on a starting and ending vector
-# - Axis k and angle of rotation theta given by vectors n0,n1
-#   P_rot = P*cos(theta) + (k x P)*sin(theta) + k*<k,P>*(1-cos(theta))
-#-------------------------------------------------------------------------------
-def rodrigues_rot(P, n0, n1):
-    
-    # If P is only 1d array (coords of single point), fix it to be matrix
-    if P.ndim == 1:
-        P = P[np.newaxis,:]
-    
-    # Get vector of rotation k and angle theta
-    n0 = n0/np.linalg.norm(n0)
-    n1 = n1/np.linalg.norm(n1)
-    k = np.cross(n0,n1)
-    k = k/np.linalg.norm(k)
-    theta = np.arccos(np.dot(n0,n1))
-    
-    # Compute rotated points
-    P_rot = np.zeros((len(P),3))
-    for i in range(len(P)):
-        P_rot[i] = P[i]*np.cos(theta) + np.cross(k,P[i])*np.sin(theta) + k*np.dot(k,P[i])*(1-np.cos(theta))
-
-    return P_rot
-
-#-------------------------------------------------------------------------------
-# ANGLE BETWEEN
-# - Get angle between vectors u,v with sign based on plane with unit normal n
-#-------------------------------------------------------------------------------
-def angle_between(u, v, n=None):
-    if n is None:
-        return np.arctan2(np.linalg.norm(np.cross(u,v)), np.dot(u,v))
-    else:
-        return np.arctan2(np.dot(n,np.cross(u,v)), np.dot(u,v))
+# The 3600 angles of the fitting circle and the 11 x 11 plane mesh (in units of the plot limits)
+CIRCLE_T = np.linspace(0, 2.*np.pi, 3600)
+COS_T = np.cos(CIRCLE_T)
+SIN_T = np.sin(CIRCLE_T)
+MESH_U, MESH_V = np.meshgrid(np.linspace(-1.,1.,11), np.linspace(-1.,1.,11))
 
 #-------------------------------------------------------------------------------
 # - Make axes of 3D plot to have equal scales
@@ -143,180 +72,346 @@ def set_axes_equal_3d(ax):
     ax.set_ylim3d([centers[1]-radius, centers[1]+radius])
     ax.set_zlim3d([centers[2]-radius, centers[2]+radius])
 
-#-------------------------------------------------------------------------------
-# (1) Fitting plane by SVD for the mean-centered data
-# Eq. of plane is <p,n> + d = 0, where p is a point on plane and n is normal vector
-#-------------------------------------------------------------------------------
-P_mean = P.mean(axis=0)
-P_centered = P - P_mean
-U,s,V = np.linalg.svd(P_centered)
-
-# Normal vector of fitting plane is given by 3rd column in V
-# Note linalg.svd returns V^T, so we need to select 3rd row from V^T
-normal = V[2,:]
-d = -np.dot(P_mean, normal)  # d = -<p,n>
-
-#-------------------------------------------------------------------------------
-# (2) Project points to coords X-Y in 2D plane
-#-------------------------------------------------------------------------------
-P_xy = rodrigues_rot(P_centered, normal, [0,0,1])
-
-#-------------------------------------------------------------------------------
-# (3) Fit circle in new 2D coords
-#-------------------------------------------------------------------------------
-xc, yc, r = fit_circle_2d(P_xy[:,0], P_xy[:,1])
-
-#--- Generate circle points in 2D
-t = np.linspace(0, 2.*np.pi, 3600)
-xx = xc + r*np.cos(t)
-yy = yc + r*np.sin(t)
-
-#-------------------------------------------------------------------------------
-# (4) Transform circle center back to 3D coords
-#-------------------------------------------------------------------------------
-C = rodrigues_rot(np.array([xc,yc,0]), [0,0,1], normal) + P_mean
-C = C.flatten()
-
-#--- Generate points for fitting circle
-t = np.linspace(0, 2.*np.pi, 3600)
-u = P[0] - C
-P_fitcircle = generate_circle_by_vectors(t, C, r, normal, u)
-
-#-------------------------------------------------------------------------------
-# Plot 2D
-#-------------------------------------------------------------------------------
-
-means = [np.mean(P[:,i]) for i in range(3)]
-min_xlim = means[0] - (r * 1.1)
-max_xlim = means[0] + (r * 1.1)
-min_ylim = means[1] - (r * 1.1)
-max_ylim = means[1] + (r * 1.1)
-min_zlim = means[2] - (r * 1.1)
-max_zlim = means[2] + (r * 1.1)
-
-fig = plt.figure(figsize=(16,11))
-alpha_pts = 0.2
-figshape = (2,3)
-ax = [None]*4
-ax[0] = plt.subplot2grid(figshape, loc=(0,0), colspan=2)
-ax[1] = plt.subplot2grid(figshape, loc=(1,0))
-ax[2] = plt.subplot2grid(figshape, loc=(1,1))
-ax[3] = plt.subplot2grid(figshape, loc=(1,2))
-i = 0
-ax[i].set_title('Fitting circle in 2D coords projected onto fitting plane')
-ax[i].set_xlabel('x'); ax[i].set_ylabel('y');
-ax[i].set_aspect('equal', 'datalim'); ax[i].margins(.1, .1)
-ax[i].grid()
-ax[i].get_xaxis().get_major_formatter().set_useOffset(False)
-ax[i].get_yaxis().get_major_formatter().set_useOffset(False)
-for tick in ax[i].get_xticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
-for tick in ax[i].get_yticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
-i = 1
-ax[i].scatter(P[:,0], P[:,1], alpha=alpha_pts, label='Points')
-ax[i].set_title('View X-Y')
-ax[i].set_xlabel('x'); ax[i].set_ylabel('y');
-ax[i].set(xlim=[min_xlim,max_xlim],ylim=[min_ylim,max_ylim],aspect=1)
-ax[i].grid()
-ax[i].get_xaxis().get_major_formatter().set_useOffset(False)
-ax[i].get_yaxis().get_major_formatter().set_useOffset(False)
-for tick in ax[i].get_xticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
-for tick in ax[i].get_yticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
-i = 2
-ax[i].scatter(P[:,0], P[:,2], alpha=alpha_pts, label='Points')
-ax[i].set_title('View X-Z')
-ax[i].set_xlabel('x'); ax[i].set_ylabel('z'); 
-ax[i].set(xlim=[min_xlim,max_xlim],ylim=[min_zlim,max_zlim],aspect=1)
-ax[i].grid()
-ax[i].get_xaxis().get_major_formatter().set_useOffset(False)
-ax[i].get_yaxis().get_major_formatter().set_useOffset(False)
-for tick in ax[i].get_xticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
-for tick in ax[i].get_yticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
-i = 3
-ax[i].scatter(P[:,1], P[:,2], alpha=alpha_pts, label='Points')
-ax[i].set_title('View Y-Z')
-ax[i].set_xlabel('y'); ax[i].set_ylabel('z'); 
-ax[i].set(xlim=[min_ylim,max_ylim],ylim=[min_zlim,max_zlim],aspect=1)
-ax[i].grid()
-ax[i].get_xaxis().get_major_formatter().set_useOffset(False)
-ax[i].get_yaxis().get_major_formatter().set_useOffset(False)
-for tick in ax[i].get_xticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
-for tick in ax[i].get_yticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
-
-ax[0].scatter(P_xy[:,0], P_xy[:,1], alpha=alpha_pts, label='Projected points')
-
-ax[0].plot(xx, yy, 'k--', lw=2, label='Fitting circle')
-ax[0].plot(xc, yc, 'k+', ms=10)
-ax[0].legend()
-
-ax[1].plot(P_fitcircle[:,0], P_fitcircle[:,1], 'k--', lw=2, label='Fitting circle')
-ax[2].plot(P_fitcircle[:,0], P_fitcircle[:,2], 'k--', lw=2, label='Fitting circle')
-ax[3].plot(P_fitcircle[:,1], P_fitcircle[:,2], 'k--', lw=2, label='Fitting circle')
-ax[3].legend()
-
-plt.show()
-
-print('Fitting plane: n = %s' % np.array_str(normal, precision=4))
-print('Fitting circle: center = %s, r = %.4f' % (np.array_str(C, precision=4), r))
-
-latitude = np.degrees(np.arctan2(-normal[2], (normal[0]**2. + normal[1]**2.)**0.5))
-longitude = np.degrees(np.arctan2(-normal[1], -normal[0]))
-print('Circle would be horizontal at:   Latitude: %.2f   Longitude: %.2f'%(latitude,longitude))
-
-#-------------------------------------------------------------------------------
-# Plot 3D
-#-------------------------------------------------------------------------------
-
-fig = plt.figure(figsize=(16,10))
-ax = fig.add_subplot(1,1,1,projection='3d')
-ax.plot(*P.T, ls='', marker='o', alpha=0.3, label='Points')
-
-#--- Plot fitting plane
-xx, yy = np.meshgrid(np.linspace(min_xlim,max_xlim,11.), np.linspace(min_ylim,max_ylim,11.))
-zz = (-normal[0]*xx - normal[1]*yy - d) / normal[2]
-ax.plot_surface(xx, yy, zz, rstride=2, cstride=2, color='y' ,alpha=0.2, shade=False)
-
-#--- Plot fitting circle
-ax.plot(*P_fitcircle.T, color='k', ls='--', lw=2, label='Fitting circle')
-ax.set_xlabel('X')
-ax.set_ylabel('Y')
-ax.set_zlabel('Z')
-ax.legend()
-rad = 'Circle Radius %.3fm'%r
-plt.title(rad)
-ax.get_xaxis().get_major_formatter().set_useOffset(False)
-ax.get_yaxis().get_major_formatter().set_useOffset(False)
-ax.zaxis.major.formatter.set_useOffset(False)
-for tick in ax.get_xticklabels(): tick.set_fontsize(10)
-for tick in ax.get_yticklabels(): tick.set_fontsize(10)
-for tick in ax.get_zticklabels(): tick.set_fontsize(10)
-
-ax.set_xlim3d(min_xlim,max_xlim)
-ax.set_ylim3d(min_ylim,max_ylim)
-ax.set_zlim3d(min_zlim,max_zlim)
-
-plt.show()
-
-#---------------------------------------------------------------------------------
-# Calculate and plot minimum distances between data points and the fitting circle
-#---------------------------------------------------------------------------------
-print('Calculating minimum distances... (This could take a while!)')
-min_dists = []
-for point in P:
-    min_dist = 1000.
-    for fits in P_fitcircle:
-        dist = ((fits[0] - point[0])**2. + (fits[1] - point[1])**2. + (fits[2] - point[2])**2.)**0.5
-        if dist < min_dist: min_dist = dist
-    min_dists.append(min_dist)
-plt.hist(min_dists,'auto')
-plt.xlabel('Distance (m)')
-plt.ylabel('Frequency')
-plt.title('Minimum distances from data points to fitting circle')
-plt.grid(True)
-plt.show()
-
-mean_dist = np.mean(min_dists)
-std_dist = np.std(min_dists)
-print('Minimum distances from data points to fitting circle (m):   Mean %.4f   Std Dev %.4f'%(mean_dist,std_dist))
-
-
-
+def load_points(filename, q=(1,)):
+    ''' Positions (n, 3) and standard deviations (n, 3, or None) from a .csv, .npy, .parquet or .pos file '''
+    if filename[-4:] == '.pos':
+        header, solutions = POS_to_CSV.read_pos(filename, q)
+        if header['coordinates'] != 'xyz':
+            raise Exception(filename + ' does not contain ECEF positions')
+        P = np.column_stack((solutions['x'], solutions['y'], solutions['z']))
+        sd = np.column_stack((solutions['sdx'], solutions['sdy'], solutions['sdz'])).astype(np.float64)
+        return P, sd
+    return POS_to_CSV.load_positions(filename), POS_to_CSV.load_deviations(filename)
+
+# Latitude and longitude at which the circle would be horizontal
+def horizontal_at(normal):
+    latitude = np.degrees(np.arctan2(-normal[2], (normal[0]**2. + normal[1]**2.)**0.5))
+    longitude = np.degrees(np.arctan2(-normal[1], -normal[0]))
+    return latitude, longitude
+
+def summarise(filename, P, fit, seconds):
+    ''' Summary table row (a dict with SUMMARY_FIELDS) for a fit '''
+    dists = np.hypot(fit.radial, fit.normal_residual)[fit.inliers]
+    latitude, longitude = horizontal_at(fit.normal)
+    return {'filename': filename, 'points': len(P), 'inliers': int(np.count_nonzero(fit.inliers)),
+            'x': fit.center[0], 'y': fit.center[1], 'z': fit.center[2], 'radius': fit.radius,
+            'nx': fit.normal[0], 'ny': fit.normal[1], 'nz': fit.normal[2],
+            'x_se': fit.center_se[0], 'y_se': fit.center_se[1], 'z_se': fit.center_se[2],
+            'radius_se': fit.radius_se, 'tilt_se': fit.tilt_se, 'latitude': latitude, 'longitude': longitude,
+            'center_lat': fit.center_geodetic[0], 'center_lon': fit.center_geodetic[1],
+            'center_height': fit.center_geodetic[2], 'east_se': fit.center_enu_se[0],
+            'north_se': fit.center_enu_se[1], 'up_se': fit.center_enu_se[2], 'tilt': fit.tilt,
+            'mean_dist': np.mean(dists), 'std_dist': np.std(dists),
+            'rms_radial': np.sqrt(np.mean(fit.radial[fit.inliers]**2.)),
+            'rms_normal': np.sqrt(np.mean(fit.normal_residual[fit.inliers]**2.)),
+            'max_dist': np.max(dists), 'iterations': fit.iterations, 'converged': fit.converged,
+            'seconds': seconds, 'error': ''}
+
+def fit_file(filename, robust=None, threshold=0.05, q=(1,), plots=None, show=False, max_points=MAX_PLOT_POINTS,
+             lod='hexbin'):
+    ''' Fit a circle to the points in filename. Plots are saved in the directory plots (if not None)
+    and / or shown (see plot_fit). Returns (summary row, CircleFit) '''
+    start = time.perf_counter()
+    P, sd = load_points(filename, q)
+    fit = fit_circle(P, sd=sd, robust=robust, threshold=threshold)
+    row = summarise(filename, P, fit, time.perf_counter() - start)
+    if plots is not None or show:
+        stem = None
+        if plots is not None:
+            stem = os.path.join(plots, os.path.splitext(os.path.basename(filename))[0])
+        plot_fit(P, fit, stem, show, max_points, lod)
+    return row, fit
+
+# fit_file for the process pool: errors go in the summary instead of stopping the run
+def fit_task(task):
+    filename, robust, threshold, q, plots, max_points, lod = task
+    try:
+        return fit_file(filename, robust, threshold, q, plots, False, max_points, lod)[0]
+    except Exception as e:
+        row = dict.fromkeys(SUMMARY_FIELDS, '')
+        row['filename'] = filename
+        row['error'] = str(e)
+        return row
+
+def fit_files(filenames, processes=None, robust=None, threshold=0.05, q=(1,), plots=None, max_points=MAX_PLOT_POINTS,
+              lod='hexbin'):
+    ''' Fit circles to all the files, in parallel. Returns the summary rows, in the order of filenames '''
+    tasks = [(filename, robust, threshold, q, plots, max_points, lod) for filename in filenames]
+    if processes == 1 or len(tasks) == 1:
+        return [fit_task(task) for task in tasks]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(fit_task, tasks))
+
+# Files with EXTENSIONS in the directories (not recursive) plus the other names as given
+def expand_filenames(names):
+    filenames = []
+    for name in names:
+        if os.path.isdir(name):
+            filenames += sorted(os.path.join(name, afile) for afile in os.listdir(name)
+                                if os.path.splitext(afile)[1] in EXTENSIONS)
+        else:
+            filenames.append(name)
+    return filenames
+
+def write_summary(filename, rows):
+    with open(filename, 'w', newline='') as fo:
+        output = csv.DictWriter(fo, fieldnames=SUMMARY_FIELDS)
+        output.writeheader()
+        output.writerows(rows)
+
+def print_summary(rows):
+    print('%-32s %8s %14s %14s %14s %9s %9s %9s %8s %8s %8s %8s'%('File', 'Points', 'X', 'Y', 'Z', 'Radius',
+                                                                'Latitude', 'Longitude', 'Tilt', 'Mean', 'Std Dev', 'Seconds'))
+    for row in rows:
+        name = os.path.basename(row['filename'])[-32:]
+        if row['error'] != '':
+            print('%-32s %s'%(name, row['error']))
+        else:
+            print('%-32s %8i %14.4f %14.4f %14.4f %9.4f %9.2f %9.2f %8.3f %8.4f %8.4f %8.2f'%(name, row['points'],
+                  row['x'], row['y'], row['z'], row['radius'], row['latitude'], row['longitude'], row['tilt'],
+                  row['mean_dist'], row['std_dist'], row['seconds']))
+
+# Indices of about budget points, the same number from each of bins angle ranges (chosen at random within each)
+def stratified_sample(angles, budget, bins=360, seed=1):
+    if len(angles) <= budget:
+        return np.arange(len(angles))
+    strata = np.minimum(((angles + np.pi) * (bins / (2.*np.pi))).astype(np.int64), bins - 1)
+    order = np.random.default_rng(seed).permutation(len(angles))
+    order = order[np.argsort(strata[order], kind='stable')]
+    counts = np.bincount(strata, minlength=bins)
+    rank = np.arange(len(angles)) - np.repeat(np.cumsum(counts) - counts, counts)
+    # Sparse strata keep all their points; the rest of the budget is shared by the others
+    quota = max(budget // bins, 1)
+    for i in range(8):
+        spare = budget - np.minimum(counts, quota).sum()
+        crowded = np.count_nonzero(counts > quota)
+        if spare <= 0 or crowded == 0: break
+        quota += max(spare // crowded, 1)
+    return np.sort(order[rank < np.minimum(counts, quota)[strata[order]]])
+
+def plot_fit(P, fit, stem=None, show=False, max_points=MAX_PLOT_POINTS, lod='hexbin'):
+    ''' Draw the 2D, 3D and distance plots. Saves them as stem_2d.png, stem_3d.png and stem_distances.png
+    if stem is not None (with the Agg backend unless show is True) and shows them if show is True.
+    With more than max_points points, the 2D views are density plots (lod='hexbin') or show a sample
+    stratified by angle (lod='decimate'); the 3D view always shows the sample '''
+    import matplotlib
+    if not show: matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d.axes3d import Axes3D
+
+    C = fit.center
+    r = fit.radius
+    normal = fit.normal
+    d = -np.dot(C, normal)  # Eq. of plane is <p,n> + d = 0
+
+    #-------------------------------------------------------------------------------
+    # Project points to coords X-Y in 2D plane
+    #-------------------------------------------------------------------------------
+    P_mean = P.mean(axis=0)
+    P_centered = P - P_mean
+    P_xy = rodrigues_rot(P_centered, normal, [0,0,1])
+    xc, yc = rodrigues_rot(C - P_mean, normal, [0,0,1])[0,:2]
+
+    #--- Generate circle points in 2D
+    xx = xc + r*COS_T
+    yy = yc + r*SIN_T
+
+    #--- Generate points for fitting circle
+    u = P[0] - C
+    P_fitcircle = generate_circle_by_vectors(CIRCLE_T, C, r, normal, u)
+
+    #--- Level of detail: the points to draw
+    sample = stratified_sample(np.arctan2(P_xy[:,1] - yc, P_xy[:,0] - xc), max_points)
+    density = lod == 'hexbin' and len(sample) < len(P)
+    label = 'Points' if len(sample) == len(P) else 'Points (%i of %i)'%(len(sample), len(P))
+
+    def points(ax, a, b, label):
+        if density:
+            ax.hexbin(a, b, gridsize=200, bins='log', mincnt=1, cmap='viridis')
+        else:
+            ax.scatter(a[sample], b[sample], alpha=alpha_pts, label=label)
+
+    # Save (and / or show) a figure
+    def finish(fig, suffix):
+        if stem is not None: fig.savefig(stem + suffix + '.png')
+        if show: plt.show()
+        plt.close(fig)
+
+    #-------------------------------------------------------------------------------
+    # Plot 2D
+    #-------------------------------------------------------------------------------
+
+    means = P_mean
+    min_xlim = means[0] - (r * 1.1)
+    max_xlim = means[0] + (r * 1.1)
+    min_ylim = means[1] - (r * 1.1)
+    max_ylim = means[1] + (r * 1.1)
+    min_zlim = means[2] - (r * 1.1)
+    max_zlim = means[2] + (r * 1.1)
+
+    fig = plt.figure(figsize=(16,11))
+    alpha_pts = 0.2
+    figshape = (2,3)
+    ax = [None]*4
+    ax[0] = plt.subplot2grid(figshape, loc=(0,0), colspan=2)
+    ax[1] = plt.subplot2grid(figshape, loc=(1,0))
+    ax[2] = plt.subplot2grid(figshape, loc=(1,1))
+    ax[3] = plt.subplot2grid(figshape, loc=(1,2))
+    i = 0
+    ax[i].set_title('Fitting circle in 2D coords projected onto fitting plane')
+    ax[i].set_xlabel('x'); ax[i].set_ylabel('y');
+    ax[i].set_aspect('equal', 'datalim'); ax[i].margins(.1, .1)
+    ax[i].grid()
+    ax[i].get_xaxis().get_major_formatter().set_useOffset(False)
+    ax[i].get_yaxis().get_major_formatter().set_useOffset(False)
+    for tick in ax[i].get_xticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
+    for tick in ax[i].get_yticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
+    i = 1
+    points(ax[i], P[:,0], P[:,1], label)
+    ax[i].set_title('View X-Y')
+    ax[i].set_xlabel('x'); ax[i].set_ylabel('y');
+    ax[i].set(xlim=[min_xlim,max_xlim],ylim=[min_ylim,max_ylim],aspect=1)
+    ax[i].grid()
+    ax[i].get_xaxis().get_major_formatter().set_useOffset(False)
+    ax[i].get_yaxis().get_major_formatter().set_useOffset(False)
+    for tick in ax[i].get_xticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
+    for tick in ax[i].get_yticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
+    i = 2
+    points(ax[i], P[:,0], P[:,2], label)
+    ax[i].set_title('View X-Z')
+    ax[i].set_xlabel('x'); ax[i].set_ylabel('z');
+    ax[i].set(xlim=[min_xlim,max_xlim],ylim=[min_zlim,max_zlim],aspect=1)
+    ax[i].grid()
+    ax[i].get_xaxis().get_major_formatter().set_useOffset(False)
+    ax[i].get_yaxis().get_major_formatter().set_useOffset(False)
+    for tick in ax[i].get_xticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
+    for tick in ax[i].get_yticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
+    i = 3
+    points(ax[i], P[:,1], P[:,2], label)
+    ax[i].set_title('View Y-Z')
+    ax[i].set_xlabel('y'); ax[i].set_ylabel('z');
+    ax[i].set(xlim=[min_ylim,max_ylim],ylim=[min_zlim,max_zlim],aspect=1)
+    ax[i].grid()
+    ax[i].get_xaxis().get_major_formatter().set_useOffset(False)
+    ax[i].get_yaxis().get_major_formatter().set_useOffset(False)
+    for tick in ax[i].get_xticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
+    for tick in ax[i].get_yticklabels(): tick.set_rotation(45); tick.set_fontsize(10)
+
+    points(ax[0], P_xy[:,0], P_xy[:,1], 'Projected ' + label[0].lower() + label[1:])
+
+    ax[0].plot(xx, yy, 'k--', lw=2, label='Fitting circle')
+    ax[0].plot(xc, yc, 'k+', ms=10)
+    ax[0].legend()
+
+    ax[1].plot(P_fitcircle[:,0], P_fitcircle[:,1], 'k--', lw=2, label='Fitting circle')
+    ax[2].plot(P_fitcircle[:,0], P_fitcircle[:,2], 'k--', lw=2, label='Fitting circle')
+    ax[3].plot(P_fitcircle[:,1], P_fitcircle[:,2], 'k--', lw=2, label='Fitting circle')
+    ax[3].legend()
+
+    finish(fig, '_2d')
+
+    #-------------------------------------------------------------------------------
+    # Plot 3D
+    #-------------------------------------------------------------------------------
+
+    fig = plt.figure(figsize=(16,10))
+    ax = fig.add_subplot(1,1,1,projection='3d')
+    ax.plot(*P[sample].T, ls='', marker='o', alpha=0.3, label=label)
+
+    #--- Plot fitting plane
+    xx = means[0] + (r * 1.1)*MESH_U
+    yy = means[1] + (r * 1.1)*MESH_V
+    zz = (-normal[0]*xx - normal[1]*yy - d) / normal[2]
+    ax.plot_surface(xx, yy, zz, rstride=2, cstride=2, color='y' ,alpha=0.2, shade=False)
+
+    #--- Plot fitting circle
+    ax.plot(*P_fitcircle.T, color='k', ls='--', lw=2, label='Fitting circle')
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.set_zlabel('Z')
+    ax.legend()
+    rad = 'Circle Radius %.3fm'%r
+    plt.title(rad)
+    ax.get_xaxis().get_major_formatter().set_useOffset(False)
+    ax.get_yaxis().get_major_formatter().set_useOffset(False)
+    ax.zaxis.major.formatter.set_useOffset(False)
+    for tick in ax.get_xticklabels(): tick.set_fontsize(10)
+    for tick in ax.get_yticklabels(): tick.set_fontsize(10)
+    for tick in ax.get_zticklabels(): tick.set_fontsize(10)
+
+    ax.set_xlim3d(min_xlim,max_xlim)
+    ax.set_ylim3d(min_ylim,max_ylim)
+    ax.set_zlim3d(min_zlim,max_zlim)
+
+    finish(fig, '_3d')
+
+    #---------------------------------------------------------------------------------
+    # Plot minimum distances between data points and the fitting circle
+    #---------------------------------------------------------------------------------
+    fig = plt.figure()
+    plt.hist(np.hypot(fit.radial, fit.normal_residual),'auto')
+    plt.xlabel('Distance (m)')
+    plt.ylabel('Frequency')
+    plt.title('Minimum distances from data points to fitting circle')
+    plt.grid(True)
+    finish(fig, '_distances')
+
+def main(argv):
+    print('CSV Circle Fitting')
+
+    parser = argparse.ArgumentParser(description='Fit 3D circles to RTKLIB positions')
+    parser.add_argument('-p', type=int, default=None, metavar='PROCESSES', help='number of processes (default: one per CPU)')
+    parser.add_argument('-r', default=None, choices=('huber', 'ransac'), help='outlier rejection')
+    parser.add_argument('-t', type=float, default=0.05, metavar='THRESHOLD', help='RANSAC inlier distance in m (default: 0.05)')
+    parser.add_argument('-q', default='1', metavar='Q[,Q...]', help='Q values to use from .pos files (default: 1)')
+    parser.add_argument('-o', default=None, metavar='SUMMARY', help='save the summary table as a .csv file')
+    parser.add_argument('--plots', default=None, metavar='DIRECTORY', help='save the plots as .png files in DIRECTORY')
+    parser.add_argument('--show', action='store_true', help='show the plots (one file at a time)')
+    parser.add_argument('--max-points', type=int, default=MAX_PLOT_POINTS, metavar='N',
+                        help='point budget for each plot (default: %i)'%MAX_PLOT_POINTS)
+    parser.add_argument('--lod', default='hexbin', choices=LOD_MODES,
+                        help='above the budget, draw density plots (hexbin, default) or a sample of the points (decimate)')
+    parser.add_argument('filenames', nargs='*')
+    args = parser.parse_args(argv[1:])
+    q = [int(value) for value in args.q.split(',')]
+
+    filenames = expand_filenames(args.filenames)
+    show = args.show
+    if len(args.filenames) == 0:
+        firstfile = ''
+        for root, dirs, files in os.walk("."):
+            if len(files) > 0:
+                if root == ".":
+                    for afile in files:
+                        if afile[-4:] == '.csv' or afile[-4:] == '.npy':
+                            if firstfile == '': firstfile = afile
+
+        filename = input('Enter the .csv filename (default: ' + firstfile + '): ') # Get the filename
+        if filename == '': filename = firstfile
+        filenames = [filename]
+        show = True
+
+    if args.plots is not None: os.makedirs(args.plots, exist_ok=True)
+
+    start = time.perf_counter()
+    if show:
+        # Plots in windows: one file at a time, in this process
+        rows = []
+        for filename in filenames:
+            print('Processing %s'%filename)
+            row, fit = fit_file(filename, args.r, args.t, q, args.plots, True, args.max_points, args.lod)
+            print(fit)
+            rows.append(row)
+    else:
+        rows = fit_files(filenames, args.p, args.r, args.t, q, args.plots, args.max_points, args.lod)
+    elapsed = time.perf_counter() - start
+
+    print_summary(rows)
+    if args.o is not None:
+        write_summary(args.o, rows)
+        print('Saved', args.o)
+    print('Fitted %i files in %.2f s'%(len(rows), elapsed))
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
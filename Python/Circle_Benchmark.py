@@ -0,0 +1,130 @@
+# Benchmarks the Circle_Fitting.py functions used by CSV_Circle_Fitting.py
+# (rotation and point to circle distance) against the original per-point loops
+# and times the streaming fit, on synthetic circles of 10k, 100k and 1M points
+
+# Usage: python Circle_Benchmark.py [max_points]
+
+import sys
+import time
+
+import numpy as np
+
+import Circle_Fitting
+
+# The original rodrigues_rot: np.cross and np.dot for every point
+def rodrigues_rot_loop(P, n0, n1):
+    if P.ndim == 1:
+        P = P[np.newaxis,:]
+    n0 = n0/np.linalg.norm(n0)
+    n1 = n1/np.linalg.norm(n1)
+    k = np.cross(n0,n1)
+    k = k/np.linalg.norm(k)
+    theta = np.arccos(np.dot(n0,n1))
+    P_rot = np.zeros((len(P),3))
+    for i in range(len(P)):
+        P_rot[i] = P[i]*np.cos(theta) + np.cross(k,P[i])*np.sin(theta) + k*np.dot(k,P[i])*(1-np.cos(theta))
+    return P_rot
+
+# The original minimum distance: every point against all 3600 points sampled on the fitting circle
+def min_distances_loop(P, P_fitcircle):
+    min_dists = []
+    for point in P:
+        min_dist = 1000.
+        for fits in P_fitcircle:
+            dist = ((fits[0] - point[0])**2. + (fits[1] - point[1])**2. + (fits[2] - point[2])**2.)**0.5
+            if dist < min_dist: min_dist = dist
+        min_dists.append(min_dist)
+    return np.array(min_dists)
+
+# num_points on a circle of radius r (m) with normal n, plus noise (m)
+def synthetic_circle(num_points, r=1.5, n=(0.3, -0.5, 0.8), noise=0.005, seed=1):
+    rng = np.random.default_rng(seed)
+    n = np.asarray(n)/np.linalg.norm(n)
+    t = rng.uniform(0., 2.*np.pi, num_points)
+    u = np.cross(n, np.eye(3)[np.argmin(np.abs(n))]) # Any vector perpendicular to n
+    u = u/np.linalg.norm(u)
+    P = Circle_Fitting.generate_circle_by_vectors(t, np.zeros(3), r, n, u)
+    return P + rng.normal(0., noise, P.shape)
+
+def main(argv):
+    print('Circle Fitting Benchmark')
+    print('(Max differences: rotation vs the loop, exact distance vs the 3600-sample brute force)')
+
+    max_points = 1000000
+    if len(argv) > 1: max_points = int(argv[1])
+    loop_limit = 100000 # The loop takes ~10 us per point, so it is only timed on (up to) this many points
+
+    normal = np.array([0.3, -0.5, 0.8])
+    z = np.array([0., 0., 1.])
+
+    num_points = 10000
+    while num_points <= max_points:
+        P = synthetic_circle(num_points)
+
+        start = time.perf_counter()
+        P_xy = Circle_Fitting.rodrigues_rot(P, normal, z)
+        rot_time = time.perf_counter() - start
+
+        timed = min(num_points, loop_limit)
+        start = time.perf_counter()
+        P_loop = rodrigues_rot_loop(P[:timed], normal, z)
+        loop_time = (time.perf_counter() - start) * num_points / timed
+        error = np.abs(P_xy[:timed] - P_loop).max()
+
+        start = time.perf_counter()
+        dists = Circle_Fitting.circle_distances(P, np.zeros(3), 1.5, normal)
+        dist_time = time.perf_counter() - start
+
+        # ~5 ms per point, so the brute force is only timed on 200 points
+        brute_timed = min(num_points, 200)
+        P_fitcircle = Circle_Fitting.generate_circle_by_vectors(np.linspace(0, 2.*np.pi, 3600), np.zeros(3), 1.5,
+                                                                normal, np.cross(normal, z))
+        start = time.perf_counter()
+        dists_loop = min_distances_loop(P[:brute_timed], P_fitcircle)
+        brute_time = (time.perf_counter() - start) * num_points / brute_timed
+        # The brute force is only as good as the 2.6 mm spacing of the samples on the circle
+        dist_error = np.abs(dists[:brute_timed] - dists_loop).max()
+
+        print('Rodrigues rotation %8i points: loop %8.3f s%s, matrix %8.4f s, speedup %6.0fx, max difference %.1e m'%(
+            num_points, loop_time, ' (estimated)' if timed < num_points else '            ', rot_time,
+            loop_time / max(rot_time, 1e-9), error))
+        print('Circle distances   %8i points: brute %8.1f s (estimated), exact  %8.4f s, speedup %6.0fx, max difference %.1e m'%(
+            num_points, brute_time, dist_time, brute_time / max(dist_time, 1e-9), dist_error))
+        num_points *= 10
+
+    # The normal is already parallel to z: the original k is 0/0 = NaN
+    P = synthetic_circle(1000, n=z)
+    with np.errstate(invalid='ignore'):
+        nan_loop = np.isnan(rodrigues_rot_loop(P, z, z)).any()
+    same = np.array_equal(Circle_Fitting.rodrigues_rot(P, z, z), P)
+    flipped = np.allclose(Circle_Fitting.rodrigues_rot(P, -z, z)[:,2], -P[:,2])
+    print('Normal parallel to z: loop gives NaN: %s, matrix gives the points unchanged: %s, normal = -z flips z: %s'%(
+        nan_loop, same, flipped))
+
+    # Streaming fit: cost per point and agreement with the batch algebraic fit
+    P = synthetic_circle(100000)
+    stream = Circle_Fitting.StreamingCircleFit()
+    start = time.perf_counter()
+    for p in P: stream.add(p)
+    add_time = (time.perf_counter() - start) / len(P)
+    start = time.perf_counter()
+    C, r, n = stream.circle()
+    circle_time = time.perf_counter() - start
+    C_batch, r_batch, n_batch = Circle_Fitting.fit_circle_3d(P)
+    print('Streaming fit: %.1f us per point, %.1f us per circle(), center differs from fit_circle_3d by %.1e m'%(
+        add_time * 1e6, circle_time * 1e6, np.abs(C - C_batch).max()))
+
+    # Sliding window: the center moves 5 cm along the normal half way through
+    P[len(P)//2:] += 0.05 * normal / np.linalg.norm(normal)
+    sliding = Circle_Fitting.SlidingCircleFit(2000)
+    for i, p in enumerate(P):
+        sliding.add(p)
+        if (i + 1) % (len(P)//8) == 0:
+            C, r, n = sliding.circle()
+            print('Sliding window (2000 points) at point %6i: center offset along the normal %7.4f m, radius %.4f m'%(
+                i + 1, np.dot(C, normal) / np.linalg.norm(normal), r))
+
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,685 @@
+# -*- coding: utf-8 -*-
+
+# 3D circle fitting functions used by CSV_Circle_Fitting.py
+# Only numpy is needed, so these can be used (and benchmarked) without matplotlib
+
+# This code is based extensively on work by Miki at Meshlogic
+# https://meshlogic.github.io/posts/jupyter/curve-fitting/fitting-a-circle-to-cluster-of-3d-points/
+
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# Generate points on circle
+# P(t) = r*cos(t)*u + r*sin(t)*(n x u) + C
+#-------------------------------------------------------------------------------
+def generate_circle_by_vectors(t, C, r, n, u):
+    n = n/np.linalg.norm(n)
+    u = u/np.linalg.norm(u)
+    P_circle = r*np.cos(t)[:,np.newaxis]*u + r*np.sin(t)[:,np.newaxis]*np.cross(n,u) + C
+    return P_circle
+
+def generate_circle_by_angles(t, C, r, theta, phi):
+    # Orthonormal vectors n, u, <n,u>=0
+    n = np.array([np.cos(phi)*np.sin(theta), np.sin(phi)*np.sin(theta), np.cos(theta)])
+    u = np.array([-np.sin(phi), np.cos(phi), 0.])
+    
+    # P(t) = r*cos(t)*u + r*sin(t)*(n x u) + C
+    P_circle = r*np.cos(t)[:,np.newaxis]*u + r*np.sin(t)[:,np.newaxis]*np.cross(n,u) + C
+    return P_circle
+
+#-------------------------------------------------------------------------------
+# FIT CIRCLE 2D
+# - Find center [xc, yc] and radius r of circle fitting to set of 2D points
+# - Optionally specify weights for points: each row of A and b is scaled by
+#   its weight (so w = 1/sigma; no N x N diagonal matrix is needed)
+#
+# - Implicit circle function:
+#   (x-xc)^2 + (y-yc)^2 = r^2
+#   (2*xc)*x + (2*yc)*y + (r^2-xc^2-yc^2) = x^2+y^2
+#   c[0]*x + c[1]*y + c[2] = x^2+y^2
+#
+# - Solution by method of least squares:
+#   A*c = b, c' = argmin(||A*c - b||^2)
+#   A = [x y 1], b = [x^2+y^2]
+#-------------------------------------------------------------------------------
+def fit_circle_2d(x, y, w=[]):
+    
+    A = np.array([x, y, np.ones(len(x))]).T
+    b = (x**2.) + (y**2.)
+    
+    # Modify A,b for weighted least squares
+    if len(w) == len(x):
+        w = np.asarray(w, dtype=np.float64)
+        A = A*w[:,np.newaxis]
+        b = b*w
+    
+    # Solve by method of least squares
+    c = np.linalg.lstsq(A,b,rcond=None)[0]
+    
+    # Get circle parameters from solution c
+    xc = c[0]/2.
+    yc = c[1]/2.
+    r = np.sqrt(c[2] + (xc**2.) + (yc**2.))
+    return xc, yc, r
+
+#-------------------------------------------------------------------------------
+# RODRIGUES ROTATION
+# - Rotate given points based on a starting and ending vector
+# - Axis k and angle of rotation theta given by vectors n0,n1
+#   P_rot = P*cos(theta) + (k x P)*sin(theta) + k*<k,P>*(1-cos(theta))
+# - As a matrix: R = I + sin(theta)*K + (1-cos(theta))*K^2, K = [k]x
+#   so all the points are rotated with one matrix multiply: P_rot = P R^T
+#-------------------------------------------------------------------------------
+def rotation_matrix(n0, n1):
+    
+    n0 = np.asarray(n0, dtype=np.float64)
+    n1 = np.asarray(n1, dtype=np.float64)
+    n0 = n0/np.linalg.norm(n0)
+    n1 = n1/np.linalg.norm(n1)
+    v = np.cross(n0,n1) # = k*sin(theta)
+    s = np.linalg.norm(v)
+    c = np.dot(n0,n1)   # = cos(theta)
+    
+    # n0 and n1 parallel: k is undefined (0/0). Same direction: nothing to do.
+    # Opposite directions: rotate by pi about any axis perpendicular to n0
+    if s < 1e-12:
+        if c > 0:
+            return np.eye(3)
+        k = np.cross(n0, np.eye(3)[np.argmin(np.abs(n0))])
+        k = k/np.linalg.norm(k)
+        return 2.*np.outer(k,k) - np.eye(3)
+    
+    k = v/s
+    K = np.array([[0., -k[2], k[1]], [k[2], 0., -k[0]], [-k[1], k[0], 0.]])
+    return np.eye(3) + s*K + (1.-c)*np.dot(K,K)
+
+def rodrigues_rot(P, n0, n1):
+    
+    # If P is only 1d array (coords of single point), fix it to be matrix
+    P = np.asarray(P, dtype=np.float64)
+    if P.ndim == 1:
+        P = P[np.newaxis,:]
+    
+    return np.dot(P, rotation_matrix(n0,n1).T)
+
+#-------------------------------------------------------------------------------
+# ANGLE BETWEEN
+# - Get angle between vectors u,v with sign based on plane with unit normal n
+#-------------------------------------------------------------------------------
+def angle_between(u, v, n=None):
+    if n is None:
+        return np.arctan2(np.linalg.norm(np.cross(u,v)), np.dot(u,v))
+    else:
+        return np.arctan2(np.dot(n,np.cross(u,v)), np.dot(u,v))
+
+#-------------------------------------------------------------------------------
+# DISTANCE TO CIRCLE
+# - Exact distances from points P to the circle with center C, radius r
+#   in the plane with normal n
+# - Split D = P - C into its component along n (h = <D,n>) and in the plane
+#   (rho = sqrt(|D|^2 - h^2)). The nearest point on the circle is in the direction
+#   of the in-plane component, so:
+#   radial residual = rho - r (positive outside the circle)
+#   normal residual = h (positive on the side n points to)
+#   distance = sqrt(radial^2 + normal^2)
+#-------------------------------------------------------------------------------
+def circle_residuals(P, C, r, n):
+    
+    P = np.asarray(P, dtype=np.float64)
+    if P.ndim == 1:
+        P = P[np.newaxis,:]
+    n = np.asarray(n, dtype=np.float64)
+    n = n/np.linalg.norm(n)
+    
+    D = P - C
+    h = np.dot(D, n)
+    rho = np.sqrt(np.maximum(np.einsum('ij,ij->i', D, D) - (h**2.), 0.))
+    return rho - r, h
+
+def circle_distances(P, C, r, n):
+    radial, normal = circle_residuals(P, C, r, n)
+    return np.hypot(radial, normal)
+
+#-------------------------------------------------------------------------------
+# PRINCIPAL AXES
+# - SVD of the (weighted) mean-centered data: the rows of V^T are the
+#   directions of most to least spread (line direction ... plane normal)
+# - Optional weights w are inverse variances (one per point)
+#-------------------------------------------------------------------------------
+def principal_axes(P, w=None):
+    ''' Returns the (weighted) mean of the points P, P - mean, the axes (rows, most spread first)
+    and the singular values '''
+    P = np.asarray(P, dtype=np.float64)
+    if w is None:
+        w = np.ones(len(P))
+    P_mean = np.dot(w, P) / np.sum(w)
+    P_centered = P - P_mean
+    U,s,V = np.linalg.svd(P_centered*np.sqrt(w)[:,np.newaxis], full_matrices=False) # The full U would be n x n
+    return P_mean, P_centered, V, s
+
+#-------------------------------------------------------------------------------
+# FIT CIRCLE 3D (algebraic)
+# - Fitting plane by SVD for the (weighted) mean-centered data
+#   Normal vector of fitting plane is given by 3rd row of V^T
+# - Project points to coords X-Y in 2D plane, fit circle in 2D,
+#   transform circle center back to 3D coords
+# - Optional weights w are inverse variances (one per point)
+#-------------------------------------------------------------------------------
+def fit_circle_3d(P, w=None):
+    
+    if w is None:
+        w = np.ones(len(P))
+    P_mean, P_centered, V, s = principal_axes(P, w)
+    return circle_in_plane(P_mean, P_centered, V[2,:], w)
+
+# The algebraic circle in the plane through P_mean with the given normal (from principal_axes)
+def circle_in_plane(P_mean, P_centered, normal, w=None):
+    
+    if w is None:
+        w = np.ones(len(P_centered))
+    P_xy = rodrigues_rot(P_centered, normal, [0,0,1])
+    xc, yc, r = fit_circle_2d(P_xy[:,0], P_xy[:,1], np.sqrt(w))
+    C = rodrigues_rot(np.array([xc,yc,0]), [0,0,1], normal).flatten() + P_mean
+    return C, r, normal
+
+#-------------------------------------------------------------------------------
+# GEOMETRIC (LEVENBERG-MARQUARDT) REFINEMENT
+# - Minimises sum(w_radial*radial^2 + w_normal*normal^2) over the center C,
+#   the radius r and the normal n (see circle_residuals)
+# - The normal is updated as n' = (n + a*u + b*v)/|...| where u,v are
+#   perpendicular to n, so there is no singularity at any orientation
+# - Jacobians, with D = P - C, e = in-plane unit vector of D, rho = |in-plane D|:
+#   d(radial)/dC = -e   d(radial)/dr = -1   d(radial)/d(a,b) = -h*<D,(u,v)>/rho
+#   d(normal)/dC = -n   d(normal)/dr = 0    d(normal)/d(a,b) = <D,(u,v)>
+# - Standard deviations sd (sdx, sdy, sdz for each point) give the residual
+#   variances: sum((e*sd)^2) for the radial and sum((n*sd)^2) for the normal
+#   (or e^T S e and n^T S n for (n, 3, 3) covariances S)
+#-------------------------------------------------------------------------------
+HUBER_K = 1.345 # Huber tuning constant (95% efficiency for Gaussian residuals)
+MAD_SCALE = 1.4826 # Median absolute deviation to standard deviation
+
+# Unit vectors u, v perpendicular to the unit vector n (and to each other)
+def plane_basis(n):
+    u = np.cross(n, np.eye(3)[np.argmin(np.abs(n))])
+    u = u/np.linalg.norm(u)
+    return u, np.cross(n,u)
+
+# Residuals and their weights for the circle C, r, n. pw are the point weights
+def weighted_residuals(P, C, r, n, sd, pw):
+    D = P - C
+    h = np.dot(D, n)
+    rho = np.sqrt(np.maximum(np.einsum('ij,ij->i', D, D) - (h**2.), 1e-30))
+    radial = rho - r
+    if sd is None:
+        w_radial = pw
+        w_normal = pw
+    else:
+        e = (D - h[:,np.newaxis]*n) / rho[:,np.newaxis]
+        if sd.ndim == 3: # Covariances
+            w_radial = pw / np.einsum('ij,ijk,ik->i', e, sd, e)
+            w_normal = pw / np.einsum('j,ijk,k->i', n, sd, n)
+        else:
+            w_radial = pw / np.einsum('ij,ij->i', e**2., sd**2.)
+            w_normal = pw / np.dot(sd**2., n**2.)
+    cost = np.dot(w_radial, radial**2.) + np.dot(w_normal, h**2.)
+    return D, h, rho, radial, w_radial, w_normal, cost
+
+# J^T W J, J^T W residuals and the cost for the circle C, r, n, plus the u, v used for the normal
+def normal_equations(P, C, r, n, sd, pw):
+    D, h, rho, radial, w_radial, w_normal, cost = weighted_residuals(P, C, r, n, sd, pw)
+    u, v = plane_basis(n)
+    Du = np.dot(D, u)
+    Dv = np.dot(D, v)
+    J_radial = np.empty((len(P), 6))
+    J_radial[:,:3] = -(D - h[:,np.newaxis]*n) / rho[:,np.newaxis]
+    J_radial[:,3] = -1.
+    J_radial[:,4] = -h*Du/rho
+    J_radial[:,5] = -h*Dv/rho
+    J_normal = np.zeros((len(P), 6))
+    J_normal[:,:3] = -n
+    J_normal[:,4] = Du
+    J_normal[:,5] = Dv
+    JtWJ = np.dot(J_radial.T*w_radial, J_radial) + np.dot(J_normal.T*w_normal, J_normal)
+    g = np.dot(J_radial.T, w_radial*radial) + np.dot(J_normal.T, w_normal*h)
+    return JtWJ, g, cost, u, v
+
+def refine_circle(P, C, r, n, sd=None, pw=None, max_iterations=100, tolerance=1e-12):
+    ''' Levenberg-Marquardt refinement of the circle C, r, n. Returns C, r, n, J^T W J at the solution,
+    the cost, the number of iterations and whether it converged '''
+    if pw is None:
+        pw = np.ones(len(P))
+    n = n/np.linalg.norm(n)
+    JtWJ, g, cost, u, v = normal_equations(P, C, r, n, sd, pw)
+    lam = 1e-3
+    for iteration in range(1, max_iterations + 1):
+        # Increase the damping until the cost goes down
+        while True:
+            step = np.linalg.solve(JtWJ + lam*np.diag(np.diag(JtWJ)) + 1e-30*np.eye(6), -g)
+            n_new = n + step[4]*u + step[5]*v
+            n_new = n_new/np.linalg.norm(n_new)
+            new_cost = weighted_residuals(P, C + step[:3], r + step[3], n_new, sd, pw)[6]
+            if new_cost <= cost or lam > 1e10:
+                break
+            lam *= 10.
+        if new_cost > cost:
+            return C, r, n, JtWJ, cost, iteration, True # No step reduces the cost: at the minimum (to rounding)
+        decrease = cost - new_cost
+        C, r, n = C + step[:3], r + step[3], n_new
+        JtWJ, g, cost, u, v = normal_equations(P, C, r, n, sd, pw)
+        lam = max(lam/10., 1e-12)
+        if decrease <= tolerance*max(cost, 1e-300) or np.max(np.abs(step)) < 1e-12:
+            return C, r, n, JtWJ, cost, iteration, True
+    return C, r, n, JtWJ, cost, max_iterations, False
+
+#-------------------------------------------------------------------------------
+# RANSAC
+# - Circles through random triples of points; the one with the most points
+#   within threshold (m) wins. The circumcenter of a, b, c is
+#   C = a + (|ac|^2*(n x ab) + |ab|^2*(ac x n)) / (2*|n|^2), n = ab x ac
+#-------------------------------------------------------------------------------
+def circles_through(a, b, c):
+    ab = b - a
+    ac = c - a
+    n = np.cross(ab, ac)
+    nn = np.einsum('ij,ij->i', n, n)
+    ok = nn > 1e-12 * np.einsum('ij,ij->i', ab, ab) * np.einsum('ij,ij->i', ac, ac) # Not (nearly) collinear
+    nn = np.where(ok, nn, 1.)
+    C = a + (np.einsum('ij,ij->i', ac, ac)[:,np.newaxis]*np.cross(n, ab)
+             + np.einsum('ij,ij->i', ab, ab)[:,np.newaxis]*np.cross(ac, n)) / (2.*nn[:,np.newaxis])
+    r = np.linalg.norm(C - a, axis=1)
+    return C, r, n / np.sqrt(nn)[:,np.newaxis], ok
+
+def ransac_circle(P, threshold, iterations=200, sample=5000, rng=None):
+    ''' Best of iterations 3-point circles, scored on (up to) sample points. Returns C, r, n '''
+    if rng is None:
+        rng = np.random.default_rng(1)
+    triples = np.array([rng.choice(len(P), 3, replace=False) for i in range(iterations)])
+    C, r, n, ok = circles_through(P[triples[:,0]], P[triples[:,1]], P[triples[:,2]])
+    S = P[rng.choice(len(P), min(sample, len(P)), replace=False)]
+    best = -1
+    best_count = -1
+    for i in np.nonzero(ok)[0]:
+        count = np.count_nonzero(circle_distances(S, C[i], r[i], n[i]) <= threshold)
+        if count > best_count:
+            best = i
+            best_count = count
+    if best < 0:
+        raise ValueError('RANSAC: all the samples were collinear')
+    return C[best], r[best], n[best]
+
+#-------------------------------------------------------------------------------
+# LOCAL (EAST, NORTH, UP) FRAME
+# - ECEF coordinates are ~6.4e6 m, so x^2 + y^2 is ~4e13 m^2 and a float64
+#   has ~0.01 m^2 left for it: the fits are done in a local frame instead
+# - ENU of a point p: R (p - origin), with the rows of R the east, north and
+#   up unit vectors at the geodetic latitude and longitude of the origin
+#   e = (-sin(lon), cos(lon), 0)
+#   n = (-sin(lat)cos(lon), -sin(lat)sin(lon), cos(lat))
+#   u = (cos(lat)cos(lon), cos(lat)sin(lon), sin(lat))
+# - R is a rotation, so distances (and the radius) are the same in both frames
+#   and a covariance S maps to R S R^T
+# - WGS84 geodetic coordinates by Bowring's iteration: lat0 = atan2(z, p(1-e^2)),
+#   then N = a/sqrt(1-e^2 sin^2(lat)), h = p cos(lat) + z sin(lat) - a^2/N,
+#   lat = atan2(z, p(1 - e^2 N/(N+h))) (micrometres after three iterations)
+#-------------------------------------------------------------------------------
+WGS84_A = 6378137.0 # Semi-major axis (m)
+WGS84_F = 1.0 / 298.257223563 # Flattening
+WGS84_E2 = WGS84_F * (2. - WGS84_F) # First eccentricity squared
+
+def ecef_to_geodetic(P):
+    ''' WGS84 latitude (degrees), longitude (degrees) and height (m) of the ECEF points P (n, 3). Returns (n, 3) '''
+    P = np.asarray(P, dtype=np.float64)
+    if P.ndim == 1:
+        P = P[np.newaxis,:]
+    x, y, z = P[:,0], P[:,1], P[:,2]
+    p = np.hypot(x, y)
+    lat = np.arctan2(z, p*(1. - WGS84_E2))
+    for i in range(3):
+        sin_lat = np.sin(lat)
+        N = WGS84_A / np.sqrt(1. - WGS84_E2*sin_lat**2.)
+        h = p*np.cos(lat) + z*sin_lat - (WGS84_A**2.)/N
+        lat = np.arctan2(z, p*(1. - WGS84_E2*N/(N + h)))
+    sin_lat = np.sin(lat)
+    h = p*np.cos(lat) + z*sin_lat - WGS84_A*np.sqrt(1. - WGS84_E2*sin_lat**2.)
+    return np.column_stack((np.degrees(lat), np.degrees(np.arctan2(y, x)), h))
+
+def geodetic_to_ecef(llh):
+    ''' ECEF points (n, 3) of WGS84 latitudes (degrees), longitudes (degrees) and heights (m), llh (n, 3) '''
+    llh = np.asarray(llh, dtype=np.float64)
+    if llh.ndim == 1:
+        llh = llh[np.newaxis,:]
+    lat = np.radians(llh[:,0])
+    lon = np.radians(llh[:,1])
+    h = llh[:,2]
+    N = WGS84_A / np.sqrt(1. - WGS84_E2*np.sin(lat)**2.)
+    return np.column_stack(((N + h)*np.cos(lat)*np.cos(lon), (N + h)*np.cos(lat)*np.sin(lon),
+                            (N*(1. - WGS84_E2) + h)*np.sin(lat)))
+
+# Rotation from ECEF to east, north, up at latitude and longitude (degrees)
+def enu_rotation(lat, lon):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.array([[-np.sin(lon), np.cos(lon), 0.],
+                     [-np.sin(lat)*np.cos(lon), -np.sin(lat)*np.sin(lon), np.cos(lat)],
+                     [np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)]])
+
+class LocalFrame:
+    ''' East, north, up frame with its origin at the ECEF point origin (or, with enu=False,
+    just shifted to origin: the ECEF axes) '''
+    def __init__(self, origin, enu=True):
+        self.origin = np.asarray(origin, dtype=np.float64).reshape(3)
+        self.enu = enu
+        self.geodetic = ecef_to_geodetic(self.origin)[0]
+        self.R = enu_rotation(self.geodetic[0], self.geodetic[1]) if enu else np.eye(3)
+
+    def to_local(self, P):
+        return np.dot(np.asarray(P, dtype=np.float64) - self.origin, self.R.T)
+
+    def to_ecef(self, E):
+        return np.dot(E, self.R) + self.origin
+
+    def vector_to_ecef(self, v):
+        return np.dot(v, self.R)
+
+    def covariance_to_local(self, sd):
+        ''' (n, 3, 3) covariances in the local frame of ECEF standard deviations sd (n, 3) '''
+        return np.einsum('ai,ni,bi->nab', self.R, np.asarray(sd)**2., self.R)
+
+#-------------------------------------------------------------------------------
+# FIT CIRCLE
+# - Algebraic start (fit_circle_3d), then geometric refinement
+# - Done in a LocalFrame at the mean of the points (ENU by default), then the
+#   center, normal and covariance are mapped back to ECEF and the center to
+#   latitude, longitude and height
+# - Optional outlier rejection (e.g. for float solutions):
+#   'huber': iteratively reweighted; points with a normalised distance z
+#            (distance / sd, or m without sd) more than HUBER_K robust sigmas
+#            (MAD of z) out are down-weighted by HUBER_K*sigma/z
+#   'ransac': consensus of 3-point circles, then the points within threshold
+#            of the circle are refined (and re-selected until they don't change)
+#-------------------------------------------------------------------------------
+class CircleFit:
+    ''' Result of fit_circle: center, radius, unit normal (pointing away from the origin), their standard errors
+    (scaled by the variance factor cost / (2*points - 6)) and the convergence diagnostics '''
+    def __init__(self):
+        self.center = None
+        self.radius = None
+        self.normal = None
+        self.center_se = None
+        self.radius_se = None
+        self.normal_se = None
+        self.tilt_se = None # Standard error of the normal direction (radians)
+        self.covariance = None # Of center (3, ECEF), radius and the normal tilts along u and v
+        self.center_geodetic = None # Latitude (degrees), longitude (degrees), height (m)
+        self.center_enu_se = None # Standard errors of the center east, north and up
+        self.normal_enu = None # The normal in east, north, up at the center
+        self.tilt = None # Angle between the normal and up (degrees)
+        self.frame = None # The LocalFrame of the fit
+        self.radial = None # Signed residuals of every point (m)
+        self.normal_residual = None
+        self.weights = None # Final point weights (robust weights times w, 0 for RANSAC outliers)
+        self.inliers = None
+        self.method = None
+        self.iterations = 0
+        self.converged = False
+        self.cost = None
+        self.variance_factor = None
+
+    def __str__(self):
+        lines = ['Circle fit (%s): %s after %i iterations'%(self.method, 'converged' if self.converged else 'NOT converged',
+                                                          self.iterations),
+                 '  center = %s +/- %s m'%(np.array_str(self.center, precision=4), np.array_str(self.center_se, precision=4)),
+                 '  center = %.9f %.9f %.4f (lat lon height) +/- %s m (ENU)'%(self.center_geodetic[0],
+                     self.center_geodetic[1], self.center_geodetic[2], np.array_str(self.center_enu_se, precision=4)),
+                 '  radius = %.4f +/- %.1e m'%(self.radius, self.radius_se),
+                 '  normal = %s +/- %.2e rad'%(np.array_str(self.normal, precision=6), self.tilt_se),
+                 '  tilt from vertical = %.4f degrees'%self.tilt,
+                 '  inliers = %i of %i'%(np.count_nonzero(self.inliers), len(self.inliers)),
+                 '  RMS radial = %.4f m, RMS normal = %.4f m'%(np.sqrt(np.mean(self.radial[self.inliers]**2.)),
+                                                               np.sqrt(np.mean(self.normal_residual[self.inliers]**2.)))]
+        return '\n'.join(lines)
+
+def fit_circle(P, sd=None, w=None, robust=None, threshold=0.05, max_iterations=100, tolerance=1e-12,
+               ransac_iterations=200, seed=1, frame='enu', local=None, start=None):
+    ''' Fit a 3D circle to the ECEF points P (n, 3). sd are (n, 3) standard deviations of the coordinates
+    (e.g. sdx, sdy, sdz from the .pos file) and / or w are point weights. robust is None, 'huber' or 'ransac'
+    (threshold is the RANSAC inlier distance in m). frame is 'enu' (fit in east, north, up around the mean
+    of the points) or 'offset' (ECEF axes, relative to the mean). Returns a CircleFit
+    If local is a LocalFrame, P are already in its coordinates (e.g. from Shape_Fitting.ShapeFitter) and
+    start can be the algebraic (C, r, n) in that frame (e.g. from circle_in_plane), so neither is worked out again '''
+    P = np.asarray(P, dtype=np.float64)
+    if P.ndim != 2 or P.shape[1] != 3 or len(P) < 3:
+        raise ValueError('Need at least 3 points with x, y, z coordinates')
+    if robust not in (None, 'huber', 'ransac'):
+        raise ValueError('Unknown robust method: %s'%robust)
+    if frame not in ('enu', 'offset'):
+        raise ValueError('Unknown frame: %s'%frame)
+    if local is not None:
+        frame = 'enu' if local.enu else 'offset'
+    if sd is not None:
+        sd = np.asarray(sd, dtype=np.float64)
+        if sd.shape != P.shape: raise ValueError('sd must have the same shape as P')
+        sd = np.maximum(sd, 1e-6) # RTKLIB writes 0.0000 for very small deviations
+    w = np.ones(len(P)) if w is None else np.asarray(w, dtype=np.float64)
+    
+    # Work in the local frame: ECEF coordinates are ~6e6 m (see LocalFrame)
+    if local is None:
+        local = LocalFrame(P[0] + np.mean(P - P[0], axis=0), frame == 'enu')
+        P = local.to_local(P)
+    
+    # Algebraic start, with one weight per point (the mean of the three variances)
+    w_point = w if sd is None else w / np.mean(sd**2., axis=1)
+    if sd is not None and frame == 'enu':
+        sd = local.covariance_to_local(sd)
+    rng = np.random.default_rng(seed)
+    if robust == 'ransac':
+        C, r, n = ransac_circle(P, threshold, ransac_iterations, rng=rng)
+    elif start is not None:
+        C, r, n = start
+    else:
+        C, r, n = fit_circle_3d(P, w_point)
+    
+    pw = w.copy()
+    iterations = 0
+    for outer in range(20):
+        if robust == 'ransac':
+            inliers = circle_distances(P, C, r, n) <= threshold
+            pw = np.where(inliers, w, 0.)
+        C, r, n, JtWJ, cost, its, converged = refine_circle(P, C, r, n, sd, pw, max_iterations, tolerance)
+        iterations += its
+        if robust is None:
+            break
+        if robust == 'ransac':
+            if np.array_equal(circle_distances(P, C, r, n) <= threshold, inliers):
+                break
+        else:
+            # Normalised distances with the base weights, robust sigma from their MAD
+            D, h, rho, radial, w_radial, w_normal, c = weighted_residuals(P, C, r, n, sd, w)
+            z = np.sqrt(w_radial*radial**2. + w_normal*h**2.)
+            sigma = max(MAD_SCALE*np.median(z), 1e-12)
+            huber = np.where(z <= HUBER_K*sigma, 1., HUBER_K*sigma/np.maximum(z, 1e-300))
+            change = np.max(np.abs(w*huber - pw))
+            pw = w*huber
+            inliers = huber == 1.
+            if change < 1e-6:
+                break
+    
+    # The sign of the normal is arbitrary: make it point away from the origin of the coordinates (up, for ECEF)
+    if np.dot(local.vector_to_ecef(n), local.to_ecef(C)) < 0:
+        n = -n
+        JtWJ = normal_equations(P, C, r, n, sd, pw)[0]
+    
+    fit = CircleFit()
+    fit.method = 'geometric' if robust is None else robust
+    fit.frame = local
+    fit.center = local.to_ecef(C)
+    fit.radius = r
+    fit.normal = local.vector_to_ecef(n)
+    fit.iterations = iterations
+    fit.converged = converged
+    fit.cost = cost
+    radial, normal_residual = circle_residuals(P, C, r, n)
+    fit.radial = radial
+    fit.normal_residual = normal_residual
+    fit.weights = pw
+    fit.inliers = pw > 0 if robust != 'huber' else inliers
+    dof = max(2*np.count_nonzero(pw > 0) - 6, 1)
+    fit.variance_factor = cost / dof
+    # Covariance of the local center, radius and tilts; the center block is rotated to ECEF
+    covariance = np.linalg.pinv(JtWJ) * fit.variance_factor
+    J = np.eye(6)
+    J[:3,:3] = local.R.T
+    fit.covariance = np.dot(np.dot(J, covariance), J.T)
+    se = np.sqrt(np.maximum(np.diag(fit.covariance), 0.))
+    fit.center_se = se[:3]
+    fit.radius_se = se[3]
+    u, v = plane_basis(n) # The basis of the tilts in the covariance (see normal_equations)
+    T = local.vector_to_ecef(np.array([u, v])).T
+    fit.normal_se = np.sqrt(np.maximum(np.diag(np.dot(np.dot(T, fit.covariance[4:,4:]), T.T)), 0.))
+    fit.tilt_se = np.sqrt(max(fit.covariance[4,4] + fit.covariance[5,5], 0.))
+    
+    # East, north, up at the center
+    fit.center_geodetic = ecef_to_geodetic(fit.center)[0]
+    R = enu_rotation(fit.center_geodetic[0], fit.center_geodetic[1])
+    fit.center_enu_se = np.sqrt(np.maximum(np.diag(np.dot(np.dot(R, fit.covariance[:3,:3]), R.T)), 0.))
+    fit.normal_enu = np.dot(R, fit.normal)
+    fit.tilt = np.degrees(np.arccos(np.clip(fit.normal_enu[2], -1., 1.)))
+    return fit
+
+#-------------------------------------------------------------------------------
+# STREAMING CIRCLE FIT
+# - The same plane (SVD / scatter matrix) and algebraic circle fit as
+#   fit_circle_3d, from running sums, so each point costs O(1) and the
+#   current circle can be read at any time
+# - With p relative to the first point, the sums are N, S1 = sum(p),
+#   S2 = sum(p p^T), S3 = sum(p p p) and S4 = sum(p p p p) (3x3x3, 3x3x3x3)
+# - Plane: normal = eigenvector of the smallest eigenvalue of S2/N - m m^T
+# - In-plane coords x = B p (B = first two rows of the rotation of the normal
+#   to z, as in fit_circle_3d), rho^2 = p^T M p with M = B^T B, so the
+#   fit_circle_2d normal equations are
+#   A^T A = [[B S2 B^T, B S1], [(B S1)^T, N]]
+#   A^T b = [sum(B_ai M_jk S3_ijk), trace(M S2)]
+#   and sum(b^2) = sum(M_ij M_kl S4_ijkl) gives the RMS of the fit
+# - SlidingCircleFit keeps the last window points and subtracts the oldest
+#   as new ones arrive (watch the center and radius for drift)
+#-------------------------------------------------------------------------------
+class StreamingCircleFit:
+    ''' Incremental algebraic circle fit. add() / add_points() the positions (e.g. ECEF) as they arrive,
+    circle() returns the current center, radius and normal '''
+    def __init__(self):
+        self.origin = None
+        self.clear()
+
+    def clear(self):
+        self.N = 0.
+        self.S1 = np.zeros(3)
+        self.S2 = np.zeros((3,3))
+        self.S3 = np.zeros((3,3,3))
+        self.S4 = np.zeros((3,3,3,3))
+
+    def accumulate(self, P, w, sign=1.):
+        if self.origin is None:
+            self.origin = np.array(P[0], dtype=np.float64)
+        p = np.asarray(P, dtype=np.float64) - self.origin
+        w = sign*w
+        if len(p) == 1:
+            # One point: outer products are much quicker than einsum
+            p = p[0]
+            pp = np.multiply.outer(p, p)
+            ppp = np.multiply.outer(pp, p)
+            self.N += w[0]
+            self.S1 += w[0]*p
+            self.S2 += w[0]*pp
+            self.S3 += w[0]*ppp
+            self.S4 += w[0]*np.multiply.outer(ppp, p)
+            return
+        self.N += np.sum(w)
+        self.S1 += np.dot(w, p)
+        self.S2 += np.einsum('n,ni,nj->ij', w, p, p)
+        self.S3 += np.einsum('n,ni,nj,nk->ijk', w, p, p, p)
+        self.S4 += np.einsum('n,ni,nj,nk,nl->ijkl', w, p, p, p, p, optimize=True)
+
+    def add(self, p, w=1.):
+        ''' Add one point (with weight w) '''
+        self.accumulate(np.asarray(p, dtype=np.float64)[np.newaxis,:], np.array([w], dtype=np.float64))
+
+    def add_points(self, P, w=None):
+        ''' Add an (n, 3) array of points (with weights w) '''
+        P = np.asarray(P, dtype=np.float64)
+        if len(P) == 0: return
+        self.accumulate(P, np.ones(len(P)) if w is None else np.asarray(w, dtype=np.float64))
+
+    def solve(self):
+        if self.N < 3:
+            return None
+        m = self.S1 / self.N
+        scatter = self.S2/self.N - np.outer(m, m)
+        eigenvalues, eigenvectors = np.linalg.eigh(scatter)
+        normal = eigenvectors[:,0]
+        if np.dot(normal, self.origin + m) < 0: normal = -normal # Away from the origin of the coordinates, as fit_circle
+        B = rotation_matrix(normal, [0,0,1])[:2]
+        M = np.dot(B.T, B)
+        ATA = np.empty((3,3))
+        ATA[:2,:2] = np.dot(np.dot(B, self.S2), B.T)
+        ATA[:2,2] = ATA[2,:2] = np.dot(B, self.S1)
+        ATA[2,2] = self.N
+        ATb = np.empty(3)
+        ATb[:2] = np.einsum('ai,jk,ijk->a', B, M, self.S3)
+        ATb[2] = np.einsum('jk,jk', M, self.S2)
+        try:
+            c = np.linalg.solve(ATA, ATb)
+        except np.linalg.LinAlgError:
+            return None # Collinear (or repeated) points
+        xc = c[0]/2.
+        yc = c[1]/2.
+        r = np.sqrt(max(c[2] + (xc**2.) + (yc**2.), 0.))
+        center = self.origin + np.dot(B.T, [xc, yc]) + np.dot(normal, m)*normal
+        bb = np.einsum('ij,kl,ijkl', M, M, self.S4)
+        ss = max(bb - 2.*np.dot(c, ATb) + np.dot(c, np.dot(ATA, c)), 0.)
+        return center, r, normal, max(eigenvalues[0], 0.), ss
+
+    def circle(self):
+        ''' The current center, radius and normal, or None if there aren't enough points yet '''
+        solution = self.solve()
+        if solution is None: return None
+        return solution[:3]
+
+    def rms(self):
+        ''' Current RMS distances of the points from the circle: (radial, normal) in m. The radial RMS is
+        from the algebraic residuals (rho^2 - r^2 ~ 2*r*(rho - r)) '''
+        solution = self.solve()
+        if solution is None: return None
+        center, r, normal, plane, ss = solution
+        return np.sqrt(ss / self.N) / (2.*max(r, 1e-300)), np.sqrt(plane)
+
+class SlidingCircleFit(StreamingCircleFit):
+    ''' StreamingCircleFit of the last window points '''
+    def __init__(self, window):
+        StreamingCircleFit.__init__(self)
+        self.window = window
+        self.points = np.zeros((window, 3))
+        self.weights = np.zeros(window)
+        self.count = 0 # Points added so far
+        self.removed = 0 # Points removed since the sums were last recalculated
+
+    def add(self, p, w=1.):
+        p = np.asarray(p, dtype=np.float64)
+        slot = self.count % self.window
+        if self.count >= self.window:
+            self.accumulate(self.points[slot][np.newaxis,:], self.weights[slot:slot+1], -1.)
+            self.removed += 1
+        self.points[slot] = p
+        self.weights[slot] = w
+        self.count += 1
+        self.accumulate(p[np.newaxis,:], np.array([w], dtype=np.float64))
+        # Subtracting leaves rounding errors behind: recalculate the sums from the window now and then
+        if self.removed >= self.window:
+            self.clear()
+            self.accumulate(self.points, self.weights)
+            self.removed = 0
+
+    def add_points(self, P, w=None):
+        P = np.asarray(P, dtype=np.float64)
+        w = np.ones(len(P)) if w is None else np.asarray(w, dtype=np.float64)
+        for i in range(len(P)):
+            self.add(P[i], w[i])
@@ -0,0 +1,103 @@
+# Checks that Circle_Fitting.fit_circle keeps 0.1 mm precision at real ECEF coordinates
+# Synthetic circles are generated in east, north, up at sites around the world (equator,
+# mid-latitudes, both hemispheres, near the pole, on a mountain) with horizontal, tilted
+# and vertical normals, converted to ECEF and fitted. The fitted center (ECEF and geodetic),
+# radius and normal are compared with the truth, for the ENU frame and the old ECEF offset
+# frame. Also checks the ECEF -> geodetic -> ECEF round trip and shows what an algebraic
+# fit straight on the ECEF coordinates (no local frame) would give
+
+# Usage: python Circle_Precision.py [points]
+# Exits with status 1 if any check fails
+
+import sys
+
+import numpy as np
+
+import Circle_Fitting
+
+TOLERANCE = 1.0e-4 # m
+
+# name, latitude, longitude, height
+SITES = (('Equator', 0.0, 0.0, 10.0),
+         ('Mid-latitude', 53.2117, -1.8087, 150.0),
+         ('Southern', -33.8568, 151.2153, 5.0),
+         ('Near the pole', 89.9, 45.0, 2800.0),
+         ('Mountain', 27.9881, 86.9250, 8848.0))
+
+# name, normal in east, north, up
+NORMALS = (('horizontal', (0., 0., 1.)),
+           ('tilted', (0.3, -0.2, 0.9)),
+           ('vertical', (1., 1., 0.)))
+
+# num_points on a circle of radius r (m) centred at the geodetic llh with normal_enu, plus noise (m)
+def synthetic_circle(llh, normal_enu, num_points, r=1.5, noise=0., seed=1):
+    rng = np.random.default_rng(seed)
+    C = Circle_Fitting.geodetic_to_ecef(llh)[0]
+    frame = Circle_Fitting.LocalFrame(C)
+    n = frame.vector_to_ecef(np.asarray(normal_enu)/np.linalg.norm(normal_enu))
+    u, v = Circle_Fitting.plane_basis(n)
+    t = rng.uniform(0., 2.*np.pi, num_points)
+    # Offsets from the center are added last, so the ECEF points are as exact as doubles allow
+    P = C + ((r*np.cos(t))[:,np.newaxis]*u + (r*np.sin(t))[:,np.newaxis]*v)
+    return P + rng.normal(0., noise, P.shape), C, r, n
+
+def errors(fit, C, r, n):
+    ''' Center (m), radius (m), normal (m at the circle's edge) and geodetic center (m) errors '''
+    return (np.linalg.norm(fit.center - C), abs(fit.radius - r), r*np.linalg.norm(np.cross(fit.normal, n)),
+            np.linalg.norm(Circle_Fitting.geodetic_to_ecef(fit.center_geodetic)[0] - C))
+
+# Radius error (m) of the algebraic fit (fit_circle_2d) on the ECEF coordinates rotated into the plane
+# of the circle, without moving them to a local origin
+def raw_radius_error(P, r, n):
+    Q = Circle_Fitting.rodrigues_rot(P, n, [0,0,1])
+    return abs(Circle_Fitting.fit_circle_2d(Q[:,0], Q[:,1])[2] - r)
+
+def main(argv):
+    print('Circle Fitting Precision Check')
+    print('(Errors in um: center, radius, normal at the edge, geodetic center; the limit is %.0f um)'%(TOLERANCE*1e6))
+
+    num_points = 10000
+    if len(argv) > 1: num_points = int(argv[1])
+    failures = 0
+
+    # Geodetic round trip
+    llh = np.array([site[1:] for site in SITES])
+    P = Circle_Fitting.geodetic_to_ecef(llh)
+    round_trip = np.max(np.linalg.norm(Circle_Fitting.geodetic_to_ecef(Circle_Fitting.ecef_to_geodetic(P)) - P, axis=1))
+    ok = round_trip < TOLERANCE
+    failures += not ok
+    print('ECEF -> geodetic -> ECEF: max error %.2e um %s'%(round_trip*1e6, 'ok' if ok else 'FAIL'))
+
+    for name, lat, lon, height in SITES:
+        for normal_name, normal_enu in NORMALS:
+            for noise in (0., 0.005):
+                P, C, r, n = synthetic_circle((lat, lon, height), normal_enu, num_points, noise=noise)
+                results = []
+                for frame in ('enu', 'offset'):
+                    fit = Circle_Fitting.fit_circle(P, frame=frame)
+                    errs = errors(fit, C, r, n)
+                    # Noisy circles can only be as good as their standard errors
+                    limit = TOLERANCE + 4.*np.linalg.norm(fit.center_se) if noise > 0. else TOLERANCE
+                    ok = (max(errs) < limit) and fit.converged
+                    failures += not ok
+                    results.append('%-6s %7.3f %7.3f %7.3f %7.3f %-4s'%(frame, errs[0]*1e6, errs[1]*1e6, errs[2]*1e6,
+                                                                      errs[3]*1e6, 'ok' if ok else 'FAIL'))
+                    if frame == 'enu':
+                        tilt = np.degrees(np.arccos(np.clip(np.dot(normal_enu, [0., 0., 1.]) /
+                                                            np.linalg.norm(normal_enu), -1., 1.)))
+                        tilt_error = abs(fit.tilt - tilt)
+                print('%-13s %-10s noise %3.0f mm: %s | %s | tilt error %.1e deg'%(name, normal_name, noise*1e3,
+                                                                                results[0], results[1], tilt_error))
+
+    P, C, r, n = synthetic_circle(SITES[1][1:], NORMALS[1][1], num_points)
+    print('Algebraic fit on the raw ECEF coordinates (%s, %s, no noise): radius error %.3g m'%(SITES[1][0],
+                                                                                             NORMALS[1][0],
+                                                                                             raw_radius_error(P, r, n)))
+
+    print('%i checks failed'%failures if failures else 'All checks passed')
+
+    print('Bye!')
+    if failures: sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,76 +1,378 @@
 # Converts an RTKLIB .pos file into .csv
 
-import matplotlib.dates as mdates
+# The .pos file is read in chunks of lines. Each chunk is parsed in one go (np.fromstring on the
+# whole chunk, with the date / time separators turned into spaces) into a numpy structured array:
+# time, the three solution columns (x, y, z ECEF or lat, lon, height), Q, ns, the three standard
+# deviations, sdxy / sdyz / sdzx (or sdne / sdeu / sdun), age and ratio. Any further columns (e.g. the
+# velocities and their standard deviations, if RTKLIB was asked to output them) are skipped; lines
+# with too few columns (or anything which isn't a number) are counted as ignored.
+# time is seconds since the GPS epoch (1980/1/6) in the time system of the file (GPST or UTC);
+# gps_time() converts UTC to GPST.
+#
+# iter_pos() yields one array per chunk, so very large files can be processed in constant memory.
+# read_pos() returns the whole file as one array.
+#
+# -f npy writes all the columns as a .npy file of the structured array instead. The .npy is written a
+# chunk at a time (the shape in its header is filled in at the end) and load_positions() memory-maps
+# it, so CSV_Circle_Fitting.py doesn't need to parse any text. -f parquet writes a Parquet file (needs pyarrow).
+
+# Usage: python POS_to_CSV.py [-q Q[,Q...]] [-t] [-f csv|npy|parquet] [filename.pos]
+# By default only the x,y,z (or lat,lon,height) of solutions with a Q of 1 are written, which is
+# what CSV_Circle_Fitting.py expects. -q selects other Q values (e.g. -q 1,2), -t adds the time column.
+# python POS_to_CSV.py --check checks the reader on .pos files with and without velocity columns
+# (and with truncated lines). It exits with status 1 if any check fails.
+
 import sys
 import os
-import string
-import csv
-
-print 'POS to CSV'
-
-filename = ''
-
-if filename == '':
-    # Check if the pos filename was passed in argv
-    if len(sys.argv) > 1: filename = sys.argv[1]
-
-firstfile = ''
-for root, dirs, files in os.walk("."):
-    if len(files) > 0:
-        if root == ".":
-            for afile in files:
-                if afile[-4:] == '.pos':
-                    if firstfile == '': firstfile = afile
-
-if filename == '': filename = raw_input('Enter the .pos filename (default: ' + firstfile + '): ') # Get the filename
-if filename == '': filename = firstfile
-
-print 'Processing',filename
-filenamestem = filename[:-4]
-outfile = filenamestem + '.csv'
-print 'Writing to',outfile
-
-try:
-    fi = open(filename,"r")
-except:
-    raise Exception('Invalid input file!')
-
-try:
-    fo = open(outfile,"wb")
-except:
-    raise Exception('Invalid output file!')
-output=csv.writer(fo,delimiter=',')
-
-lines = 0
-ignored = 0
-
-try:
-    for line in fi:
-        if line[0] != '%': # ignore header lines which all start '% '
-            fields = string.split(line)
-            if fields[5] == '1': # Check the Q value
-                # Only convert data with a Q of 1
-                time_str = fields[0] + ' ' + fields[1]
-                #output.writerow([time_str, fields[2], fields[3], fields[4]])
-                output.writerow([fields[2], fields[3], fields[4]])
-                lines += 1
-            else:
-                ignored += 1
-
-    print 'Processed',lines,'data points'
-    print 'Ignored',ignored,'data points'
-
-finally: # Close the files
-    try:
-        fi.close()
-    except:
-        pass
+import argparse
+import struct
+
+import numpy as np
+
+CHUNK_LINES = 100000
+
+GPS_EPOCH_DAYS = 722820 # date(1980, 1, 6).toordinal()
+SECONDS_PER_WEEK = 604800
+LEAP_SECONDS = 18 # GPST - UTC since 2017/1/1
+
+# Column names for the two coordinate types
+COORDINATES = {'xyz': (('x', 'y', 'z'), ('sdx', 'sdy', 'sdz', 'sdxy', 'sdyz', 'sdzx')),
+               'llh': (('lat', 'lon', 'height'), ('sdn', 'sde', 'sdu', 'sdne', 'sdeu', 'sdun'))}
+
+def pos_dtype(coordinates):
+    ''' Structured dtype of the solutions for 'xyz' or 'llh' coordinates '''
+    position, deviations = COORDINATES[coordinates]
+    return np.dtype([('time', '<f8')] + [(name, '<f8') for name in position] + [('Q', 'u1'), ('ns', 'u1')]
+                    + [(name, '<f4') for name in deviations] + [('age', '<f4'), ('ratio', '<f4')])
+
+def read_header(fi):
+    ''' Read the '%' header lines from fi. Returns a dict with the header lines, time_system ('GPST' or 'UTC'),
+    time_format ('calendar' or 'week') and coordinates ('xyz' or 'llh'). Leaves fi at the first solution '''
+    header = {'lines': [], 'time_system': 'GPST', 'time_format': 'calendar', 'coordinates': 'xyz'}
+    while True:
+        position = fi.tell()
+        line = fi.readline()
+        if line[:1] != '%':
+            fi.seek(position)
+            break
+        header['lines'].append(line.rstrip('\n'))
+        fields = line[1:].split()
+        if len(fields) > 1 and ('x-ecef(m)' in fields or 'latitude(deg)' in fields):
+            # The column header: "%  GPST          x-ecef(m) ..." or "%  UTC     latitude(deg) ..."
+            header['time_system'] = fields[0]
+            if 'latitude(deg)' in fields: header['coordinates'] = 'llh'
+    # Week / time of week or calendar date and time: look at the first solution
+    position = fi.tell()
+    first = fi.readline()
+    fi.seek(position)
+    if first.split()[:1] and '/' not in first.split()[0]: header['time_format'] = 'week'
+    if header['time_system'] not in ('GPST', 'UTC'):
+        raise Exception('Unsupported time system: ' + header['time_system'])
+    return header
+
+# date(year, month, day).toordinal() for arrays (H. Hinnant's days_from_civil, counted from 0001/1/1 = day 1)
+def days_from_civil(year, month, day):
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    yoe = year - (era * 400)
+    doy = (((153 * (month + np.where(month > 2, -3, 9))) + 2) // 5) + day - 1
+    doe = (yoe * 365) + (yoe // 4) - (yoe // 100) + doy
+    return (era * 146097) + doe - 305
+
+# Number of whitespace separated fields on each line of text
+def fields_per_line(text):
+    b = np.frombuffer(text.encode('latin1', 'replace'), dtype=np.uint8)
+    space = b <= 32 # Spaces, tabs, newlines
+    starts = np.flatnonzero(space[:-1] & ~space[1:]) + 1 # Where each field starts
+    if len(b) > 0 and not space[0]: starts = np.concatenate(([0], starts))
+    newlines = np.flatnonzero(b == 10)
+    return np.bincount(np.searchsorted(newlines, starts), minlength=len(newlines) + (0 if text.endswith('\n') else 1))
+
+def parse_lines(text, header, dtype):
+    ''' Parse a block of solution lines into an array of dtype. The leading columns of each line
+    are used and any extra columns are skipped. Returns (solutions, number of lines which couldn't be parsed) '''
+    calendar = header['time_format'] == 'calendar'
+    time_columns = 6 if calendar else 2
+    columns = time_columns + len(dtype.names) - 1
+    if calendar:
+        text = text.replace('/', ' ').replace(':', ' ')
+    counts = fields_per_line(text)
     try:
-        fo.close()
-    except:
-        pass
-    print 'Bye!'
+        values = np.fromstring(text, dtype=np.float64, sep=' ')
+    except ValueError: # Newer versions of numpy don't stop quietly at something which isn't a number
+        values = None
+    if (values is not None) and (len(values) == np.sum(counts)):
+        # Take the first columns fields of every line which has enough of them (blank lines don't count)
+        good = counts >= columns
+        bad = int(np.count_nonzero((counts > 0) & ~good))
+        if (len(counts) > 0) and np.all(counts == counts[0]) and good[0]:
+            values = values.reshape(-1, counts[0])[:, :columns]
+        else:
+            starts = (np.cumsum(counts) - counts)[good]
+            values = values[starts[:, np.newaxis] + np.arange(columns)]
+    else:
+        # Something which isn't a number: parse line by line
+        rows = []
+        bad = 0
+        for line in text.splitlines():
+            fields = line.split()
+            if not fields: continue
+            try:
+                if len(fields) < columns: raise ValueError
+                rows.append([float(field) for field in fields[:columns]])
+            except ValueError:
+                bad += 1
+        values = np.array(rows, dtype=np.float64).reshape(-1, columns)
+
+    out = np.empty(len(values), dtype=dtype)
+    if calendar:
+        ymd = values[:, :3].astype(np.int64)
+        days = days_from_civil(ymd[:, 0], ymd[:, 1], ymd[:, 2]) - GPS_EPOCH_DAYS
+        out['time'] = (days * 86400.) + (values[:, 3] * 3600.) + (values[:, 4] * 60.) + values[:, 5]
+    else:
+        out['time'] = (values[:, 0] * SECONDS_PER_WEEK) + values[:, 1]
+    for i, name in enumerate(dtype.names[1:]):
+        out[name] = values[:, time_columns + i]
+    return out, bad
+
+def iter_pos(filename, q=None, chunk_lines=CHUNK_LINES, header=None):
+    ''' Generator yielding the solutions in filename as arrays of (up to) chunk_lines rows.
+    q is a collection of the Q values to keep (None keeps everything). If header is a dict,
+    it is filled in with the header (see read_header) before the first array is yielded, and
+    header['solutions'] / header['ignored'] count the solutions kept and those filtered out
+    (or which couldn't be parsed) '''
+    with open(filename, 'r') as fi:
+        h = read_header(fi)
+        h['solutions'] = 0
+        h['ignored'] = 0
+        if header is not None: header.update(h)
+        else: header = h
+        dtype = pos_dtype(h['coordinates'])
+        keep = None if q is None else np.array(sorted(q), dtype=np.uint8)
+        while True:
+            lines = []
+            for line in fi:
+                if line[:1] == '%': continue
+                lines.append(line)
+                if len(lines) == chunk_lines: break
+            if len(lines) == 0: break
+            block, bad = parse_lines(''.join(lines), h, dtype)
+            parsed = len(block)
+            if keep is not None: block = block[np.isin(block['Q'], keep)]
+            header['solutions'] += len(block)
+            header['ignored'] += parsed - len(block) + bad
+            yield block
+
+def read_pos(filename, q=None, chunk_lines=CHUNK_LINES):
+    ''' Read the solutions in filename (keeping only the Q values in q, if given).
+    Returns (header, solutions) '''
+    header = {}
+    blocks = list(iter_pos(filename, q, chunk_lines, header))
+    if len(blocks) == 0: return header, np.zeros(0, dtype=pos_dtype(header.get('coordinates', 'xyz')))
+    return header, np.concatenate(blocks)
+
+def gps_time(solutions, header, leap_seconds=LEAP_SECONDS):
+    ''' time of the solutions in GPST seconds (UTC files are shifted by leap_seconds) '''
+    if header['time_system'] == 'UTC': return solutions['time'] + leap_seconds
+    return solutions['time']
+
+# Text formats of the CSV columns: RTKLIB writes ECEF and height to 0.1 mm and lat / lon to 1e-9 degrees
+FORMATS = {'time': '%.3f', 'x': '%.4f', 'y': '%.4f', 'z': '%.4f', 'lat': '%.9f', 'lon': '%.9f', 'height': '%.4f'}
+
+def write_csv(fo, block, names):
+    if len(block) == 0: return
+    np.savetxt(fo, np.column_stack([block[name] for name in names]), fmt=[FORMATS[name] for name in names],
+               delimiter=',')
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_SHAPE_DIGITS = 20 # Room in the .npy header for the final number of rows
+
+def npy_header(dtype, rows, length=None):
+    ''' .npy (version 1.0) header for a 1-D array of dtype, padded to length bytes (default: the multiple
+    of 64 which leaves room for NPY_SHAPE_DIGITS digits of rows) '''
+    d = "{'descr': %r, 'fortran_order': False, 'shape': (%i,), }"%(np.lib.format.dtype_to_descr(dtype), rows)
+    if length is None: length = ((len(NPY_MAGIC) + 2 + len(d) + NPY_SHAPE_DIGITS + 1 + 63) // 64) * 64
+    d += ' ' * (length - len(NPY_MAGIC) - 2 - len(d) - 1) + '\n'
+    return NPY_MAGIC + struct.pack('<H', length - len(NPY_MAGIC) - 2) + d.encode('latin1')
+
+class NPYWriter:
+    ''' Writes blocks of a structured array to a .npy file without knowing the number of rows
+    in advance. The header is written first with room for the shape, which is filled in by close() '''
+    def __init__(self, filename, dtype):
+        self.dtype = dtype
+        self.rows = 0
+        self.fo = open(filename, 'wb')
+        self.header_length = len(npy_header(dtype, 0))
+        self.fo.write(npy_header(dtype, 0))
+
+    def write(self, block):
+        self.fo.write(np.ascontiguousarray(block, dtype=self.dtype).tobytes())
+        self.rows += len(block)
+
+    def close(self):
+        self.fo.seek(0)
+        self.fo.write(npy_header(self.dtype, self.rows, self.header_length))
+        self.fo.close()
+
+class ParquetWriter:
+    ''' Writes blocks of a structured array to a Parquet file, one row group per block '''
+    def __init__(self, filename, dtype):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception('Writing Parquet files needs pyarrow (pip install pyarrow)')
+        self.pyarrow = pyarrow
+        self.rows = 0
+        schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtype[name])) for name in dtype.names])
+        self.writer = pyarrow.parquet.ParquetWriter(filename, schema)
+
+    def write(self, block):
+        self.writer.write_table(self.pyarrow.table({name: block[name] for name in block.dtype.names}))
+        self.rows += len(block)
+
+    def close(self):
+        self.writer.close()
+
+def load_solutions(filename):
+    ''' Load the solutions written by POS_to_CSV.py -f npy (memory-mapped, read only) or -f parquet '''
+    if filename[-8:] == '.parquet':
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception('Reading Parquet files needs pyarrow (pip install pyarrow)')
+        table = pyarrow.parquet.read_table(filename, memory_map=True)
+        columns = [(name, table.column(name).to_numpy()) for name in table.column_names]
+        out = np.empty(table.num_rows, dtype=[(name, values.dtype) for name, values in columns])
+        for name, values in columns: out[name] = values
+        return out
+    return np.load(filename, mmap_mode='r')
+
+def load_positions(filename):
+    ''' (n, 3) array of the x, y, z ECEF positions in a .csv, .npy or .parquet file written by POS_to_CSV.py '''
+    if filename[-4:] == '.csv':
+        return np.loadtxt(filename, delimiter=',', ndmin=2)[:, -3:] # Skip the time column, if there is one
+    solutions = load_solutions(filename)
+    if 'x' not in solutions.dtype.names:
+        raise Exception(filename + ' does not contain ECEF positions')
+    return np.column_stack((solutions['x'], solutions['y'], solutions['z']))
+
+def load_deviations(filename):
+    ''' (n, 3) array of sdx, sdy, sdz from a .npy or .parquet file written by POS_to_CSV.py, or None for .csv files '''
+    if filename[-4:] == '.csv':
+        return None
+    solutions = load_solutions(filename)
+    if 'sdx' not in solutions.dtype.names:
+        return None
+    return np.column_stack((solutions['sdx'], solutions['sdy'], solutions['sdz'])).astype(np.float64)
+
+# Self check: write .pos files with num_lines solutions (plus velocity columns and / or truncated or garbled lines)
+# and compare what read_pos makes of them with a line by line parse. Returns a list of (check, ok)
+POS_HEADER = '%  GPST                  x-ecef(m)      y-ecef(m)      z-ecef(m)   Q  ns   sdx(m)   sdy(m)   sdz(m)  sdxy(m)  sdyz(m)  sdzx(m) age(s)  ratio'
+VELOCITY_HEADER = '    vx(m/s)    vy(m/s)    vz(m/s)      sdvx     sdvy     sdvz    sdvxy    sdvyz    sdvzx'
+
+def pos_check():
+    import tempfile
+    rng = np.random.default_rng(1)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, num_lines, velocity, week, truncated in (('2 lines with velocities', 2, True, False, 0),
+                                                          ('19 lines with velocities', 19, True, False, 0),
+                                                          ('1000 lines with velocities', 1000, True, False, 0),
+                                                          ('1000 lines, week / tow, velocities', 1000, True, True, 0),
+                                                          ('1000 lines', 1000, False, False, 0),
+                                                          ('1000 lines, 3 truncated', 1000, False, False, 3),
+                                                          ('1000 lines with velocities, 3 truncated', 1000, True, False, 3),
+                                                          ('1000 lines, 3 garbled', 1000, False, False, -3)):
+            lines = ['% program   : RTKPOST ver.2.4.3 b34', POS_HEADER + (VELOCITY_HEADER if velocity else '')]
+            expected = []
+            for i in range(num_lines):
+                t = 10. + (i * 0.25)
+                xyz = np.array([3803704.1234, -119800.5678, 5079834.9012]) + rng.normal(0., 0.01, 3)
+                q = int(rng.integers(1, 6))
+                when = '1980 %10.3f'%(345600. + t) if week else '2017/12/21 00:%02i:%06.3f'%(int(t // 60), t % 60.)
+                line = '%s %14.4f %14.4f %14.4f %3i %3i %8.4f %8.4f %8.4f %8.4f %8.4f %8.4f %6.2f %6.1f'%(when,
+                       xyz[0], xyz[1], xyz[2], q, 9, 0.005, 0.004, 0.01, 0.001, -0.002, 0.003, 0., 999.9)
+                if velocity: line += ' %10.5f %10.5f %10.5f %8.4f %8.4f %8.4f %8.4f %8.4f %8.4f'%tuple(rng.normal(0., 1., 9))
+                if i < truncated:
+                    line = ' '.join(line.split()[:7]) # Cut short, like the last line of a file being written
+                elif i < -truncated:
+                    line = line.replace('.', ',', 3) # Not numbers
+                else:
+                    expected.append((np.round(xyz, 4), q))
+                lines.append(line)
+            filename = os.path.join(directory, 'check.pos')
+            with open(filename, 'w') as fo: fo.write('\n'.join(lines) + '\n')
+            header, solutions = read_pos(filename, chunk_lines=333)
+            xyz = np.column_stack((solutions['x'], solutions['y'], solutions['z']))
+            ok = ((len(solutions) == len(expected)) and (header['ignored'] == abs(truncated)) and
+                  np.allclose(xyz, [e[0] for e in expected], rtol=0., atol=1e-6) and
+                  np.array_equal(solutions['Q'], [e[1] for e in expected]))
+            results.append(('%s: %i solutions, %i ignored'%(name, len(solutions), header['ignored']), ok))
+    return results
+
+def main(argv):
+    print('POS to CSV')
+
+    parser = argparse.ArgumentParser(description='Convert an RTKLIB .pos file into .csv')
+    parser.add_argument('-q', default='1', metavar='Q[,Q...]', help='Q values to keep, or "all" (default: 1)')
+    parser.add_argument('-t', action='store_true', help='include the time column')
+    parser.add_argument('-f', default='csv', choices=('csv', 'npy', 'parquet'),
+                        help='output format: csv (default), or npy / parquet with all the columns')
+    parser.add_argument('--check', action='store_true', help='check the reader on synthetic .pos files and exit')
+    parser.add_argument('filename', nargs='?', default='')
+    args = parser.parse_args(argv[1:])
+
+    if args.check:
+        failures = 0
+        for check, ok in pos_check():
+            failures += not ok
+            print('%s: %s'%(check, 'ok' if ok else 'FAIL'))
+        print('%i checks failed'%failures if failures else 'All checks passed')
+        print('Bye!')
+        if failures: sys.exit(1)
+        return
+
+    filename = args.filename
+    firstfile = ''
+    for root, dirs, files in os.walk("."):
+        if len(files) > 0:
+            if root == ".":
+                for afile in files:
+                    if afile[-4:] == '.pos':
+                        if firstfile == '': firstfile = afile
+
+    if filename == '': filename = input('Enter the .pos filename (default: ' + firstfile + '): ') # Get the filename
+    if filename == '': filename = firstfile
+
+    q = None if args.q == 'all' else [int(value) for value in args.q.split(',')]
 
+    print('Processing',filename)
+    filenamestem = filename[:-4]
+    outfile = filenamestem + '.' + args.f
+    print('Writing to',outfile)
 
+    header = {}
+    if args.f == 'csv':
+        with open(outfile, 'w') as fo:
+            for block in iter_pos(filename, q, header=header):
+                names = list(COORDINATES[header['coordinates']][0])
+                if args.t: names = ['time'] + names
+                write_csv(fo, block, names)
+    else:
+        writer = None
+        try:
+            for block in iter_pos(filename, q, header=header):
+                if writer is None:
+                    writer = (NPYWriter if args.f == 'npy' else ParquetWriter)(outfile, block.dtype)
+                writer.write(block)
+        finally:
+            if writer is not None: writer.close()
 
+    print('Time system',header.get('time_system'),'coordinates',header.get('coordinates'))
+    print('Processed',header.get('solutions', 0),'data points')
+    print('Ignored',header.get('ignored', 0),'data points')
+    print('Bye!')
 
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+# Fits survey geometries to post-processed positions from the u-blox NEO-M8T FeatherWing:
+# a static point (mean and covariance), a 3D line (rails), a plane (tilting tables),
+# a circle (rotating arms, Circle_Fitting.fit_circle) and a sphere.
+# ShapeFitter moves the points into a local east, north, up frame once and shares the
+# centring and SVD between the shapes, so each file is loaded and prepared only once
+# however many shapes are tried. best() picks the simplest shape that fits about as
+# well as the best one (by residual RMS per coordinate, see RESIDUALS).
+# shape_residuals() gives the distances of any points from a fitted shape.
+
+# Usage: python Shape_Fitting.py [-s auto|point,line,circle,plane,sphere] [-q Q[,Q...]] [--ratio R]
+#                                [-t tolerance] [filename or directory ...]
+# The files can be .csv, .npy, .parquet or .pos, as for CSV_Circle_Fitting.py
+
+import sys
+import argparse
+
+import numpy as np
+
+import Circle_Fitting
+from Circle_Fitting import LocalFrame, principal_axes, ecef_to_geodetic, enu_rotation
+
+# Simplest first: points, then 1D (line, circle), then 2D (plane, sphere) shapes, straight before curved
+SHAPES = ('point', 'line', 'circle', 'plane', 'sphere')
+
+#-------------------------------------------------------------------------------
+# RESIDUALS
+# - Vectorised distances of the points P (n, 3) from each shape (D = P - C):
+#   point:  |D|
+#   line:   sqrt(|D|^2 - <D,d>^2) for the unit direction d
+#   plane:  <D,n> for the unit normal n (signed)
+#   sphere: |D| - r (signed, positive outside)
+#   circle: Circle_Fitting.circle_distances
+# - The distances from a point and from a line or circle have 3 and 2 noise
+#   components, so the RMS is divided by sqrt(COMPONENTS) to compare shapes:
+#   for 5 mm noise on each coordinate every shape that fits gives 5 mm
+#-------------------------------------------------------------------------------
+COMPONENTS = {'point': 3, 'line': 2, 'circle': 2, 'plane': 1, 'sphere': 1}
+
+#-------------------------------------------------------------------------------
+# DEGENERATE FITS
+# - A line needs the points to be spread out, a plane or circle needs them
+#   spread in two directions and a sphere in three: the singular values of the
+#   centred points (largest first) must be at least DEGENERATE times the largest
+#   (line: the spread must be at least MIN_SPREAD m)
+# - Points along a line (plus noise) fit a circle or sphere of enormous radius:
+#   the radius must be no more than MAX_RADIUS times the spread of the points
+#-------------------------------------------------------------------------------
+DEGENERATE = 1e-6
+MIN_SPREAD = 1e-9 # m
+MAX_RADIUS = 1000.
+SPREAD_AXES = {'line': 1, 'circle': 2, 'plane': 2, 'sphere': 3} # Singular values which mustn't vanish
+
+def point_residuals(P, C):
+    D = np.asarray(P, dtype=np.float64) - C
+    return np.sqrt(np.einsum('ij,ij->i', D, D))
+
+def line_residuals(P, C, d):
+    D = np.asarray(P, dtype=np.float64) - C
+    along = np.dot(D, d)
+    return np.sqrt(np.maximum(np.einsum('ij,ij->i', D, D) - along**2., 0.))
+
+def plane_residuals(P, C, n):
+    return np.dot(np.asarray(P, dtype=np.float64) - C, n)
+
+def sphere_residuals(P, C, r):
+    return point_residuals(P, C) - r
+
+def shape_residuals(fit, P):
+    ''' Residuals (m) of the ECEF points P (n, 3) from the ShapeFit fit '''
+    P = np.asarray(P, dtype=np.float64)
+    if P.ndim == 1:
+        P = P[np.newaxis,:]
+    if fit.shape == 'point':
+        return point_residuals(P, fit.center)
+    if fit.shape == 'line':
+        return line_residuals(P, fit.center, fit.direction)
+    if fit.shape == 'plane':
+        return plane_residuals(P, fit.center, fit.direction)
+    if fit.shape == 'sphere':
+        return sphere_residuals(P, fit.center, fit.radius)
+    if fit.shape == 'circle':
+        return Circle_Fitting.circle_distances(P, fit.center, fit.radius, fit.direction)
+    raise ValueError('Unknown shape: %s'%fit.shape)
+
+#-------------------------------------------------------------------------------
+# SPHERE
+# - Algebraic start: |p|^2 = 2<c,p> + k is linear in c and k, r^2 = k + |c|^2
+# - Gauss-Newton refinement of the geometric residuals |p - c| - r
+#   J = [-(p - c)/|p - c|, -1]
+#-------------------------------------------------------------------------------
+def fit_sphere(P, max_iterations=50, tolerance=1e-12):
+    ''' Sphere through the points P (n, 3, ideally centred). Returns C, r, the covariance of C and r
+    (scaled by the residual variance) and whether it converged '''
+    A = np.column_stack((2.*P, np.ones(len(P))))
+    c = np.linalg.lstsq(A, np.einsum('ij,ij->i', P, P), rcond=None)[0]
+    C = c[:3]
+    r = np.sqrt(max(c[3] + np.dot(C, C), 0.))
+    converged = False
+    for iteration in range(max_iterations):
+        D = P - C
+        dist = np.maximum(np.sqrt(np.einsum('ij,ij->i', D, D)), 1e-300)
+        J = np.column_stack((-D/dist[:,np.newaxis], -np.ones(len(P))))
+        step = np.linalg.lstsq(J, -(dist - r), rcond=None)[0]
+        C = C + step[:3]
+        r = r + step[3]
+        if np.max(np.abs(step)) < tolerance*max(r, 1.):
+            converged = True
+            break
+    D = P - C
+    dist = np.sqrt(np.einsum('ij,ij->i', D, D))
+    J = np.column_stack((-D/np.maximum(dist, 1e-300)[:,np.newaxis], -np.ones(len(P))))
+    variance = np.sum((dist - r)**2.) / max(len(P) - 4, 1)
+    return C, r, np.linalg.pinv(np.dot(J.T, J)) * variance, converged
+
+#-------------------------------------------------------------------------------
+# SHAPE FIT
+#-------------------------------------------------------------------------------
+class ShapeFit:
+    ''' Result of ShapeFitter.fit: the shape and its parameters (ECEF), residual statistics and,
+    where they make sense, standard errors '''
+    def __init__(self, shape):
+        self.shape = shape
+        self.center = None # Point, line / plane centroid, circle / sphere center
+        self.direction = None # Line direction, plane / circle normal (unit vectors)
+        self.radius = None # Circle and sphere
+        self.center_se = None # Standard errors of the center (ECEF)
+        self.radius_se = None
+        self.covariance = None # Point: the scatter of the positions (ECEF, 3 x 3)
+        self.sd_enu = None # Point: standard deviations of the positions in east, north, up
+        self.center_geodetic = None # Latitude (degrees), longitude (degrees), height (m)
+        self.direction_enu = None # direction in east, north, up at the center
+        self.tilt = None # Angle between direction and up (degrees)
+        self.residuals = None # Of every point (m)
+        self.rms = np.inf
+        self.sigma = np.inf # RMS per coordinate (rms / sqrt(COMPONENTS))
+        self.max = np.inf
+        self.points = 0
+        self.converged = True
+        self.error = '' # Why the shape could not be fitted
+        self.fit = None # The CircleFit, for circles
+
+    def __str__(self):
+        if self.error != '':
+            return '%s: %s'%(self.shape, self.error)
+        lines = ['%s fit to %i points: RMS %.4f m, max %.4f m%s'%(self.shape.capitalize(), self.points, self.rms,
+                                                                 self.max, '' if self.converged else ' (NOT converged)'),
+                 '  center = %s m'%np.array_str(self.center, precision=4),
+                 '  center = %.9f %.9f %.4f (lat lon height)'%tuple(self.center_geodetic)]
+        if self.center_se is not None:
+            lines.append('  center standard errors = %s m'%np.array_str(self.center_se, precision=5))
+        if self.sd_enu is not None:
+            lines.append('  standard deviations = %s m (ENU)'%np.array_str(self.sd_enu, precision=4))
+        if self.direction is not None:
+            lines.append('  %s = %s (ENU %s), %.4f degrees from up'%('direction' if self.shape == 'line' else 'normal',
+                         np.array_str(self.direction, precision=6), np.array_str(self.direction_enu, precision=6),
+                         self.tilt))
+        if self.radius is not None:
+            radius = '  radius = %.4f m'%self.radius
+            if self.radius_se is not None: radius += ' +/- %.1e m'%self.radius_se
+            lines.append(radius)
+        return '\n'.join(lines)
+
+class ShapeFitter:
+    ''' Fits shapes to the ECEF points P (n, 3). The local frame, the centred points and their principal
+    axes are worked out once and shared by all the fits. sd (n, 3) are used by the circle fit '''
+    def __init__(self, P, sd=None):
+        P = np.asarray(P, dtype=np.float64)
+        if P.ndim != 2 or P.shape[1] != 3 or len(P) < 1:
+            raise ValueError('Need points with x, y, z coordinates')
+        self.P = P
+        self.sd = sd
+        self.frame = LocalFrame(P[0] + np.mean(P - P[0], axis=0))
+        self.Q = self.frame.to_local(P) # East, north, up
+        self.mean, self.Q_centered, self.axes, self.singular_values = principal_axes(self.Q)
+        self.spread = np.max(np.sqrt(np.einsum('ij,ij->i', self.Q_centered, self.Q_centered))) # m from the mean
+        self.fits = {}
+
+    def degenerate(self, shape, radius=None):
+        ''' Why the points can't define shape (or the fitted radius is meaningless), or '' '''
+        s = np.concatenate((self.singular_values, np.zeros(3)))[:3]
+        axes = SPREAD_AXES.get(shape, 0)
+        if axes > 0 and self.spread < MIN_SPREAD:
+            return 'the points are all in the same place'
+        if axes > 1 and s[axes - 1] < DEGENERATE * s[0]:
+            return 'the points are %s'%('in a line' if s[1] < DEGENERATE * s[0] else 'in a plane')
+        if (radius is not None) and not (radius <= MAX_RADIUS * self.spread):
+            return 'the fit is degenerate (radius %.3g m for points %.3g m across)'%(radius, 2. * self.spread)
+        return ''
+
+    def check(self, shape, radius=None):
+        error = self.degenerate(shape, radius)
+        if error: raise ValueError(error)
+
+    # Fill in the ECEF center (and direction), the geodetic and ENU values and the residual statistics
+    def finish(self, fit, center, direction=None):
+        fit.center = self.frame.to_ecef(center)
+        fit.center_geodetic = ecef_to_geodetic(fit.center)[0]
+        if direction is not None:
+            fit.direction = self.frame.vector_to_ecef(direction)
+            fit.direction_enu = np.dot(enu_rotation(fit.center_geodetic[0], fit.center_geodetic[1]), fit.direction)
+            fit.tilt = np.degrees(np.arccos(np.clip(abs(fit.direction_enu[2]), 0., 1.)))
+        fit.residuals = shape_residuals(fit, self.P)
+        fit.points = len(self.P)
+        fit.rms = np.sqrt(np.mean(fit.residuals**2.))
+        fit.sigma = fit.rms / np.sqrt(COMPONENTS[fit.shape])
+        fit.max = np.max(np.abs(fit.residuals))
+        return fit
+
+    def fit(self, shape):
+        ''' Fit (or return the earlier fit of) shape. Returns a ShapeFit (with error set if it could not be fitted) '''
+        if shape in self.fits:
+            return self.fits[shape]
+        if shape not in SHAPES:
+            raise ValueError('Unknown shape: %s'%shape)
+        fit = ShapeFit(shape)
+        minimum = {'point': 1, 'line': 2, 'circle': 3, 'plane': 3, 'sphere': 4}[shape]
+        n = len(self.P)
+        try:
+            if n < minimum:
+                raise ValueError('needs at least %i points'%minimum)
+            self.check(shape)
+            if shape == 'point':
+                local_covariance = np.dot(self.Q_centered.T, self.Q_centered) / max(n - 1, 1)
+                fit.covariance = np.dot(np.dot(self.frame.R.T, local_covariance), self.frame.R)
+                fit.sd_enu = np.sqrt(np.diag(local_covariance))
+                fit.center_se = np.sqrt(np.diag(fit.covariance) / n)
+                self.finish(fit, self.mean)
+            elif shape == 'line':
+                self.finish(fit, self.mean, self.axes[0])
+            elif shape == 'plane':
+                self.finish(fit, self.mean, self.axes[2])
+            elif shape == 'sphere':
+                C, r, covariance, converged = fit_sphere(self.Q_centered)
+                self.check(shape, r)
+                fit.radius = r
+                fit.converged = converged
+                se = np.sqrt(np.maximum(np.diag(covariance), 0.))
+                fit.center_se = np.sqrt(np.maximum(np.diag(np.dot(np.dot(self.frame.R.T, covariance[:3,:3]),
+                                                                  self.frame.R)), 0.))
+                fit.radius_se = se[3]
+                self.finish(fit, C + self.mean)
+            else:
+                # The shared frame, centring and plane normal give the algebraic start
+                start = Circle_Fitting.circle_in_plane(self.mean, self.Q_centered, self.axes[2])
+                self.check(shape, start[1])
+                fit.fit = Circle_Fitting.fit_circle(self.Q, sd=self.sd, local=self.frame, start=start)
+                self.check(shape, fit.fit.radius)
+                fit.radius = fit.fit.radius
+                fit.radius_se = fit.fit.radius_se
+                fit.center_se = fit.fit.center_se
+                fit.converged = fit.fit.converged
+                self.finish(fit, self.frame.to_local(fit.fit.center), np.dot(self.frame.R, fit.fit.normal))
+            if not np.isfinite(fit.rms):
+                raise ValueError('the fit is degenerate')
+        except (ValueError, np.linalg.LinAlgError) as e:
+            fit = ShapeFit(shape)
+            fit.error = str(e)
+        self.fits[shape] = fit
+        return fit
+
+    def fit_all(self, shapes=SHAPES):
+        ''' Fit all the shapes. Returns a dict of ShapeFits '''
+        return {shape: self.fit(shape) for shape in shapes}
+
+    def best(self, shapes=SHAPES, ratio=2., tolerance=0.):
+        ''' The simplest of the shapes (in SHAPES order) whose RMS per coordinate (sigma) is within ratio
+        times the best one (or no more than tolerance m). Curved shapes can follow the noise a little,
+        so ratio should be more than 1 '''
+        fits = self.fit_all(shapes)
+        best_sigma = min(fit.sigma for fit in fits.values())
+        if not np.isfinite(best_sigma):
+            raise ValueError('None of the shapes could be fitted')
+        for shape in SHAPES:
+            if shape in fits and fits[shape].sigma <= max(ratio*best_sigma, tolerance):
+                return fits[shape]
+
+def main(argv):
+    print('Shape Fitting')
+
+    import CSV_Circle_Fitting
+
+    parser = argparse.ArgumentParser(description='Fit points, lines, circles, planes and spheres to RTKLIB positions')
+    parser.add_argument('-s', default='auto', metavar='SHAPES',
+                        help='auto (default) or a list of shapes from %s'%','.join(SHAPES))
+    parser.add_argument('-q', default='1', metavar='Q[,Q...]', help='Q values to use from .pos files (default: 1)')
+    parser.add_argument('--ratio', type=float, default=2.,
+                        help='picks the simplest shape with an RMS per coordinate within RATIO of the best (default: 2)')
+    parser.add_argument('-t', type=float, default=0., metavar='TOLERANCE',
+                        help='or no more than TOLERANCE m (default: 0)')
+    parser.add_argument('filenames', nargs='*')
+    args = parser.parse_args(argv[1:])
+    q = [int(value) for value in args.q.split(',')]
+    shapes = SHAPES if args.s == 'auto' else tuple(args.s.split(','))
+    for shape in shapes:
+        if shape not in SHAPES: parser.error('unknown shape: %s'%shape)
+
+    filenames = CSV_Circle_Fitting.expand_filenames(args.filenames)
+    if len(filenames) == 0:
+        filename = input('Enter the filename: ')
+        filenames = [filename]
+
+    for filename in filenames:
+        print()
+        print(filename)
+        # Loaded once: every shape is fitted to the same arrays
+        P, sd = CSV_Circle_Fitting.load_points(filename, q)
+        fitter = ShapeFitter(P, sd)
+        best = fitter.best(shapes, args.ratio, args.t)
+        for shape in shapes:
+            fit = fitter.fit(shape)
+            if fit.error != '':
+                print('  %-7s %s'%(shape, fit.error))
+            else:
+                print('%s %-7s RMS %9.4f m  per coordinate %9.4f m  max %9.4f m'%('*' if fit is best else ' ', shape,
+                                                                                 fit.rms, fit.sigma, fit.max))
+        print(best)
+
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
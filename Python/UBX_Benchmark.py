@@ -0,0 +1,171 @@
+# Benchmarks the UBX_Checker.py scan engine against the original byte-by-byte loop,
+# shows how the parallel batch check scales with the number of processes
+# and times the UBX_RAWX.py decoder and the UBX_RINEX.py converter
+
+# Usage: python UBX_Benchmark.py [filename.bin]
+# If no filename is given, a synthetic RXM-RAWX / RXM-SFRBX / TIM-TM2 log is generated
+
+import sys
+import os
+import struct
+import time
+import random
+import tempfile
+import shutil
+import subprocess
+
+import UBX_Checker
+import UBX_Index
+import UBX_RAWX
+import UBX_RINEX
+
+# The original checker loop: one fi.read(1) and one csum() call per payload byte
+# Stops after limit bytes so the benchmark doesn't take all day
+def bytewise_scan(filename, limit=None):
+    csum = UBX_Checker.csum
+    processed = 0
+    messages = {}
+    with open(filename, 'rb') as fi:
+        while (limit is None) or (processed < limit):
+            sum1 = 0
+            sum2 = 0
+            result = fi.read(2)
+            if len(result) != 2: break
+            if (result[0] != 0xb5) or (result[1] != 0x62): break
+            processed += 2
+            result = fi.read(2)
+            message_type = '0x%02X 0x%02X'%(result[0],result[1])
+            sum1,sum2 = csum(result[0],sum1,sum2)
+            sum1,sum2 = csum(result[1],sum1,sum2)
+            processed += 2
+            result = fi.read(2)
+            length = (result[1] * 256) + result[0]
+            sum1,sum2 = csum(result[0],sum1,sum2)
+            sum1,sum2 = csum(result[1],sum1,sum2)
+            processed += 2
+            for l in range(length):
+                byte = fi.read(1)
+                sum1,sum2 = csum(ord(byte),sum1,sum2)
+                processed += 1
+            result = fi.read(2)
+            processed += 2
+            messages[message_type] = messages.get(message_type, 0) + 1
+    return processed
+
+# Generate num_epochs of RXM-RAWX (with num_meas measurements), RXM-SFRBX and TIM-TM2 frames
+def synthetic_frames(num_epochs, num_meas=20, measRate=0.25, seed=1):
+    rng = random.Random(seed)
+    frame = UBX_Checker.ubx_frame
+    rcvTow = 345600.0
+    for epoch in range(num_epochs):
+        rcvTow += measRate
+        # RXM-RAWX: rcvTow, week, leapS, numMeas, recStat, version, reserved
+        payload = struct.pack('<dHbBBBBB', rcvTow, 1980, 18, num_meas, 1, 1, 0, 0)
+        for m in range(num_meas):
+            # prMes, cpMes, doMes, gnssId, svId, reserved, freqId, locktime, cno, prStdev, cpStdev, doStdev, trkStat, reserved
+            payload += struct.pack('<ddfBBBBHBBBBBB', 2.0e7 + rng.random() * 5.0e6, 1.1e8 + rng.random() * 2.0e7,
+                                   rng.uniform(-4000., 4000.), m % 7, 1 + m, 0, 0, 64500, 30 + m, 3, 1, 5, 0x07, 0)
+        yield frame(0x02, 0x15, payload)
+        # RXM-SFRBX: gnssId, svId, reserved, freqId, numWords, chn, version, reserved plus ten words
+        payload = struct.pack('<BBBBBBBB', 0, 1 + (epoch % 32), 0, 0, 10, epoch % 16, 2, 0)
+        payload += struct.pack('<10I', *[rng.getrandbits(30) for w in range(10)])
+        yield frame(0x02, 0x13, payload)
+        # TIM-TM2: ch, flags, count, wnR, wnF, towMsR, towSubMsR, towMsF, towSubMsF, accEst
+        # A new rising and falling edge every epoch, timed in UTC (the default) like the receiver, so 18 s behind rcvTow
+        towMs = int(round((rcvTow - 18) * 1000))
+        yield frame(0x0D, 0x03, struct.pack('<BBHHHIIIII', 0, 0xF7, epoch, 1980, 1980, towMs, 0, towMs + 10, 0, 20))
+
+def write_synthetic_log(filename, num_epochs, num_meas=20):
+    with open(filename, 'wb') as fo:
+        for f in synthetic_frames(num_epochs, num_meas):
+            fo.write(f)
+    return os.path.getsize(filename)
+
+def mb_per_sec(num_bytes, seconds):
+    return (num_bytes / 1.0e6) / max(seconds, 1e-9)
+
+def main(argv):
+    print('UBX Checker Benchmark')
+
+    tempname = None
+    if len(argv) > 1:
+        filename = argv[1]
+    else:
+        tempname = os.path.join(tempfile.gettempdir(), 'UBX_Benchmark.bin')
+        filename = tempname
+        print('Generating synthetic log',filename)
+        write_synthetic_log(filename, 20000) # ~ 14MB, 83 minutes at 4Hz
+
+    try:
+        filesize = os.path.getsize(filename)
+        print('File size was',filesize)
+
+        # The byte-by-byte loop is slow, so only time the first 2MB of it
+        limit = min(filesize, 2000000)
+        start = time.perf_counter()
+        loop_bytes = bytewise_scan(filename, limit)
+        loop_time = time.perf_counter() - start
+        loop_rate = mb_per_sec(loop_bytes, loop_time)
+        print('Byte-by-byte loop:  %10i bytes in %8.3f s = %8.2f MB/s'%(loop_bytes,loop_time,loop_rate))
+
+        start = time.perf_counter()
+        stats = UBX_Checker.scan_file(filename)
+        scan_time = time.perf_counter() - start
+        scan_rate = mb_per_sec(stats.processed, scan_time)
+        print('Memory-mapped scan: %10i bytes in %8.3f s = %8.2f MB/s'%(stats.processed,scan_time,scan_rate))
+
+        print('Speedup: %.1fx'%(scan_rate / max(loop_rate, 1e-9)))
+
+        # Batch check, splitting the file into chunks across 1, 2, 4 ... processes
+        processes = 1
+        while processes <= (os.cpu_count() or 1):
+            start = time.perf_counter()
+            UBX_Checker.check_files([filename], processes, chunk_size=max(filesize // (4 * processes), 1))
+            batch_time = time.perf_counter() - start
+            print('Batch check, %2i processes: %8.3f s = %8.2f MB/s'%(processes,batch_time,mb_per_sec(filesize, batch_time)))
+            processes *= 2
+
+        # Decode the RXM-RAWX messages into numpy arrays. The frame index is built first (and not timed)
+        UBX_Index.update_index(filename)
+        start = time.perf_counter()
+        epochs, meas = UBX_RAWX.load_rawx(filename)
+        decode_time = time.perf_counter() - start
+        print('RXM-RAWX decode: %i epochs, %i measurements in %.3f s = %.0f epochs/s'%(len(epochs),len(meas),decode_time,
+                                                                                        len(epochs) / max(decode_time, 1e-9)))
+        print('A day at 4Hz (345600 epochs) would take %.1f s'%(345600 * decode_time / max(len(epochs), 1)))
+
+        # RINEX conversion in one pass (UBX_RINEX.py) against the old workflow: convert with RTKLIB's
+        # convbin (if it is installed) and then check the log
+        outdir = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            UBX_RINEX.convert_files([filename], processes=1, directory=outdir)
+            rinex_time = time.perf_counter() - start
+            print('RINEX conversion:           %8.3f s = %8.2f MB/s'%(rinex_time,mb_per_sec(filesize, rinex_time)))
+            processes = 1
+            while processes <= (os.cpu_count() or 1):
+                start = time.perf_counter()
+                UBX_RINEX.convert_files([filename], shard='hour', processes=processes, directory=outdir)
+                shard_time = time.perf_counter() - start
+                print('RINEX hourly, %2i processes: %8.3f s = %8.2f MB/s'%(processes,shard_time,mb_per_sec(filesize, shard_time)))
+                processes *= 2
+            convbin = shutil.which('convbin')
+            if convbin is None:
+                print('convbin not found: convert-then-check not timed (the check alone took %.3f s)'%scan_time)
+            else:
+                start = time.perf_counter()
+                subprocess.run([convbin, '-r', 'ubx', '-od', '-os', '-d', outdir, filename],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                convbin_time = time.perf_counter() - start + scan_time
+                print('convbin + check:            %8.3f s = %8.2f MB/s'%(convbin_time,mb_per_sec(filesize, convbin_time)))
+        finally:
+            shutil.rmtree(outdir)
+    finally:
+        if tempname is not None:
+            os.remove(tempname)
+            if os.path.exists(UBX_Index.index_filename(tempname)): os.remove(UBX_Index.index_filename(tempname))
+
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
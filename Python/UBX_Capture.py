@@ -0,0 +1,740 @@
+# Non-blocking serial capture pipeline for the NEO-M8T GNSS RAWX Logger
+
+# A reader thread does large reads (everything that is in_waiting) from the serial port into a
+# ring of preallocated buffers. A writer thread takes the filled buffers, writes them to disk,
+# flushing in batches, and hands them back to the reader. Neither thread prints anything: console
+# output is throttled and summarised so it can never hold up the serial port.
+
+import os
+import sys
+import time
+import glob
+import gzip
+import mmap
+import queue
+import shutil
+import struct
+import selectors
+import threading
+import collections
+
+import UBX_Checker
+
+# RXM-RAWX payload header: rcvTow, week, leapS, numMeas
+RAWX_HEADER = struct.Struct('<dHbB')
+
+GPS_UNIX_OFFSET = 315964800 # Unix time of the GPS epoch (1980-01-06)
+
+class BufferRing(object):
+    ''' A ring of preallocated buffers passed from the reader thread to the writer thread '''
+
+    def __init__(self, num_buffers=64, buffer_size=1<<16):
+        self.buffer_size = buffer_size
+        self.buffers = [bytearray(buffer_size) for i in range(num_buffers)]
+        self.free = queue.Queue() # Indexes of empty buffers
+        self.filled = queue.Queue() # (index, length, port) of buffers waiting to be written. None means stop
+        for i in range(num_buffers): self.free.put(i)
+
+    def in_use(self):
+        ''' Number of buffers holding data which has not been written yet '''
+        return len(self.buffers) - self.free.qsize()
+
+class CapturePort(object):
+    ''' One serial port being captured: the port, the file its data is written to, its sinks and its statistics '''
+
+    def __init__(self, ser, fp, sinks=None, label=None):
+        self.ser = ser
+        self.fp = fp
+        self.sinks = list(sinks) if sinks is not None else []
+        self.label = label
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.reads = 0
+        self.error = None # Exception which stopped this port (with several ports, the others carry on)
+
+    def running(self):
+        return self.error is None
+
+    def summary(self):
+        return '%s: logged %i bytes in %i reads%s'%(self.label, self.bytes_written, self.reads,
+                                                  '' if self.error is None else '  STOPPED: %s'%self.error)
+
+class SerialCapture(object):
+    ''' Capture everything from ser into the file fp using a reader thread and a writer thread
+
+    sinks is a list of functions which are called (in the writer thread) with a memoryview of each
+    chunk of data after it has been written. They must copy the data if they want to keep it.
+    The writer works through a list of CapturePorts (here just the one): see SelectorCapture. '''
+
+    def __init__(self, ser, fp, ring=None, flush_interval=1.0, sinks=None, handoff_space=4096, ports=None):
+        self.ports = ports if ports is not None else [CapturePort(ser, fp, sinks)]
+        self.ser = self.ports[0].ser
+        self.fp = self.ports[0].fp
+        self.sinks = self.ports[0].sinks
+        self.ring = ring if ring is not None else BufferRing()
+        self.flush_interval = flush_interval # Seconds between file flushes
+        self.handoff_space = handoff_space # Hand a buffer to the writer when it has less space than this
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.reads = 0
+        self.flushes = 0
+        self.ring_waits = 0 # Number of times the reader had to wait for a free buffer
+        self.max_in_use = 0 # Most buffers ever waiting to be written
+        self.cpu_time = 0. # Thread CPU time of the reader and the writer (once they have stopped)
+        self.error = None # Exception which stopped either thread
+        self.start_time = None
+        self._stop = threading.Event()
+        self._reader = threading.Thread(target=self._run_reader, name='UBX reader')
+        self._writer = threading.Thread(target=self._write_loop, name='UBX writer')
+        self._reader.daemon = True
+        self._writer.daemon = True
+
+    def start(self):
+        self.start_time = time.time()
+        self._writer.start()
+        self._reader.start()
+
+    def stop(self, timeout=5.0):
+        ''' Stop reading, write everything which has been read and flush the file '''
+        self._stop.set()
+        self._reader.join(timeout)
+        self._writer.join(timeout)
+
+    def running(self):
+        return self._writer.is_alive()
+
+    def _get_free(self):
+        # Wait for an empty buffer, but keep checking for stop (or a dead writer)
+        ring = self.ring
+        try:
+            return ring.free.get_nowait()
+        except queue.Empty:
+            self.ring_waits += 1
+        while not self._stop.is_set():
+            try:
+                return ring.free.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _hand_off(self, index, fill, port):
+        # Pass a filled buffer to the writer
+        ring = self.ring
+        ring.filled.put((index, fill, port))
+        in_use = ring.in_use()
+        if in_use > self.max_in_use: self.max_in_use = in_use
+
+    def _counted(self, port, num_bytes):
+        port.bytes_read += num_bytes
+        port.reads += 1
+        self.bytes_read += num_bytes
+        self.reads += 1
+
+    def _run_reader(self):
+        cpu_start = time.thread_time()
+        try:
+            self._read_loop()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.cpu_time += time.thread_time() - cpu_start
+            self.ring.filled.put(None)
+
+    def _read_loop(self):
+        ring = self.ring
+        port = self.ports[0]
+        ser = port.ser
+        index = None
+        fill = 0
+        try:
+            while not self._stop.is_set():
+                if index is None:
+                    index = self._get_free()
+                    if index is None: break
+                    fill = 0
+                    view = memoryview(ring.buffers[index])
+                # Read everything that is waiting (or wait up to the port timeout for one byte)
+                want = min(max(ser.in_waiting, 1), ring.buffer_size - fill)
+                num_bytes = ser.readinto(view[fill:fill + want])
+                if num_bytes:
+                    fill += num_bytes
+                    self._counted(port, num_bytes)
+                # Hand the buffer over when it is nearly full or the burst of data has ended
+                if (fill > 0) and ((ring.buffer_size - fill < self.handoff_space) or (ser.in_waiting == 0)):
+                    view.release()
+                    self._hand_off(index, fill, port)
+                    index = None
+        except Exception as e:
+            port.error = e
+            raise
+        finally:
+            if index is not None:
+                view.release()
+                if fill > 0:
+                    self._hand_off(index, fill, port)
+                else:
+                    ring.free.put(index)
+
+    def _write_loop(self):
+        ring = self.ring
+        last_flush = time.time()
+        cpu_start = time.thread_time()
+        try:
+            while True:
+                try:
+                    item = ring.filled.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = False
+                if item is None: break
+                if item:
+                    index, length, port = item
+                    data = memoryview(ring.buffers[index])[:length]
+                    try:
+                        port.fp.write(data)
+                        for sink in port.sinks: sink(data)
+                        port.bytes_written += length
+                    except Exception as e:
+                        port.error = e
+                        # With one port (or when every port has failed) the capture stops
+                        if all(p.error is not None for p in self.ports): raise
+                    finally:
+                        data.release()
+                        ring.free.put(index)
+                    self.bytes_written += length
+                now = time.time()
+                if now - last_flush >= self.flush_interval:
+                    self._flush()
+                    self.flushes += 1
+                    last_flush = now
+        except Exception as e:
+            self.error = e
+            self._stop.set()
+        finally:
+            try:
+                self._flush()
+            except Exception as e:
+                if self.error is None: self.error = e
+            self.cpu_time += time.thread_time() - cpu_start
+
+    def _flush(self):
+        for port in self.ports:
+            try:
+                port.fp.flush()
+            except Exception as e:
+                port.error = e
+                if len(self.ports) == 1: raise
+
+    def summary(self):
+        ''' One line summary of the capture so far '''
+        elapsed = max(time.time() - self.start_time, 1e-6) if self.start_time is not None else 1e-6
+        return 'Logged %i bytes (%.0f bytes/s)  Buffers in use: %i/%i (max %i)'%(self.bytes_written,
+                self.bytes_written / elapsed, self.ring.in_use(), len(self.ring.buffers), self.max_in_use)
+
+class SelectorCapture(SerialCapture):
+    ''' SerialCapture of several CapturePorts with one reader thread (and the usual writer thread)
+
+    The reader waits on all of the ports with a selector (ports which can't be selected, e.g. on
+    Windows, are polled with in_waiting), reads everything each ready port has waiting into a ring
+    buffer, then sleeps for batch_interval so the data builds up into bigger reads. So it wakes up
+    at most 1/batch_interval times a second however many ports there are. A port which fails is
+    stopped; the others carry on. '''
+
+    def __init__(self, ports, ring=None, flush_interval=1.0, batch_interval=0.02):
+        SerialCapture.__init__(self, None, None, ring, flush_interval, ports=list(ports))
+        self.batch_interval = batch_interval
+        self.wakeups = 0
+
+    def _read_port(self, port):
+        # Read whatever port has waiting into a free buffer. Returns False if the port has failed
+        ring = self.ring
+        index = self._get_free()
+        if index is None: return True
+        view = memoryview(ring.buffers[index])
+        num_bytes = 0
+        try:
+            num_bytes = port.ser.readinto(view[:min(max(port.ser.in_waiting, 1), ring.buffer_size)])
+        except Exception as e:
+            port.error = e
+        finally:
+            view.release()
+            if num_bytes:
+                self._counted(port, num_bytes)
+                self._hand_off(index, num_bytes, port)
+            else:
+                ring.free.put(index)
+        return port.error is None
+
+    def _read_loop(self):
+        selector = selectors.DefaultSelector()
+        polled = []
+        for port in self.ports:
+            try:
+                selector.register(port.ser.fileno(), selectors.EVENT_READ, port)
+            except Exception: # No fileno (or it can't be selected)
+                polled.append(port)
+        try:
+            while not self._stop.is_set() and any(port.running() for port in self.ports):
+                # Wait for the first port to have data (polled ports are checked every batch_interval)
+                if len(selector.get_map()) > 0:
+                    ready = [key.data for key, events in selector.select(self.batch_interval if polled else 0.1)]
+                else:
+                    time.sleep(self.batch_interval)
+                    ready = []
+                for port in polled:
+                    try:
+                        if port.running() and port.ser.in_waiting > 0: ready.append(port)
+                    except Exception as e:
+                        port.error = e
+                if not ready: continue
+                self.wakeups += 1
+                for port in ready:
+                    if not self._read_port(port):
+                        try:
+                            selector.unregister(port.ser.fileno())
+                        except Exception:
+                            pass
+                        if port in polled: polled.remove(port)
+                # Let the next batch build up (the kernel buffers it) rather than waking for every few bytes
+                self._stop.wait(self.batch_interval)
+            # Read whatever is left
+            for port in self.ports:
+                try:
+                    while port.running() and port.ser.in_waiting > 0 and self._read_port(port): pass
+                except Exception as e:
+                    port.error = e
+        finally:
+            selector.close()
+
+    def summary(self):
+        ''' One line summary of the capture so far '''
+        elapsed = max(time.time() - self.start_time, 1e-6) if self.start_time is not None else 1e-6
+        return 'Logged %i bytes from %i ports (%.0f bytes/s)  %.1f wakeups/s  Buffers in use: %i/%i (max %i)'%(
+               self.bytes_written, len(self.ports), self.bytes_written / elapsed, self.wakeups / elapsed,
+               self.ring.in_use(), len(self.ring.buffers), self.max_in_use)
+
+# Log filename from the prefix and the (local) time the file was opened, e.g. GNSS_RAWX_Log_20180131_235959.bin
+def log_filename(prefix='GNSS_RAWX_Log_', t=None, directory='.'):
+    tn = time.localtime(time.time() if t is None else t)
+    date_str = str(tn[0])+str(tn[1]).zfill(2)+str(tn[2]).zfill(2)
+    time_str = str(tn[3]).zfill(2)+str(tn[4]).zfill(2)+str(tn[5]).zfill(2)
+    filename = prefix + date_str + '_' + time_str + '.bin'
+    if directory not in ('', '.'): filename = os.path.join(directory, filename)
+    # Don't overwrite an existing log if two files are opened in the same second
+    n = 1
+    stem = filename[:-4]
+    while os.path.exists(filename) or os.path.exists(filename + PART) or os.path.exists(filename + '.gz') or os.path.exists(filename + '.zst'):
+        filename = stem + '_' + str(n) + '.bin'
+        n += 1
+    return filename
+
+# Files are written with this suffix and only renamed once they are complete
+PART = '.part'
+
+# Lock the open file fp (until it is closed) to show it is being written. Returns False if it is
+# already locked: by another process or, on Linux, another open file object in this process.
+# With wait, wait for the lock instead
+def lock_file(fp, wait=False):
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            fp.seek(0) # msvcrt locks bytes from the current position
+            msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK if wait else msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+    except OSError:
+        return False
+    return True
+
+# True if the open file fp is still called filename
+def same_file(fp, filename):
+    try:
+        return os.path.samestat(os.fstat(fp.fileno()), os.stat(filename))
+    except OSError:
+        return False
+
+# Finish off any .part files left behind by a crash or power cut: cut off any incomplete frame
+# at the end and rename them. Returns a list of (filename, bytes removed). Files which are locked
+# are being written by a running logger (see RotatingLogFile) and are left alone
+def recover_partial(directory='.'):
+    recovered = []
+    for partname in sorted(glob.glob(os.path.join(directory, '*.bin' + PART))):
+        try:
+            fp = open(partname, 'r+b')
+        except OSError:
+            continue # Finished by its logger since the glob
+        with fp:
+            # Check the name after locking: the logger may have just finished and renamed it
+            if not (lock_file(fp) and same_file(fp, partname)): continue
+            filesize = os.fstat(fp.fileno()).st_size
+            stats = UBX_Checker.UBXStats(filesize)
+            if filesize > 0: # mmap cannot map an empty file
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    UBX_Checker.scan_buffer(mm, stats)
+            fp.truncate(stats.end)
+            fp.flush()
+            os.fsync(fp.fileno())
+        filename = partname[:-len(PART)]
+        os.replace(partname, filename)
+        recovered.append((filename, stats.filesize - stats.end))
+    return recovered
+
+class Compressor(object):
+    ''' Background thread which compresses finished log files (gzip or zstd) and deletes the originals '''
+
+    def __init__(self, method='gzip', level=None):
+        if method == 'zstd':
+            import zstandard # Optional: only needed for zstd compression
+            self.compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+            self.extension = '.zst'
+        elif method == 'gzip':
+            self.level = 6 if level is None else level
+            self.extension = '.gz'
+        else:
+            raise ValueError('Unknown compression method: ' + str(method))
+        self.method = method
+        self.queue = queue.Queue()
+        self.compressed = [] # Names of the compressed files
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='UBX compressor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, filename):
+        self.queue.put(filename)
+
+    def close(self):
+        ''' Wait for all the queued files to be compressed '''
+        self.queue.put(None)
+        self._thread.join()
+
+    def _compress(self, filename):
+        outname = filename + self.extension
+        with open(filename, 'rb') as fi, open(outname + PART, 'wb') as fo:
+            if self.method == 'zstd':
+                self.compressor.copy_stream(fi, fo)
+            else:
+                with gzip.GzipFile(filename=os.path.basename(filename), mode='wb', compresslevel=self.level, fileobj=fo) as gz:
+                    shutil.copyfileobj(fi, gz, 1<<20)
+            fo.flush()
+            os.fsync(fo.fileno())
+        os.replace(outname + PART, outname)
+        os.remove(filename)
+        return outname
+
+    def _run(self):
+        while True:
+            filename = self.queue.get()
+            if filename is None: break
+            try:
+                self.compressed.append(self._compress(filename))
+            except Exception as e:
+                self.error = e # Leave the original file where it is
+
+class RotatingLogFile(object):
+    ''' File-like object for SerialCapture which starts a new log file every max_bytes and / or
+    max_seconds, like RAWX_Logger_4's new_file. Files are only ever cut on a UBX frame boundary,
+    so every file starts with a complete frame and ends with one.
+
+    The current file is written as name.bin.part and fsync'd every fsync_interval seconds (when
+    the capture flushes it). It is locked while it is open, so recover_partial in another logger
+    leaves it alone. When it is finished it is fsync'd, closed and renamed to name.bin,
+    so a .bin file is always complete. Finished files can be compressed in the background
+    (compress='gzip' or 'zstd'). on_new_file(filename) is called each time a file is opened.
+
+    With align, the time comes from the receiver: files are cut just before the first RXM-RAWX of
+    each max_seconds period of UTC (from rcvTow, week and leapS) and named after the start of the
+    period, so the files from several receivers start with the same epoch and have the same time
+    in their names. Data after the last complete frame is held back until the next write. '''
+
+    def __init__(self, prefix='GNSS_RAWX_Log_', directory='.', max_bytes=None, max_seconds=None,
+                 fsync_interval=10.0, compress=None, on_new_file=None, clock=time.time, align=False):
+        self.prefix = prefix
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.fsync_interval = fsync_interval
+        self.on_new_file = on_new_file
+        self.clock = clock
+        self.align = align and (max_seconds is not None)
+        self.period = None # max_seconds period (of UTC) of the last RXM-RAWX, with align
+        self.held = b'' # Incomplete frame held back, with align
+        self.compressor = Compressor(compress) if compress is not None else None
+        self.finished = [] # Names of the completed files
+        self.fp = None
+        self.filename = None
+        self.file_bytes = 0
+        self.frame_ends = [] # Stream offsets of the ends of the frames in the data being written
+        self.frame_periods = [] # and the period of each RXM-RAWX (None for other frames)
+        self.parser = UBX_Checker.UBXStreamParser(on_frame=self._on_frame)
+        self.stream_offset = 0
+        self.opened = None
+        self.last_fsync = None
+
+    def _on_frame(self, offset, msg_class, msg_id, payload):
+        self.frame_ends.append(offset + len(payload) + UBX_Checker.OVERHEAD)
+        period = None
+        if self.align and (msg_class == 0x02) and (msg_id == 0x15) and (len(payload) >= RAWX_HEADER.size):
+            rcvTow, week, leapS, numMeas = RAWX_HEADER.unpack_from(payload)
+            period = int((GPS_UNIX_OFFSET + (week * 604800) + rcvTow - leapS) // self.max_seconds)
+        self.frame_periods.append(period)
+
+    def _open(self):
+        self.opened = self.clock()
+        name_time = self.opened
+        if self.period is not None: name_time = self.period * self.max_seconds
+        self.filename = log_filename(self.prefix, name_time, self.directory)
+        while True:
+            self.fp = open(self.filename + PART, 'wb')
+            lock_file(self.fp, wait=True)
+            if same_file(self.fp, self.filename + PART): break
+            self.fp.close() # recover_partial got to it between the open and the lock
+        self.file_bytes = 0
+        self.last_fsync = self.opened
+        if self.on_new_file is not None: self.on_new_file(self.filename)
+
+    def _finish(self):
+        # Make sure everything is on the disk before the file gets its final name
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+        os.replace(self.filename + PART, self.filename)
+        self.finished.append(self.filename)
+        self.fp = None
+        if self.compressor is not None: self.compressor.add(self.filename)
+
+    def rotation_due(self):
+        if (self.max_bytes is not None) and (self.file_bytes >= self.max_bytes): return True
+        if self.align: return False # Cut on the receiver's time instead
+        if (self.max_seconds is not None) and (self.clock() - self.opened >= self.max_seconds): return True
+        return False
+
+    def write(self, data):
+        data = memoryview(data)
+        start = self.stream_offset
+        self.stream_offset += len(data)
+        self.frame_ends = []
+        self.frame_periods = []
+        self.parser.feed(data)
+        if self.held:
+            start -= len(self.held)
+            data = memoryview(self.held + bytes(data))
+            self.held = b''
+        pos = 0
+        for end, period in zip(self.frame_ends, self.frame_periods):
+            # The first RXM-RAWX of a new period starts a new file (with align)
+            if period is not None:
+                if (self.period is not None) and (period != self.period) and (self.fp is not None):
+                    self._finish()
+                self.period = period
+            # Write up to the end of this frame; if the file is now due to be rotated, finish it.
+            # The next file is opened when there is something to write to it
+            if self.fp is None: self._open()
+            self.fp.write(data[pos:end - start])
+            self.file_bytes += end - start - pos
+            pos = end - start
+            if self.rotation_due():
+                self._finish()
+        if self.align and (0 < len(data) - pos < 65536):
+            self.held = bytes(data[pos:]) # It could be the start of the next period's first RXM-RAWX
+        elif pos < len(data):
+            if self.fp is None: self._open()
+            self.fp.write(data[pos:])
+            self.file_bytes += len(data) - pos
+        return len(data)
+
+    def flush(self):
+        if self.fp is None: return
+        self.fp.flush()
+        now = self.clock()
+        if now - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.fp.fileno())
+            self.last_fsync = now
+
+    def close(self):
+        ''' Finish the current file and wait for any compression to complete '''
+        if self.held:
+            if self.fp is None: self._open()
+            self.fp.write(self.held)
+            self.file_bytes += len(self.held)
+            self.held = b''
+        if self.fp is not None:
+            self._finish()
+        if self.compressor is not None:
+            self.compressor.close()
+
+class HexEcho(object):
+    ''' Sink which echoes data in Python hex syntax (useful for cutting and pasting),
+    showing at most max_bytes per interval and summarising the rest '''
+
+    def __init__(self, max_bytes=256, interval=1.0, out=None):
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.out = out if out is not None else sys.stdout
+        self.shown = 0
+        self.skipped = 0
+        self.interval_start = time.time()
+
+    def __call__(self, data):
+        now = time.time()
+        if now - self.interval_start >= self.interval:
+            if self.skipped > 0:
+                self.out.write('\n... %i bytes not shown\n'%self.skipped)
+            self.shown = 0
+            self.skipped = 0
+            self.interval_start = now
+        show = max(0, min(len(data), self.max_bytes - self.shown))
+        if show > 0:
+            self.out.write(''.join('\\x%02x'%c for c in data[:show]))
+        self.shown += show
+        self.skipped += len(data) - show
+
+class EpochMonitor(object):
+    ''' Sink which parses the data as it is captured (without changing it) and keeps live statistics:
+    frames per message type, RXM-RAWX epoch gaps (from rcvTow), data rate and corrupt data.
+    Problems are queued in events for the main thread to print. measRate is in seconds; if it
+    is None it is taken to be the smallest gap seen between epochs. '''
+
+    def __init__(self, measRate=None, max_events=100):
+        self.parser = UBX_Checker.UBXStreamParser(on_frame=self._on_frame)
+        self.stats = self.parser.stats
+        self.measRate = measRate
+        self.learn_rate = measRate is None
+        self.epochs = 0
+        self.missed_epochs = 0
+        self.max_gap = 0.
+        self.num_meas = 0 # numMeas in the last epoch
+        self.last_tow = None
+        self.events = collections.deque(maxlen=max_events)
+        self.bytes = 0
+        self._reported_regions = 0
+        self._rate_bytes = 0
+        self._rate_time = time.time()
+
+    def __call__(self, data):
+        self.bytes += len(data)
+        self.parser.feed(data)
+        regions = self.stats.bad_regions
+        while self._reported_regions < len(regions):
+            offset, length, reason = regions[self._reported_regions]
+            self.events.append('Corrupt data at offset %i: %i bytes skipped (%s)'%(offset,length,reason))
+            self._reported_regions += 1
+
+    def _on_frame(self, offset, msg_class, msg_id, payload):
+        if (msg_class != 0x02) or (msg_id != 0x15) or (len(payload) < RAWX_HEADER.size):
+            return
+        rcvTow, week, leapS, numMeas = RAWX_HEADER.unpack_from(payload)
+        self.epochs += 1
+        self.num_meas = numMeas
+        last_tow = self.last_tow
+        self.last_tow = rcvTow
+        if last_tow is None:
+            return
+        gap = rcvTow - last_tow
+        if gap < -302400.: gap += 604800. # Week rollover
+        if gap <= 0.:
+            self.events.append('RXM-RAWX rcvTow went backwards: %.3f to %.3f'%(last_tow,rcvTow))
+            return
+        if gap > self.max_gap: self.max_gap = gap
+        if self.learn_rate and ((self.measRate is None) or (gap < self.measRate)):
+            self.measRate = round(gap, 3)
+        missed = int(round(gap / self.measRate)) - 1
+        if missed > 0:
+            self.missed_epochs += missed
+            self.events.append('Missed %i epoch%s before rcvTow %.3f (gap %.3fs)'%(missed,'' if missed == 1 else 's',rcvTow,gap))
+
+    def pop_events(self):
+        ''' Return (and forget) the events queued since the last call '''
+        events = []
+        while len(self.events) > 0:
+            events.append(self.events.popleft())
+        return events
+
+    def summary(self):
+        ''' One line summary of the statistics, including the data rate since the last call '''
+        now = time.time()
+        rate = (self.bytes - self._rate_bytes) / max(now - self._rate_time, 1e-6)
+        self._rate_bytes = self.bytes
+        self._rate_time = now
+        frames = '  '.join('%s %i'%(UBX_Checker.message_name(*key), count) for key, count in sorted(self.stats.messages.items()))
+        return '%.0f bytes/s  Epochs %i (%i missed, max gap %.3fs, %i meas)  %s  Corrupt: %i regions, %i bytes'%(rate,
+               self.epochs, self.missed_epochs, self.max_gap, self.num_meas, frames, len(self.stats.bad_regions), self.stats.skipped())
+
+# Loopback check: stream a synthetic log through a pseudo-terminal into SerialCapture
+# and make sure every byte arrives in the file (within timeout seconds). POSIX only (needs the pty module)
+def pty_loopback(num_epochs=2000, baud=230400, chunk=4096, timeout=10.):
+    import io
+    import pty
+    import tty
+    import serial
+    import UBX_Benchmark
+
+    data = b''.join(UBX_Benchmark.synthetic_frames(num_epochs))
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    ser = serial.Serial(os.ttyname(slave), baud, timeout=0.1)
+    out = io.BytesIO()
+    capture = SerialCapture(ser, out, ring=BufferRing(8, 8192))
+    capture.start()
+    try:
+        deadline = time.time() + timeout
+        view = memoryview(data)
+        os.set_blocking(master, False) # So a stalled capture can't hold up the writes past the deadline
+        while len(view) > 0 and capture.running() and time.time() < deadline:
+            try:
+                view = view[os.write(master, view[:chunk]):] # os.write can be partial when the pty buffer is full
+            except BlockingIOError:
+                time.sleep(0.001)
+        while capture.bytes_written < len(data) and capture.running() and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        capture.stop()
+        ser.close()
+        os.close(master)
+        os.close(slave)
+    return capture, out.getvalue() == data, len(data)
+
+# Recovery check: recover_partial (as run by a logger starting up) finishes a .part file left by a crash,
+# but leaves alone the .part file a running RotatingLogFile is writing. Returns a list of (check, ok)
+def recover_check(num_epochs=100):
+    import tempfile
+    import UBX_Benchmark
+
+    data = b''.join(UBX_Benchmark.synthetic_frames(num_epochs))
+    half = len(data) // 2
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        crashed = os.path.join(directory, 'crashed.bin')
+        with open(crashed + PART, 'wb') as fo: fo.write(data[:half]) # Ends part way through a frame
+        live = RotatingLogFile(prefix='live_', directory=directory)
+        live.write(data[:half])
+        live.flush()
+        recovered = recover_partial(directory)
+        results.append(('the crashed file is recovered, without its incomplete frame',
+                        (len(recovered) == 1) and (recovered[0][0] == crashed) and
+                        (open(crashed, 'rb').read() == data[:half - recovered[0][1]]) and data[half - recovered[0][1]:].startswith(b'\xb5\x62')))
+        results.append(('the live file is left alone', os.path.exists(live.filename + PART)))
+        try:
+            live.write(data[half:])
+            live.close()
+            ok = open(live.filename, 'rb').read() == data
+        except Exception:
+            ok = False
+        results.append(('the live file is finished with all of its data', ok))
+    return results
+
+def main(argv):
+    print('UBX Capture Loopback Check')
+    capture, ok, num_bytes = pty_loopback()
+    print(capture.summary())
+    print('Sent %i bytes. Captured %i bytes. %s'%(num_bytes, capture.bytes_written, 'Data matches' if ok else 'DATA MISMATCH!!'))
+    failures = 0 if ok else 1
+    for check, ok in recover_check():
+        failures += not ok
+        print('%s: %s'%(check, 'ok' if ok else 'FAIL'))
+    print('%i checks failed'%failures if failures else 'All checks passed')
+    print('Bye!')
+    if failures: sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
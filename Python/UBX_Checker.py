@@ -1,7 +1,23 @@
 # Checks the format of u-blox binary files
 
+# The file is memory-mapped and walked frame by frame using memoryview slices
+# and struct, so no per-byte Python calls are needed. The 8-bit Fletcher
+# checksums are calculated in bulk with numpy, many frames at a time.
+
 import sys
 import os
+import mmap
+import struct
+from itertools import accumulate
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# UBX frame: Sync Char 1 (0xB5), Sync Char 2 (0x62), Class, ID, Length (2 bytes, little endian), Payload, Checksum A, Checksum B
+SYNC = b'\xb5\x62'
+HEADER = struct.Struct('<BBH') # Class, ID, Length
+HEADER_LEN = 6 # Sync chars + class + ID + length
+OVERHEAD = 8 # Header plus two checksum bytes
 
 # Add byte to checksums sum1 and sum2
 def csum(byte, sum1, sum2):
@@ -11,115 +27,514 @@ def csum(byte, sum1, sum2):
     sum2 = sum2 & 0xFF
     return sum1,sum2
 
-print 'UBX Binary File Checker'
+# Calculate both checksum bytes for the class, ID, length and payload bytes in one go
+# sum1 is the sum of all bytes; sum2 is the sum of all the running totals of sum1
+def ubx_checksum(data):
+    sum1 = sum(data) & 0xFF
+    sum2 = sum(accumulate(data)) & 0xFF
+    return sum1,sum2
 
-filename = ''
+# Assemble a complete UBX frame (sync chars, header, payload and checksum)
+def ubx_frame(msg_class, msg_id, payload=b''):
+    body = HEADER.pack(msg_class, msg_id, len(payload)) + bytes(payload)
+    sum1,sum2 = ubx_checksum(body)
+    return SYNC + body + bytes((sum1, sum2))
 
-if filename == '':
-    # Check if the bin filename was passed in argv
-    if len(sys.argv) > 1: filename = sys.argv[1]
+# Names of the messages the NEO-M8T logger deals with
+MESSAGE_NAMES = {(0x02, 0x15): 'RXM-RAWX', (0x02, 0x13): 'RXM-SFRBX', (0x0D, 0x03): 'TIM-TM2',
+                 (0x05, 0x01): 'ACK-ACK', (0x05, 0x00): 'ACK-NAK',
+                 (0x06, 0x01): 'CFG-MSG', (0x06, 0x08): 'CFG-RATE', (0x06, 0x17): 'CFG-NMEA',
+                 (0x06, 0x24): 'CFG-NAV5', (0x06, 0x3E): 'CFG-GNSS'}
 
-# Find first .bin file in the current directory
-firstfile = ''
-for root, dirs, files in os.walk("."):
-    if len(files) > 0:
-        if root == ".": # Comment this line to check sub-directories too
-            for afile in files:
-                if afile[-4:] == '.bin':
-                    if firstfile == '': firstfile = afile
-
-# Ask user for .bin filename offering firstfile as the default
-if filename == '': filename = raw_input('Enter the bin filename (default: ' + firstfile + '): ') # Get the filename
-if filename == '': filename = firstfile
-
-print 'Processing',filename
-filesize = os.path.getsize(filename)
-
-# Try to open file for reading
-try:
-    fi = open(filename,"rb")
-except:
-    raise Exception('Invalid file!')
-
-processed = 0
-messages = {}
-longest = 0
-
-try:
-    while True:
-        sum1 = 0 # Checksum bytes
-        sum2 = 0
-
-        # Try to read two bytes, check they are the two sync chars
-        print
-        result = fi.read(2)
-        if len(result) == 0:
-            raise Exception('End of file?!')
-        if len(result) != 2:
-            raise Exception('Failed to read header bytes!')
-        if (ord(result[0]) != 0xb5) or (ord(result[1]) != 0x62):
-            raise Exception('Failed to read valid header bytes!')
-        processed += 2
-
-        # Try to read two more bytes, these will be the type bytes
-        result = fi.read(2)
-        if len(result) != 2:
-            raise Exception('Failed to read type bytes!')
-        message_type = '0x%02X 0x%02X'%(ord(result[0]),ord(result[1]))
-        print 'Processing message type',message_type
-        sum1,sum2 = csum(ord(result[0]),sum1,sum2)
-        sum1,sum2 = csum(ord(result[1]),sum1,sum2)
-        processed += 2
-
-        # Try to read two more bytes, these will be the message length
-        result = fi.read(2)
-        if len(result) != 2:
-            raise Exception('Failed to read length bytes!')
-        length = (ord(result[1]) * 256) + ord(result[0])
-        print 'Message contains %i (0x%04X) data bytes'%(length,length)
-        sum1,sum2 = csum(ord(result[0]),sum1,sum2)
-        sum1,sum2 = csum(ord(result[1]),sum1,sum2)
-        processed += 2
-
-        # Try to read length bytes
-        for l in range(length):
-            byte = fi.read(1)
-            if byte == '':
-                raise Exception('Failed to read data byte!')
-            sum1,sum2 = csum(ord(byte),sum1,sum2)
-            processed += 1
-
-        # Try to read two checksum bytes
-        result = fi.read(2)
-        if len(result) != 2:
-            raise Exception('Failed to read checksum bytes!')
-        if (ord(result[0]) != sum1) or (ord(result[1]) != sum2):
-            print 'Checksum failure! Expected 0x%02X 0x%02X : Got 0x%02X 0x%02X'%(sum1,sum2,ord(result[0]),ord(result[1]))
-            #raise Exception('Checksum failure!')
-        processed += 2
-
-        # Check if we have seen this message type before
-        if messages.has_key(message_type):
-            messages[message_type] += 1 # if we have, increment its count
+def message_name(msg_class, msg_id):
+    return MESSAGE_NAMES.get((msg_class, msg_id), message_type_str(msg_class, msg_id))
+
+# Format a (class, ID) pair the way the checker has always printed it
+def message_type_str(msg_class, msg_id):
+    return '0x%02X 0x%02X'%(msg_class, msg_id)
+
+# Reasons for bad regions
+BAD_SYNC = 'bad sync'
+BAD_LENGTH = 'bad length'
+BAD_CHECKSUM = 'bad checksum'
+TRUNCATED = 'truncated frame'
+
+# Longest payload we expect from the NEO-M8T. A corrupt length field can claim up to 65535 bytes,
+# so anything longer than this is treated as a false sync rather than followed
+MAX_LENGTH = 8192
+
+class UBXStats(object):
+    ''' Per-message-type counts and byte totals for a UBX file '''
+
+    def __init__(self, filesize=0):
+        self.filesize = filesize
+        self.processed = 0 # Bytes in valid frames
+        self.longest = 0 # Longest payload
+        self.messages = {} # (class, ID) : count
+        self.checksum_errors = 0 # Frames which failed their checksum (one per bad region at most)
+        self.false_syncs = 0 # 0xB5 0x62 inside corrupt data which failed the checksum too
+        self.bad_regions = [] # (offset, length, reason) of data which is not part of a valid frame
+        self.end = 0 # Offset of the byte after the last valid frame
+
+    def add(self, msg_class, msg_id, length):
+        ''' Count one frame '''
+        key = (msg_class, msg_id)
+        self.messages[key] = self.messages.get(key, 0) + 1
+        self.processed += length + OVERHEAD
+        if length > self.longest: self.longest = length
+
+    def merge(self, other):
+        ''' Add the counts from another UBXStats (another chunk or file) '''
+        self.filesize += other.filesize
+        self.processed += other.processed
+        self.checksum_errors += other.checksum_errors
+        self.false_syncs += other.false_syncs
+        if other.longest > self.longest: self.longest = other.longest
+        for key, count in other.messages.items():
+            self.messages[key] = self.messages.get(key, 0) + count
+
+    def skipped(self):
+        ''' Total number of bytes in bad regions '''
+        return sum(region[1] for region in self.bad_regions)
+
+    def report(self, max_regions=20):
+        ''' Print the file statistics '''
+        print()
+        print('Processed',self.processed,'bytes')
+        print('File size was',self.filesize)
+        if (self.processed != self.filesize):
+            print('FILE SIZE MISMATCH!!')
+        if self.checksum_errors > 0:
+            print('Checksum failures:',self.checksum_errors)
+        if self.false_syncs > 0:
+            print('False syncs in corrupt data:',self.false_syncs)
+        if len(self.bad_regions) > 0:
+            print('Skipped %i bytes in %i bad regions:'%(self.skipped(),len(self.bad_regions)))
+            for offset, length, reason in self.bad_regions[:max_regions]:
+                print('  Offset %i (0x%08X)  Length %i  (%s)'%(offset,offset,length,reason))
+            if len(self.bad_regions) > max_regions:
+                print('  ...')
+        print('Longest message was %i data bytes'%self.longest)
+        if len(self.messages) > 0:
+            print('Message types and totals were:')
+            for key in sorted(self.messages.keys()):
+                print('Message type:',message_type_str(*key),'  Total:',self.messages[key])
+
+# Walk the frame headers in view from pos, stopping at the first frame which starts at or after limit
+# Returns a list of (start, class, ID, length) for each frame, the offset of the next frame,
+# and the reason the walk stopped early (None if limit was reached)
+def walk_frames(view, pos, limit, max_length=MAX_LENGTH):
+    size = len(view)
+    unpack_header = HEADER.unpack_from
+    frames = []
+    while pos < limit:
+        # Check for the two sync chars
+        if size - pos < HEADER_LEN:
+            return frames, pos, TRUNCATED
+        if (view[pos] != 0xB5) or (view[pos+1] != 0x62):
+            return frames, pos, BAD_SYNC
+
+        # Class, ID and length
+        msg_class, msg_id, length = unpack_header(view, pos + 2)
+        if length > max_length:
+            return frames, pos, BAD_LENGTH
+        end = pos + HEADER_LEN + length
+        if end + 2 > size:
+            return frames, pos, TRUNCATED
+
+        frames.append((pos, msg_class, msg_id, length))
+        pos = end + 2
+    return frames, pos, None
+
+# Calculate the checksums of many frames at once using prefix sums over the bytes they span
+# For bytes x[a:e], sum1 = S[e] - S[a] and sum2 = e*sum1 - (T[e] - T[a]), where S and T are the
+# running totals of x[i] and i*x[i]. uint32 wraparound is harmless as only the bottom 8 bits are used
+def frame_checksums(buf, starts, lengths):
+    base = int(starts[0]) + 2 # First byte after the sync chars
+    first = np.asarray(starts, dtype=np.uint32) - np.uint32(starts[0])
+    ends = first + np.uint32(4) + np.asarray(lengths, dtype=np.uint32) # Byte after the payload
+    span = int(ends[-1]) + 2
+    x = np.frombuffer(buf, dtype=np.uint8, count=span, offset=base).astype(np.uint32)
+    S = np.zeros(span + 1, dtype=np.uint32)
+    np.cumsum(x, out=S[1:])
+    T = np.zeros(span + 1, dtype=np.uint32)
+    np.cumsum(x * np.arange(span, dtype=np.uint32), out=T[1:])
+    sum1 = S[ends] - S[first]
+    sum2 = (ends * sum1) - (T[ends] - T[first])
+    expected = np.empty((len(first), 2), dtype=np.uint8)
+    expected[:,0] = sum1 & np.uint32(0xFF)
+    expected[:,1] = sum2 & np.uint32(0xFF)
+    received = np.empty_like(expected)
+    received[:,0] = x[ends]
+    received[:,1] = x[ends + np.uint32(1)]
+    return expected, received
+
+# Walk the UBX frames in buf (bytes, bytearray or mmap), updating stats
+# Frames are processed window bytes at a time to bound the memory used by the checksum arrays.
+# When a frame fails (bad sync, length or checksum, or it runs off the end of buf) the scan
+# searches for the next 0xB5 0x62 from the byte after the start of the bad frame and carries on.
+# Everything between the last good frame and the next good frame is added to stats.bad_regions.
+# While resyncing, a small window is used so a run of false syncs doesn't re-check 4MB each time.
+# The scan starts at offset start and ends at the last frame which starts before stop (frames
+# may run past stop). If on_frames is given, it is called with an array of (start, class, ID, length)
+# rows for each batch of valid frames
+def scan_buffer(buf, stats, verbose=False, window=1<<22, max_length=MAX_LENGTH, resync_window=1<<16,
+                start=0, stop=None, on_frames=None, print_errors=True, resync=None):
+    # resync is a list when start is not known to be a frame boundary: the offsets of any checksum
+    # failures before the first valid frame are added to it rather than counted (see merge_chunks)
+    view = memoryview(buf)
+    size = len(view)
+    if stop is None: stop = size
+    pos = start
+    bad_start = None # Start of the current bad region
+    bad_reason = None
+    synced = resync is None
+    try:
+        while pos < stop:
+            limit = pos + (window if bad_start is None else resync_window)
+            frames, pos, reason = walk_frames(view, pos, min(stop, limit), max_length)
+            if len(frames) > 0:
+                frames = np.array(frames, dtype=np.int64)
+                expected, received = frame_checksums(buf, frames[:,0], frames[:,3])
+                failed = np.nonzero((expected != received).any(axis=1))[0]
+                if len(failed) > 0:
+                    # Accept the frames before the first failure and resync from there
+                    f = failed[0]
+                    if (f == 0) and not synced:
+                        resync.append(int(frames[f,0]))
+                    elif (f > 0) or (bad_start is None):
+                        if print_errors: print('Checksum failure at offset %i! Expected 0x%02X 0x%02X : Got 0x%02X 0x%02X'%(frames[f,0],expected[f,0],expected[f,1],received[f,0],received[f,1]))
+                        stats.checksum_errors += 1
+                    else:
+                        stats.false_syncs += 1 # Still resyncing: this isn't a frame, just 0xB5 0x62 in the bad data
+                    pos = int(frames[f,0])
+                    reason = BAD_CHECKSUM
+                    frames = frames[:f]
+                if len(frames) > 0:
+                    synced = True
+                    if bad_start is not None:
+                        stats.bad_regions.append((bad_start, int(frames[0,0]) - bad_start, bad_reason))
+                        bad_start = None
+                    stats.end = int(frames[-1,0] + frames[-1,3]) + OVERHEAD
+                    if on_frames is not None: on_frames(frames)
+                for offset, msg_class, msg_id, length in frames.tolist():
+                    if verbose:
+                        print()
+                        print('Processing message type',message_type_str(msg_class, msg_id))
+                        print('Message contains %i (0x%04X) data bytes'%(length,length))
+                    stats.add(msg_class, msg_id, length)
+            if reason is None: continue
+
+            # Look for the next pair of sync chars
+            if bad_start is None:
+                bad_start = pos
+                bad_reason = reason
+            pos = buf.find(SYNC, pos + 1, stop + 1)
+            if pos < 0: pos = stop
+    finally:
+        view.release()
+    if bad_start is not None:
+        stats.bad_regions.append((bad_start, stop - bad_start, bad_reason))
+    return stats
+
+class UBXStreamParser(object):
+    ''' Incremental UBX frame parser for live data
+
+    feed() can be given data in chunks of any size. Complete, valid frames are counted in stats
+    and passed to on_frame(offset, msg_class, msg_id, payload) where payload is a memoryview which
+    is only valid during the call. Corrupt data is skipped (resyncing at the next 0xB5 0x62) and
+    added to stats.bad_regions, just like scan_buffer. '''
+
+    def __init__(self, stats=None, on_frame=None, max_length=MAX_LENGTH):
+        self.stats = stats if stats is not None else UBXStats()
+        self.on_frame = on_frame
+        self.max_length = max_length
+        self.buffer = bytearray()
+        self.offset = 0 # Stream offset of buffer[0]
+        self.bad_start = None # Stream offset of the start of the current bad region
+        self.bad_reason = None
+
+    def _bad(self, pos, reason):
+        # Start (or extend) a bad region at buffer position pos. Returns the position of the next sync chars
+        if self.bad_start is None:
+            self.bad_start = self.offset + pos
+            self.bad_reason = reason
+        nxt = self.buffer.find(SYNC, pos + 1)
+        if nxt < 0:
+            # Keep a trailing 0xB5 as it could be the start of the next frame
+            nxt = len(self.buffer) - 1 if self.buffer[-1:] == b'\xb5' else len(self.buffer)
+        return nxt
+
+    def feed(self, data):
+        ''' Parse data. Returns the number of complete, valid frames found '''
+        self.buffer += data
+        buf = self.buffer
+        size = len(buf)
+        stats = self.stats
+        unpack_header = HEADER.unpack_from
+        frames = 0
+        pos = 0
+        while size - pos >= 2:
+            if (buf[pos] != 0xB5) or (buf[pos+1] != 0x62):
+                pos = self._bad(pos, BAD_SYNC)
+                continue
+            if size - pos < HEADER_LEN: break
+            msg_class, msg_id, length = unpack_header(buf, pos + 2)
+            if length > self.max_length:
+                pos = self._bad(pos, BAD_LENGTH)
+                continue
+            end = pos + HEADER_LEN + length
+            if end + 2 > size: break # Wait for the rest of the frame
+            sum1,sum2 = ubx_checksum(memoryview(buf)[pos+2:end])
+            if (buf[end] != sum1) or (buf[end+1] != sum2):
+                if self.bad_start is None:
+                    stats.checksum_errors += 1
+                else:
+                    stats.false_syncs += 1
+                pos = self._bad(pos, BAD_CHECKSUM)
+                continue
+
+            # Valid frame
+            if self.bad_start is not None:
+                stats.bad_regions.append((self.bad_start, self.offset + pos - self.bad_start, self.bad_reason))
+                self.bad_start = None
+            stats.add(msg_class, msg_id, length)
+            frames += 1
+            if self.on_frame is not None:
+                with memoryview(buf) as view:
+                    self.on_frame(self.offset + pos, msg_class, msg_id, view[pos+HEADER_LEN:end])
+            pos = end + 2
+        del buf[:pos]
+        self.offset += pos
+        stats.end = self.offset
+        return frames
+
+    def finish(self):
+        ''' End of the stream: anything left in the buffer is an incomplete frame or bad data '''
+        if len(self.buffer) > 0 and self.bad_start is None:
+            self.bad_start = self.offset
+            self.bad_reason = TRUNCATED if self.buffer[:2] == SYNC else BAD_SYNC
+        if self.bad_start is not None:
+            end = self.offset + len(self.buffer)
+            self.stats.bad_regions.append((self.bad_start, end - self.bad_start, self.bad_reason))
+            self.bad_start = None
+        self.offset += len(self.buffer)
+        del self.buffer[:]
+
+# Memory-map filename and scan it
+def scan_file(filename, verbose=False, max_length=MAX_LENGTH):
+    filesize = os.path.getsize(filename)
+    stats = UBXStats(filesize)
+    if filesize == 0:
+        return stats # mmap cannot map an empty file
+    with open(filename, 'rb') as fi:
+        mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            scan_buffer(mm, stats, verbose, max_length=max_length)
+        finally:
+            mm.close()
+    return stats
+
+# Write the bad regions to a small .csv file: offset,length,reason
+def save_bad_regions(filename, bad_regions):
+    with open(filename, 'w') as fo:
+        for offset, length, reason in bad_regions:
+            fo.write('%i,%i,%s\n'%(offset,length,reason))
+
+def load_bad_regions(filename):
+    bad_regions = []
+    with open(filename, 'r') as fi:
+        for line in fi:
+            offset, length, reason = line.strip().split(',')
+            bad_regions.append((int(offset), int(length), reason))
+    return bad_regions
+
+# Copy filename to outfile leaving out the bad regions. No parsing needed, just one sequential copy
+def repair_file(filename, outfile, bad_regions):
+    filesize = os.path.getsize(filename)
+    written = 0
+    with open(filename, 'rb') as fi, open(outfile, 'wb') as fo:
+        if filesize == 0: return 0
+        mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = 0
+            for offset, length, reason in sorted(bad_regions) + [(filesize, 0, None)]:
+                if offset > pos:
+                    fo.write(mm[pos:offset])
+                    written += offset - pos
+                pos = max(pos, offset + length)
+        finally:
+            mm.close()
+    return written
+
+# Check the frames which start in bytes [start, stop) of filename. Used by check_files
+# Chunks will usually start part way through a frame; the scan resyncs at the first valid frame
+# and the data before it is left for merge_chunks to sort out. Returns a tuple of:
+# chunk start, first frame offset, end of last frame, reasons for the leading and trailing bad data,
+# offsets of the checksum failures before the first frame, UBXStats
+def check_chunk(task):
+    filename, start, stop = task
+    stats = UBXStats()
+    first = None
+    lead_failures = []
+    if stop > start:
+        def on_frames(frames):
+            nonlocal first
+            if first is None: first = int(frames[0,0])
+        with open(filename, 'rb') as fi:
+            mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                scan_buffer(mm, stats, start=start, stop=stop, on_frames=on_frames, print_errors=False, resync=lead_failures)
+            finally:
+                mm.close()
+    lead = None
+    trail = None
+    inner = []
+    for region in stats.bad_regions:
+        if (first is None) or (region[0] < first):
+            if lead is None: lead = region[2]
+        elif region[0] >= stats.end:
+            trail = region[2]
         else:
-            messages[message_type] = 1 # if we have not, set its count to 1
-
-        # Update the longest message length
-        if (length > longest): longest = length
-
-finally:
-    fi.close() # Close the file
-
-    # Print the file statistics
-    print
-    print 'Processed',processed,'bytes'
-    print 'File size was',filesize
-    if (processed != filesize):
-        print 'FILE SIZE MISMATCH!!'
-    print 'Longest message was %i data bytes'%longest
-    if len(messages) > 0:
-        print 'Message types and totals were:'
-        for key in messages.keys():
-            print 'Message type:',key,'  Total:',messages[key]
-
-    print 'Bye!'
+            inner.append(region)
+    stats.bad_regions = inner
+    return start, first, (stats.end if first is not None else None), lead, trail, lead_failures, stats
+
+# Combine the check_chunk results for one file (in chunk order) into a single UBXStats
+def merge_chunks(filesize, results):
+    stats = UBXStats(filesize)
+    prev_end = 0 # End of the last valid frame
+    pending = None # Reason for the bad data after prev_end
+    for start, first, end, lead, trail, lead_failures, chunk in results:
+        # The chunk couldn't tell a damaged frame from a false sync before its first frame. Failures
+        # before prev_end are inside a valid frame; one right at prev_end is a damaged frame
+        for offset in lead_failures:
+            if offset == prev_end:
+                stats.checksum_errors += 1
+                if pending is None: pending = BAD_CHECKSUM
+            elif offset > prev_end:
+                stats.false_syncs += 1
+        if first is None:
+            if pending is None: pending = lead
+            continue
+        if first > prev_end:
+            stats.bad_regions.append((prev_end, first - prev_end, pending or lead or BAD_SYNC))
+        stats.bad_regions.extend(chunk.bad_regions)
+        stats.merge(chunk)
+        prev_end = end
+        pending = trail
+    if prev_end < filesize:
+        stats.bad_regions.append((prev_end, filesize - prev_end, pending or TRUNCATED))
+    stats.filesize = filesize
+    stats.end = prev_end
+    return stats
+
+# Check many files in parallel. Files larger than chunk_size are split into chunks so one
+# big file can use all the cores too. Returns a dictionary of filename : UBXStats
+def check_files(filenames, processes=None, chunk_size=1<<26):
+    tasks = []
+    for filename in filenames:
+        filesize = os.path.getsize(filename)
+        for start in range(0, max(filesize, 1), chunk_size):
+            tasks.append((filename, start, min(start + chunk_size, filesize)))
+    results = {}
+    for filename in filenames: results[filename] = []
+    with ProcessPoolExecutor(processes) as pool:
+        for task, result in zip(tasks, pool.map(check_chunk, tasks)):
+            results[task[0]].append(result)
+    all_stats = {}
+    for filename in filenames:
+        all_stats[filename] = merge_chunks(os.path.getsize(filename), results[filename])
+    return all_stats
+
+# Find all the files with extension in the directory tree under top
+def find_files(top='.', extension='.bin'):
+    found = []
+    for root, dirs, files in os.walk(top):
+        for afile in files:
+            if afile[-4:] == extension:
+                found.append(os.path.join(root, afile))
+    return sorted(found)
+
+# Check every .bin file under directory and print a combined report
+def batch_check(directory, processes=None):
+    filenames = find_files(directory)
+    print('Checking',len(filenames),'files in',directory)
+    all_stats = check_files(filenames, processes)
+    total = UBXStats()
+    for filename in filenames:
+        stats = all_stats[filename]
+        print('%s  %i bytes  %i frames  %i bad regions (%i bytes)  %i checksum failures'%(filename,stats.filesize,
+              sum(stats.messages.values()),len(stats.bad_regions),stats.skipped(),stats.checksum_errors))
+        total.merge(stats)
+    total.report()
+    return all_stats
+
+# Find first .bin file in the current directory
+def find_first_file(extension='.bin'):
+    firstfile = ''
+    for root, dirs, files in os.walk("."):
+        if len(files) > 0:
+            if root == ".": # Comment this line to check sub-directories too
+                for afile in files:
+                    if afile[-4:] == extension:
+                        if firstfile == '': firstfile = afile
+    return firstfile
+
+def main(argv):
+    print('UBX Binary File Checker')
+
+    verbose = '-v' in argv # Print every message type and length
+    repair = '-r' in argv # Write the bad region index and a repaired copy of the file
+    index = '-i' in argv # Write the .ubxidx frame index
+    batch = '-b' in argv # Check all the .bin files in a directory tree, in parallel
+    argv = [arg for arg in argv if arg not in ['-v', '-r', '-i', '-b']]
+
+    if batch:
+        directory = '.'
+        if len(argv) > 1: directory = argv[1]
+        batch_check(directory)
+        print('Bye!')
+        return
+
+    filename = ''
+
+    if filename == '':
+        # Check if the bin filename was passed in argv
+        if len(argv) > 1: filename = argv[1]
+
+    firstfile = find_first_file()
+
+    # Ask user for .bin filename offering firstfile as the default
+    if filename == '': filename = input('Enter the bin filename (default: ' + firstfile + '): ') # Get the filename
+    if filename == '': filename = firstfile
+
+    print('Processing',filename)
+
+    # Try to open file for reading
+    if not os.path.isfile(filename):
+        raise Exception('Invalid file!')
+
+    if index:
+        # Check the file and (re)write its frame index in the same pass
+        import UBX_Index
+        print('Writing frame index to',UBX_Index.index_filename(filename))
+        stats = UBX_Index.update_index(filename, rebuild=True, verbose=verbose)
+    else:
+        stats = scan_file(filename, verbose)
+    stats.report()
+
+    if repair and len(stats.bad_regions) > 0:
+        filenamestem = filename[:-4]
+        badfile = filenamestem + '.bad.csv'
+        print()
+        print('Writing bad regions to',badfile)
+        save_bad_regions(badfile, stats.bad_regions)
+        outfile = filenamestem + '_repaired' + filename[-4:]
+        print('Writing repaired file to',outfile)
+        repair_file(filename, outfile, stats.bad_regions)
+
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
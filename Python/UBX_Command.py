@@ -0,0 +1,405 @@
+# Command / acknowledgement engine for configuring the NEO-M8T
+
+# Every command goes to the serial port as one complete frame, and several commands can be in
+# flight at once. Each reply is matched to its command by class and ID: ACK-ACK and ACK-NAK carry
+# the class and ID of the message they acknowledge, and the reply to a poll has the same class and
+# ID as the poll itself. The receiver answers in order, so commands with the same class and ID
+# (e.g. several CFG-MSG) are matched first in, first out. Commands which time out are sent again
+# up to retries times. Nothing sleeps for a fixed time: configuration takes as long as the
+# receiver takes to answer, typically a few milliseconds per message.
+
+# Usage: python UBX_Command.py
+# Configures a simulated receiver on a pseudo-terminal and reports how long it took
+
+import os
+import sys
+import time
+import select
+import threading
+import collections
+
+import UBX_Checker
+
+ACK_CLASS = 0x05
+ACK_NAK = 0x00
+ACK_ACK = 0x01
+CFG_CLASS = 0x06
+CFG_MSG = 0x01
+CFG_PRT = 0x00
+
+# What a command waits for
+EXPECT_ACK = 'ack' # ACK-ACK or ACK-NAK
+EXPECT_RESPONSE = 'response' # A message with the same class and ID (poll)
+EXPECT_NONE = 'none' # Nothing (fire and forget)
+
+# Command outcomes
+ACK = 'ACK'
+NAK = 'NAK'
+RESPONSE = 'RESPONSE'
+SENT = 'SENT'
+TIMEOUT = 'TIMEOUT'
+
+# A CFG message with no payload (or just the port / message type) polls the current setting
+def is_poll(msg_class, msg_id, payload):
+    if msg_class != CFG_CLASS: return False
+    if len(payload) == 0: return True
+    if (msg_id == CFG_MSG) and (len(payload) == 2): return True
+    if (msg_id == CFG_PRT) and (len(payload) == 1): return True
+    return False
+
+class Command(object):
+    ''' One UBX message to send, and what to wait for
+
+    By default CFG messages wait for ACK-ACK / ACK-NAK, CFG polls wait for the reply and all
+    other messages are sent without waiting. timeout and retries override the engine defaults.
+    frame is the complete, checksummed frame if it has already been built (e.g. from a cached profile) '''
+
+    def __init__(self, msg_class, msg_id, payload=b'', expect=None, timeout=None, retries=None, frame=None):
+        self.msg_class = msg_class
+        self.msg_id = msg_id
+        self.payload = bytes(payload)
+        if expect is None:
+            if is_poll(msg_class, msg_id, self.payload): expect = EXPECT_RESPONSE
+            elif msg_class == CFG_CLASS: expect = EXPECT_ACK
+            else: expect = EXPECT_NONE
+        self.expect = expect
+        self.timeout = timeout
+        self.retries = retries
+        self.frame = bytes(frame) if frame is not None else UBX_Checker.ubx_frame(msg_class, msg_id, self.payload)
+
+    @classmethod
+    def from_frame(cls, msg, **kwargs):
+        ''' Command from a frame in the logger's b"\\xB5\\x62..." syntax, with or without the checksum '''
+        msg = bytes(msg)
+        if (len(msg) < UBX_Checker.HEADER_LEN) or (msg[:2] != UBX_Checker.SYNC):
+            raise ValueError('Not a UBX frame!')
+        msg_class, msg_id, length = UBX_Checker.HEADER.unpack_from(msg, 2)
+        if len(msg) not in (UBX_Checker.HEADER_LEN + length, UBX_Checker.OVERHEAD + length):
+            raise ValueError('UBX frame length does not match its length field!')
+        return cls(msg_class, msg_id, msg[UBX_Checker.HEADER_LEN:UBX_Checker.HEADER_LEN + length], **kwargs)
+
+    def key(self):
+        return (self.msg_class, self.msg_id)
+
+    def name(self):
+        name = UBX_Checker.message_name(self.msg_class, self.msg_id)
+        if (self.msg_class, self.msg_id) == (CFG_CLASS, CFG_MSG) and len(self.payload) >= 2:
+            name += ' ' + UBX_Checker.message_name(self.payload[0], self.payload[1])
+        return name
+
+class CommandResult(object):
+    ''' The outcome of one command: status, number of attempts, seconds from first send to reply
+    and (for polls) the reply payload '''
+
+    def __init__(self, command):
+        self.command = command
+        self.status = None
+        self.attempts = 0
+        self.elapsed = None
+        self.response = None
+        self.first_sent = None
+
+    def ok(self):
+        return self.status in (ACK, RESPONSE, SENT)
+
+    def __str__(self):
+        elapsed = '' if self.elapsed is None else ' in %.3f s'%self.elapsed
+        return '%-24s %-8s after %i attempt%s%s'%(self.command.name(), self.status, self.attempts,
+                                                 '' if self.attempts == 1 else 's', elapsed)
+
+class UBXCommander(object):
+    ''' Sends commands to the receiver and matches the replies
+
+    Up to window commands are in flight at once; each batch of commands goes to the port in a
+    single write. Everything else the receiver sends, except the ACK frames and the replies to the
+    commands, is passed on unchanged to on_data(data) (e.g. to write residual RXM-RAWX data to the log at shutdown). '''
+
+    def __init__(self, ser, timeout=0.5, retries=2, window=8, on_data=None, poll_interval=0.002):
+        self.ser = ser
+        self.timeout = timeout
+        self.retries = retries
+        self.window = window
+        self.on_data = on_data
+        self.poll_interval = poll_interval
+        self.parser = UBX_Checker.UBXStreamParser(on_frame=self._on_frame)
+        self._raw = bytearray() # Data read but not yet passed on
+        self._passed = 0 # Stream offset of _raw[0]
+        self._replies = [] # Stream (start, end) of ACK frames and replies not yet cut out
+        self._pending = collections.defaultdict(collections.deque) # (class, ID) -> in-flight result numbers
+        self._results = []
+
+    def _resolve(self, key, expect, status, payload=None):
+        # Resolve the oldest in-flight command for key which is waiting for expect. The receiver follows
+        # the reply to a CFG poll with an ACK-ACK, so a CFG poll stays in flight until its ACK has arrived
+        # too (otherwise that ACK would resolve the next command with the same key, e.g. a set after the poll)
+        queue = self._pending.get(key)
+        if not queue: return False
+        for n in queue:
+            result = self._results[n]
+            command = result.command
+            if expect == EXPECT_RESPONSE:
+                if (command.expect != EXPECT_RESPONSE) or (result.status is not None): continue
+                if command.msg_class != CFG_CLASS: queue.remove(n)
+            elif command.expect == EXPECT_RESPONSE:
+                if command.msg_class != CFG_CLASS: continue
+                queue.remove(n)
+                if (result.status is not None) and (status == ACK): return True # The poll's reply came first
+            elif command.expect == EXPECT_ACK:
+                queue.remove(n)
+            else:
+                continue
+            result.status = status
+            result.elapsed = time.perf_counter() - result.first_sent
+            if payload is not None: result.response = bytes(payload)
+            return True
+        return False
+
+    def _on_frame(self, offset, msg_class, msg_id, payload):
+        span = (offset, offset + UBX_Checker.OVERHEAD + len(payload))
+        if msg_class == ACK_CLASS and msg_id in (ACK_ACK, ACK_NAK):
+            self._replies.append(span)
+            if len(payload) >= 2:
+                self._resolve((payload[0], payload[1]), EXPECT_ACK, ACK if msg_id == ACK_ACK else NAK)
+        elif self._resolve((msg_class, msg_id), EXPECT_RESPONSE, RESPONSE, payload):
+            self._replies.append(span)
+
+    def _pass_on(self, end):
+        # Pass the data up to stream offset end to on_data, leaving out the ACK frames and replies
+        if end <= self._passed: return
+        out = bytearray()
+        pos = self._passed
+        for start, stop in self._replies:
+            out += self._raw[pos - self._passed:max(start, pos) - self._passed]
+            pos = max(stop, pos)
+        out += self._raw[pos - self._passed:end - self._passed]
+        del self._raw[:end - self._passed]
+        self._passed = end
+        self._replies = []
+        if out: self.on_data(bytes(out))
+
+    def _read(self):
+        # Read whatever has arrived, waiting at most poll_interval
+        waiting = self.ser.in_waiting
+        data = self.ser.read(waiting if waiting > 0 else 1)
+        if len(data) == 0: return
+        if self.on_data is not None: self._raw += data
+        self.parser.feed(data)
+        # Only the incomplete frame (if any) at the end of the parser's buffer is held back
+        if self.on_data is not None: self._pass_on(self.parser.offset)
+
+    def run(self, commands, preamble=b''):
+        ''' Send the commands and wait for their replies. Returns a CommandResult for each command, in order.
+        preamble (e.g. NMEA sentences) goes in the same write as the first batch of commands '''
+        self._results = [CommandResult(c) for c in commands]
+        self._pending.clear()
+        todo = collections.deque(range(len(self._results)))
+        in_flight = {} # result number -> deadline
+        old_timeout = self.ser.timeout
+        self.ser.timeout = self.poll_interval
+        try:
+            while todo or in_flight:
+                # Top up the window and send the whole batch in one write
+                batch = bytearray(preamble)
+                preamble = b''
+                now = time.perf_counter()
+                while todo and (len(in_flight) < self.window):
+                    n = todo.popleft()
+                    result = self._results[n]
+                    command = result.command
+                    batch += command.frame
+                    result.attempts += 1
+                    if result.first_sent is None: result.first_sent = now
+                    if command.expect == EXPECT_NONE:
+                        result.status = SENT
+                        continue
+                    in_flight[n] = now + (self.timeout if command.timeout is None else command.timeout)
+                    self._pending[command.key()].append(n)
+                if batch:
+                    self.ser.write(batch)
+                    self.ser.flush()
+
+                self._read()
+
+                # Retire the replies and retry (or give up on) anything which has timed out
+                now = time.perf_counter()
+                for n, deadline in list(in_flight.items()):
+                    result = self._results[n]
+                    pending = self._pending[result.command.key()]
+                    if (result.status is not None) and (n not in pending):
+                        del in_flight[n]
+                    elif now > deadline:
+                        del in_flight[n]
+                        pending.remove(n)
+                        if result.status is not None: continue # A poll which had its reply but not its ACK
+                        retries = self.retries if result.command.retries is None else result.command.retries
+                        if result.attempts <= retries:
+                            todo.appendleft(n)
+                        else:
+                            result.status = TIMEOUT
+                            result.elapsed = now - result.first_sent
+
+            # Pass on anything else which has already arrived, including any incomplete frame
+            while self.ser.in_waiting > 0:
+                self._read()
+            if self.on_data is not None: self._pass_on(self._passed + len(self._raw))
+        finally:
+            self.ser.timeout = old_timeout
+        return self._results
+
+    def send(self, msg_class, msg_id, payload=b'', **kwargs):
+        ''' Send one command and wait for its reply. Returns its CommandResult '''
+        return self.run([Command(msg_class, msg_id, payload, **kwargs)])[0]
+
+class CommandResponder(object):
+    ''' The NEO-M8T's side of the configuration conversation, without any port
+
+    CFG messages are acknowledged (ACK-NAK for the (class, ID)s in nak) and polls are answered
+    with the last payload set, followed by an ACK-ACK (polls are never rejected). Everything else is ignored. The first drop commands are ignored,
+    so the retries can be exercised. feed() returns the reply frames for the data received '''
+
+    def __init__(self, nak=(), drop=0):
+        self.nak = set(nak)
+        self.drop = drop
+        self.received = [] # (class, ID, payload) of every command
+        self.settings = {}
+        self._replies = []
+        self.parser = UBX_Checker.UBXStreamParser(on_frame=self._on_frame)
+
+    def _on_frame(self, offset, msg_class, msg_id, payload):
+        payload = bytes(payload)
+        self.received.append((msg_class, msg_id, payload))
+        if self.drop > 0:
+            self.drop -= 1
+            return
+        if msg_class != CFG_CLASS: return
+        key = (msg_class, msg_id) if msg_id != CFG_MSG else (msg_class, msg_id) + tuple(payload[:2])
+        poll = is_poll(msg_class, msg_id, payload)
+        if poll:
+            self._replies.append(UBX_Checker.ubx_frame(msg_class, msg_id, self.settings.get(key, payload)))
+        elif (msg_class, msg_id) not in self.nak:
+            self.settings[key] = payload
+        reply = ACK_NAK if (not poll) and ((msg_class, msg_id) in self.nak) else ACK_ACK
+        self._replies.append(UBX_Checker.ubx_frame(ACK_CLASS, reply, bytes((msg_class, msg_id))))
+
+    def feed(self, data):
+        ''' Parse data from the host. Returns a list of reply frames '''
+        self.parser.feed(data)
+        replies = self._replies
+        self._replies = []
+        return replies
+
+class SimulatedReceiver(object):
+    ''' A minimal stand-in for the NEO-M8T on a pseudo-terminal, for checking the command engine
+
+    Commands are answered by a CommandResponder (nak and drop are passed to it). Data is paced at
+    baud, and each reply follows ack_delay seconds after its command. port is the name of the
+    serial device to open. '''
+
+    def __init__(self, baud=115200, ack_delay=0.002, nak=(), drop=0):
+        import pty
+        import tty
+        self.baud = baud
+        self.ack_delay = ack_delay
+        self.responder = CommandResponder(nak, drop)
+        self.received = self.responder.received
+        self.settings = self.responder.settings
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._write_lock = threading.Lock() # Replies and unsolicited data are written whole
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='SimulatedReceiver', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready: continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            time.sleep(len(data) * 10. / self.baud) # Time to receive data at baud
+            for reply in self.responder.feed(data):
+                time.sleep(self.ack_delay + (len(reply) * 10. / self.baud))
+                self.write(reply)
+
+    def write(self, data):
+        ''' Send unsolicited data (e.g. RXM-RAWX frames) to the port '''
+        with self._write_lock:
+            view = memoryview(data)
+            while len(view) > 0: # os.write can be partial when the pty buffer is full
+                view = view[os.write(self.master, view):]
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+# Checks for main: title, SimulatedReceiver args, UBXCommander args, commands (None: the logger's start-up
+# configuration) and a function of the results which returns (ok, what it checked)
+def startup_ok(results):
+    return all((r.status == ACK) and (r.attempts == 1) for r in results), 'all ACK first time'
+
+def retried_ok(results):
+    return (all(r.status == ACK for r in results) and (sum(r.attempts for r in results) > len(results)),
+            'all ACK after retries')
+
+def nak_ok(results):
+    gnss = [r.status == NAK for r in results if r.command.key() == (CFG_CLASS, 0x3E)]
+    others = [r.status == ACK for r in results if r.command.key() != (CFG_CLASS, 0x3E)]
+    return (gnss == [True]) and all(others), 'CFG-GNSS NAK, the rest ACK'
+
+def poll_ok(results):
+    statuses = [r.status for r in results]
+    return ((statuses == [RESPONSE, NAK, RESPONSE, RESPONSE, ACK, RESPONSE]) and
+            (results[5].response == results[4].command.payload),
+            'poll, rejected set, poll of CFG-GNSS then poll, set, poll of CFG-NAV5 answered in order')
+
+MAX_SECONDS = 0.5 # "Well under a second"
+
+def main(argv):
+    import serial
+    import UBX_Profile # The logger's start-up configuration
+
+    print('UBX Command Engine Check')
+    # Each poll's trailing ACK-ACK must not be taken as the reply to the set which follows it
+    polls = [Command(CFG_CLASS, 0x3E), Command(CFG_CLASS, 0x3E, bytes(4)), Command(CFG_CLASS, 0x3E),
+             Command(CFG_CLASS, 0x24), Command(CFG_CLASS, 0x24, bytes(range(36))), Command(CFG_CLASS, 0x24)]
+    checks = [('Start-up configuration', {}, {}, None, startup_ok),
+              ('With 2 lost replies', {'drop': 2}, {'timeout': 0.1}, None, retried_ok),
+              ('With CFG-GNSS rejected', {'nak': [(0x06, 0x3E)]}, {}, None, nak_ok),
+              ('Polls pipelined with sets', {'nak': [(0x06, 0x3E)]}, {}, polls, poll_ok)]
+    failures = 0
+    for title, receiver_args, commander_args, commands, check in checks:
+        receiver = SimulatedReceiver(**receiver_args)
+        ser = serial.Serial(receiver.port, receiver.baud, timeout=0.1)
+        try:
+            print()
+            print(title)
+            commander = UBXCommander(ser, **commander_args)
+            start = time.perf_counter()
+            preamble = b''
+            if commands is None:
+                preamble, commands = UBX_Profile.split_blob(UBX_Profile.compile_profile(UBX_Profile.DEFAULT_PROFILE))
+            results = commander.run(commands, preamble)
+            elapsed = time.perf_counter() - start
+            for result in results: print(result)
+            ok, what = check(results)
+            fast = elapsed < MAX_SECONDS
+            failures += (not ok) + (not fast)
+            print('%i of %i commands succeeded in %.3f s'%(sum(r.ok() for r in results), len(results), elapsed))
+            print('%s: %s'%(what, 'ok' if ok else 'FAIL'))
+            print('Under %.1f s: %s'%(MAX_SECONDS, 'ok' if fast else 'FAIL'))
+        finally:
+            ser.close()
+            receiver.close()
+    print()
+    print('%i checks failed'%failures if failures else 'All checks passed')
+    print('Bye!')
+    if failures: sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,246 @@
+# Persistent frame index (.ubxidx sidecar) for u-blox binary files
+
+# The index holds one fixed-size record per valid frame: file offset, class, ID, payload length,
+# GPS week and time of week. RXM-RAWX frames provide week and rcvTow, NAV frames provide iTOW;
+# all other frames (RXM-SFRBX, TIM-TM2, ...) inherit the time of the frame before them, so the
+# time column increases through the file and can be searched with a binary search.
+#
+# The sidecar is written next to the log. When the log has grown since the index was written,
+# only the new data is scanned and the new records are appended.
+
+# Usage: python UBX_Index.py filename.bin
+# Creates or updates filename.ubxidx and prints a summary of the index
+
+import sys
+import os
+import mmap
+import struct
+import zlib
+
+import numpy as np
+
+import UBX_Checker
+
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('msg_class', 'u1'), ('msg_id', 'u1'), ('length', '<u2'), ('week', '<u2'), ('tow', '<f8')])
+
+# Sidecar header: magic, bytes of the log indexed so far, record count, log signature,
+# and the week and tow carried forward from the last timed frame. Padded to 64 bytes
+INDEX_MAGIC = b'UBXIDX\x01\x00'
+INDEX_HEADER = struct.Struct('<8sQQIHd26x')
+
+SECONDS_PER_WEEK = 604800
+SIGNATURE_BYTES = 1024 # The log signature is the CRC32 of (up to) this many bytes from the start of the log
+
+# Sidecar filename for a log
+def index_filename(filename):
+    return filename[:-4] + '.ubxidx'
+
+# Continuous GPS time in seconds
+def gps_seconds(week, tow):
+    return (np.asarray(week, dtype=np.float64) * SECONDS_PER_WEEK) + tow
+
+# CRC32 of the first length bytes of the log. Used to spot a log which has been replaced
+def log_signature(fi, length):
+    fi.seek(0)
+    return zlib.crc32(fi.read(min(length, SIGNATURE_BYTES)))
+
+# Gather num_bytes little-endian fields at offsets from raw and convert them to dtype
+def gather(raw, offsets, num_bytes, dtype):
+    return raw[offsets[:,np.newaxis] + np.arange(num_bytes)].view(dtype)[:,0]
+
+# Week and time of week for each of the frames ((start, class, ID, length) rows)
+# Frames which don't carry a time inherit it from the frame before; the first frames inherit week, tow
+def frame_times(raw, frames, week, tow):
+    n = len(frames)
+    starts = frames[:,0]
+    classes = frames[:,1]
+    ids = frames[:,2]
+    lengths = frames[:,3]
+    own_tow = np.full(n, np.nan)
+    own_week = np.full(n, -1, dtype=np.int64)
+
+    # RXM-RAWX: rcvTow (R8) at payload offset 0, week (U2) at payload offset 8
+    rawx = np.nonzero((classes == 0x02) & (ids == 0x15) & (lengths >= 16))[0]
+    if len(rawx) > 0:
+        payload = starts[rawx] + UBX_Checker.HEADER_LEN
+        own_tow[rawx] = gather(raw, payload, 8, '<f8')
+        own_week[rawx] = gather(raw, payload + 8, 2, '<u2')
+
+    # NAV: iTOW (U4, ms) at payload offset 0
+    nav = np.nonzero((classes == 0x01) & (lengths >= 4))[0]
+    if len(nav) > 0:
+        own_tow[nav] = gather(raw, starts[nav] + UBX_Checker.HEADER_LEN, 4, '<u4') / 1000.
+
+    # Carry the last known time forward
+    latest = np.maximum.accumulate(np.where(np.isnan(own_tow), -1, np.arange(n)))
+    tow_out = np.where(latest >= 0, own_tow[np.maximum(latest, 0)], tow)
+    latest = np.maximum.accumulate(np.where(own_week < 0, -1, np.arange(n)))
+    week_out = np.where(latest >= 0, own_week[np.maximum(latest, 0)], week)
+    return week_out, tow_out
+
+# Build index records for the frames
+def frame_records(raw, frames, week, tow):
+    records = np.empty(len(frames), dtype=INDEX_DTYPE)
+    records['offset'] = frames[:,0]
+    records['msg_class'] = frames[:,1]
+    records['msg_id'] = frames[:,2]
+    records['length'] = frames[:,3]
+    records['week'], records['tow'] = frame_times(raw, frames, week, tow)
+    return records
+
+# Read the sidecar header. Returns (indexed, count, signature, week, tow) or None if there is no valid sidecar
+def read_index_header(idxfile):
+    try:
+        with open(idxfile, 'rb') as fi:
+            header = fi.read(INDEX_HEADER.size)
+    except (IOError, OSError):
+        return None
+    if len(header) != INDEX_HEADER.size:
+        return None
+    magic, indexed, count, signature, week, tow = INDEX_HEADER.unpack(header)
+    if magic != INDEX_MAGIC:
+        return None
+    if os.path.getsize(idxfile) < INDEX_HEADER.size + (count * INDEX_DTYPE.itemsize):
+        return None
+    return indexed, count, signature, week, tow
+
+# Create or update the index for filename
+# If the log has grown, only the new data is scanned. If the log has been replaced or truncated
+# (or rebuild is True) the index is rebuilt from scratch. Returns the UBXStats for the data scanned
+def update_index(filename, rebuild=False, verbose=False):
+    idxfile = index_filename(filename)
+    filesize = os.path.getsize(filename)
+    header = None if rebuild else read_index_header(idxfile)
+
+    with open(filename, 'rb') as fi:
+        if header is not None:
+            indexed, count, signature, week, tow = header
+            if (indexed > filesize) or (log_signature(fi, indexed) != signature):
+                header = None # Different file: start again
+        if header is None:
+            indexed, count, week, tow = 0, 0, 0, np.nan
+
+        stats = UBX_Checker.UBXStats(filesize)
+        stats.end = indexed
+        new_records = []
+        if filesize > indexed:
+            mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                raw = np.frombuffer(mm, dtype=np.uint8)
+                def on_frames(frames):
+                    nonlocal week, tow
+                    records = frame_records(raw, frames, week, tow)
+                    week = int(records['week'][-1])
+                    tow = float(records['tow'][-1])
+                    new_records.append(records)
+                UBX_Checker.scan_buffer(mm, stats, verbose, start=indexed, on_frames=on_frames)
+                del raw, on_frames # Release the buffer so the mmap can close
+            finally:
+                mm.close()
+        signature = log_signature(fi, stats.end)
+
+    # Append the new records first and then rewrite the header, so an interrupted update
+    # leaves the old (smaller) record count in place
+    with open(idxfile, 'wb' if header is None else 'r+b') as fo:
+        if header is None:
+            fo.write(INDEX_HEADER.pack(INDEX_MAGIC, 0, 0, 0, 0, np.nan))
+        fo.seek(INDEX_HEADER.size + (count * INDEX_DTYPE.itemsize))
+        for records in new_records:
+            fo.write(records.tobytes())
+            count += len(records)
+        fo.truncate()
+        fo.flush()
+        fo.seek(0)
+        fo.write(INDEX_HEADER.pack(INDEX_MAGIC, stats.end, count, signature, week, tow))
+    return stats
+
+# Load the index records (memory-mapped, read only)
+def load_index(idxfile):
+    header = read_index_header(idxfile)
+    if header is None:
+        raise Exception('Invalid index file!')
+    count = header[1]
+    if count == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.memmap(idxfile, dtype=INDEX_DTYPE, mode='r', offset=INDEX_HEADER.size, shape=(count,))
+
+class UBXIndex(object):
+    ''' Random access into a UBX log through its .ubxidx sidecar '''
+
+    def __init__(self, filename, update=True):
+        self.filename = filename
+        self.idxfile = index_filename(filename)
+        if update or (read_index_header(self.idxfile) is None):
+            update_index(filename)
+        self.frames = load_index(self.idxfile)
+        self._times = None
+        self._type_order = None
+        self._type_keys = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def times(self):
+        ''' Continuous GPS time (seconds) of every frame. Frames before the first timed frame are -inf '''
+        if self._times is None:
+            times = gps_seconds(self.frames['week'], self.frames['tow'])
+            times[np.isnan(times)] = -np.inf
+            self._times = times
+        return self._times
+
+    def time_window(self, start, end):
+        ''' Records for the frames with start <= GPS time < end (binary search) '''
+        lo, hi = np.searchsorted(self.times(), [start, end], side='left')
+        return self.frames[lo:hi]
+
+    def message_type(self, msg_class, msg_id):
+        ''' Records for all frames of one message type, in file order (binary search) '''
+        if self._type_order is None:
+            keys = (self.frames['msg_class'].astype(np.uint16) << 8) | self.frames['msg_id']
+            self._type_order = np.argsort(keys, kind='stable')
+            self._type_keys = keys[self._type_order]
+        key = (msg_class << 8) | msg_id
+        lo, hi = np.searchsorted(self._type_keys, [key, key + 1], side='left')
+        return self.frames[self._type_order[lo:hi]]
+
+    def select(self, msg_class=None, msg_id=None, start=None, end=None):
+        ''' Records in a time window and / or of one message type '''
+        if (msg_class is not None) and (start is None) and (end is None):
+            return self.message_type(msg_class, msg_id)
+        records = self.frames
+        if (start is not None) or (end is not None):
+            records = self.time_window(-np.inf if start is None else start, np.inf if end is None else end)
+        if msg_class is not None:
+            records = records[(records['msg_class'] == msg_class) & (records['msg_id'] == msg_id)]
+        return records
+
+    def payloads(self, records):
+        ''' Yield the payload bytes of each record '''
+        with open(self.filename, 'rb') as fi:
+            for record in records:
+                fi.seek(int(record['offset']) + UBX_Checker.HEADER_LEN)
+                yield fi.read(int(record['length']))
+
+def main(argv):
+    print('UBX Frame Indexer')
+
+    filename = ''
+    if len(argv) > 1: filename = argv[1]
+    firstfile = UBX_Checker.find_first_file()
+    if filename == '': filename = input('Enter the bin filename (default: ' + firstfile + '): ') # Get the filename
+    if filename == '': filename = firstfile
+
+    print('Indexing',filename)
+    stats = update_index(filename)
+    print('Scanned',stats.processed + stats.skipped(),'new bytes')
+
+    index = UBXIndex(filename, update=False)
+    print('Index',index.idxfile,'contains',len(index),'frames')
+    timed = index.frames[np.isfinite(index.times())]
+    if len(timed) > 0:
+        print('GPS week %i TOW %.3f to GPS week %i TOW %.3f'%(timed['week'][0],timed['tow'][0],timed['week'][-1],timed['tow'][-1]))
+
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,340 @@
+## U-Blox NEO-M8T GNSS RAWX Logger for several receivers at once
+
+## Logs RXM-RAWX, RXM-SFRBX and TIM-TM2 messages from N FeatherWings running UBX_Echo
+## (e.g. a base and its rovers) in one process, one set of log files per port.
+
+## All of the receivers are configured at the same time. Then they are captured by
+## UBX_Capture.SelectorCapture: one reader thread waits on all of the serial ports with a selector,
+## reads whatever each port has into the ring buffers, and sleeps for batch_interval (so it wakes up
+## at most 1/batch_interval times a second however many ports there are). SerialCapture's writer
+## thread writes the data to each port's files. Adding a receiver adds bytes, not threads or wakeups.
+## (Ports without a fileno, e.g. on Windows, are polled with in_waiting on the same schedule.)
+
+## With -t, the files are cut on the receivers' own time (RXM-RAWX rcvTow) rather than the PC's
+## clock: every receiver starts a new file at the first epoch of each period and the files are named
+## after the start of the period, so the base and rover files line up one to one.
+## (Use --no-align to cut on the PC's clock instead.)
+
+## Usage: python UBX_MultiLogger.py [-p profile.json] [-q] [-b baud] [-s MB] [-t minutes] [-z gzip|zstd] PORT[=LABEL] ...
+##   e.g. python UBX_MultiLogger.py -t 60 COM3=base COM4=rover1 COM5=rover2
+##   Files are called GNSS_RAWX_Log_<LABEL>_<date>_<time>.bin (LABEL defaults to the port's name)
+##   --benchmark : measure the CPU time used to capture 1, 2, 4 and 8 simulated receivers into aligned
+##                 files, and check the files (POSIX only)
+##   --check : run this logger and a single-port logger in one directory while a third logger starts up
+##             there, and check that only the crashed .part file is recovered (POSIX only)
+
+import os
+import re
+import sys
+import time
+import struct
+import argparse
+import threading
+
+import UBX_Capture
+import UBX_Profile
+
+# PORT[=LABEL] -> (port, label). The label is used in the file names so it is kept to safe characters
+def parse_port(arg):
+    port, sep, label = arg.partition('=')
+    if not label: label = os.path.basename(port)
+    return port, re.sub(r'[^A-Za-z0-9_\-]+', '_', label)
+
+def run_all(function, items):
+    ''' Call function(item) for every item in its own thread. Returns the results (or the exceptions) in order '''
+    results = [None] * len(items)
+    def call(i, item):
+        try:
+            results[i] = function(item)
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=call, args=(i, item)) for i, item in enumerate(items)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return results
+
+# rcvTow of the RXM-RAWX at the start of data (None if it doesn't start with one)
+RAWX_START = b'\xb5\x62\x02\x15'
+def first_rcvTow(data):
+    if data[:4] != RAWX_START or len(data) < 14: return None
+    return struct.unpack_from('<d', data, 6)[0]
+
+# CPU time (reader + writer threads) to capture num_receivers simulated receivers, each replaying
+# num_epochs of a synthetic 4Hz log at speed times real time, into RotatingLogFiles aligned every
+# max_seconds. Receiver i starts i epochs late, so they don't all start at the start of a period.
+# Returns the capture, elapsed time and a list of problems with the files. POSIX only (uses pseudo-terminals)
+def benchmark(num_receivers, num_epochs=200, speed=10., baud=230400, batch_interval=0.02, max_seconds=10.):
+    import glob
+    import serial
+    import tempfile
+    import UBX_Benchmark
+    import UBX_Command
+    import UBX_Replay
+
+    frames = list(UBX_Benchmark.synthetic_frames(num_epochs))
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        sources = []
+        for i in range(num_receivers):
+            filename = os.path.join(directory, 'synthetic%i.bin'%i)
+            with open(filename, 'wb') as fo:
+                fo.write(b''.join(frames[3 * i:])) # Three frames per epoch
+            sources.append(filename)
+        receivers = [UBX_Command.SimulatedReceiver(baud) for i in range(num_receivers)]
+        ports = [UBX_Capture.CapturePort(serial.Serial(receiver.port, baud, timeout=0.1),
+                                         UBX_Capture.RotatingLogFile(prefix='sim%i_'%i, directory=directory,
+                                                                     max_seconds=max_seconds, align=True),
+                                         label='sim%i'%i) for i, receiver in enumerate(receivers)]
+        replays = [UBX_Replay.Replay(source, receiver.write, speed, baud, spin=0.) for source, receiver in zip(sources, receivers)]
+        capture = UBX_Capture.SelectorCapture(ports, batch_interval=batch_interval)
+        try:
+            capture.start()
+            threads = [replay.start() for replay in replays]
+            for thread in threads: thread.join()
+            deadline = time.time() + 5.
+            while any(port.bytes_written < os.path.getsize(source) for port, source in zip(ports, sources)) and time.time() < deadline:
+                time.sleep(0.01)
+            elapsed = time.time() - capture.start_time
+        finally:
+            capture.stop()
+            for port in ports:
+                port.ser.close()
+                port.fp.close()
+            for receiver in receivers: receiver.close()
+
+        # Every receiver's files, joined, are exactly what it sent. Its files have the same names
+        # as everyone else's and, after the first (which starts wherever the receiver started),
+        # start with the same epoch
+        names = None
+        starts = None
+        for port, source in zip(ports, sources):
+            files = [open(filename, 'rb').read() for filename in port.fp.finished]
+            if b''.join(files) != open(source, 'rb').read():
+                problems.append('%s: data mismatch'%port.label)
+            if port.error is not None:
+                problems.append(port.summary())
+            if len(glob.glob(os.path.join(directory, port.label + '_*'))) != len(files):
+                problems.append('%s: unexpected files'%port.label)
+            port_names = [os.path.basename(filename)[len(port.label) + 1:] for filename in port.fp.finished]
+            port_starts = [first_rcvTow(data) for data in files[1:]]
+            if names is None:
+                names, starts = port_names, port_starts
+            else:
+                if port_names != names: problems.append('%s: file names %s != %s'%(port.label, port_names, names))
+                if port_starts != starts: problems.append('%s: files start at %s != %s'%(port.label, port_starts, starts))
+        if len(names) < 2: problems.append('no files were cut')
+    return capture, elapsed, problems
+
+# Two captures in one directory: a SelectorCapture of two simulated receivers (like this logger) and a
+# SerialCapture of one (like NEO-M8T_GNSS_RAWX_Logger.py). Half way through, another process runs
+# recover_partial there, as a logger starting up does. Only the .part file left by a 'crash' should
+# be recovered; the live files must carry on. Returns a list of (check, ok). POSIX only (uses pseudo-terminals)
+def shared_directory_check(num_epochs=120, speed=10., baud=230400):
+    import glob
+    import serial
+    import subprocess
+    import tempfile
+    import UBX_Benchmark
+    import UBX_Command
+    import UBX_Replay
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'synthetic.bin')
+        num_bytes = UBX_Benchmark.write_synthetic_log(source, num_epochs)
+        data = open(source, 'rb').read()
+        crashed = os.path.join(directory, 'GNSS_RAWX_Log_crashed_20171221_000000.bin')
+        with open(crashed + UBX_Capture.PART, 'wb') as fo: fo.write(data[:num_bytes // 2])
+        receivers = [UBX_Command.SimulatedReceiver(baud) for i in range(3)]
+        ports = [UBX_Capture.CapturePort(serial.Serial(receiver.port, baud, timeout=0.1),
+                                         UBX_Capture.RotatingLogFile(prefix='GNSS_RAWX_Log_%s_'%label, directory=directory,
+                                                                     max_seconds=10., align=True), label=label)
+                 for receiver, label in zip(receivers, ('a0', 'a1', 'b'))]
+        multi = UBX_Capture.SelectorCapture(ports[:2])
+        single = UBX_Capture.SerialCapture(ports[2].ser, ports[2].fp, ports=ports[2:])
+        captures = [multi, single]
+        replays = [UBX_Replay.Replay(source, receiver.write, speed, baud, spin=0.) for receiver in receivers]
+        try:
+            for capture in captures: capture.start()
+            threads = [replay.start() for replay in replays]
+            deadline = time.time() + 30.
+            while any(port.bytes_written < num_bytes // 2 for port in ports) and time.time() < deadline:
+                time.sleep(0.01)
+            live = sorted(glob.glob(os.path.join(directory, '*' + UBX_Capture.PART)))
+            command = 'import UBX_Capture\nfor filename, removed in UBX_Capture.recover_partial(%r): print(filename)'%directory
+            recovered = subprocess.run([sys.executable, '-c', command], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, timeout=30.).stdout.splitlines()
+            for thread in threads: thread.join(max(deadline - time.time(), 0.)) # A replay into a dead capture can block
+            while any(port.bytes_written < num_bytes for port in ports) and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            for capture in captures: capture.stop()
+            for port in ports:
+                port.ser.close()
+                try:
+                    port.fp.close()
+                except Exception as e: # e.g. its .part file was recovered from under it
+                    port.error = e
+            for receiver in receivers: receiver.close()
+        results.append(('another logger starting up recovered only the crashed file (%i live files left alone)'%(len(live) - 1),
+                        (len(live) == 4) and (recovered == [crashed])))
+        for capture, port in zip((multi, multi, single), ports):
+            ok = (capture.error is None) and (port.error is None) and \
+                 (b''.join(open(filename, 'rb').read() for filename in port.fp.finished) == data)
+            results.append(('%s: all of the data, in %i files'%(port.label, len(port.fp.finished)), ok))
+        results.append(('no .part files left', not glob.glob(os.path.join(directory, '*' + UBX_Capture.PART))))
+    return results
+
+def run_benchmark():
+    ''' Returns True if every receiver's files were captured correctly and aligned '''
+    print('CPU time of the capture threads for N simulated receivers (4Hz, 20 satellites, 10x real time, 230400 baud)')
+    print('logging to files aligned every 10 seconds')
+    base = None
+    ok = True
+    for num_receivers in (1, 2, 4, 8):
+        capture, elapsed, problems = benchmark(num_receivers)
+        cpu = 100. * capture.cpu_time / elapsed
+        if base is None: base = cpu
+        print('%i receiver%s: CPU %5.2f%% (%.2fx one receiver, %.2f%% per receiver)  %.1f wakeups/s  %s'%(num_receivers,
+              ' ' if num_receivers == 1 else 's', cpu, cpu / base, cpu / num_receivers, capture.wakeups / elapsed,
+              'files ok' if not problems else 'FAIL'))
+        for problem in problems: print('  ' + problem)
+        if problems: ok = False
+    return ok
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='NEO-M8T GNSS RAWX Logger for several receivers')
+    parser.add_argument('ports', nargs='*', metavar='PORT[=LABEL]', help='serial ports (and labels for the file names)')
+    parser.add_argument('-q', action='store_true', help='no console output while logging')
+    parser.add_argument('-b', type=int, default=115200, metavar='BAUD', help='baud rate (default 115200)')
+    parser.add_argument('-s', type=float, default=None, metavar='MB', help='start a new file every MB megabytes')
+    parser.add_argument('-t', type=float, default=None, metavar='MINUTES', help='start a new file every MINUTES minutes')
+    parser.add_argument('-z', choices=['gzip', 'zstd'], default=None, help='compress finished files')
+    parser.add_argument('-p', default=None, metavar='PROFILE', help='receiver profile (JSON, see UBX_Profile.py)')
+    parser.add_argument('--no-align', action='store_true', help='cut the files on the PC clock, not the receivers\' time')
+    parser.add_argument('--fsync', type=float, default=10.0, metavar='SECONDS', help='fsync the log files every SECONDS seconds')
+    parser.add_argument('--benchmark', action='store_true', help='measure the CPU time for 1, 2, 4 and 8 simulated receivers')
+    parser.add_argument('--check', action='store_true', help='check that loggers sharing a directory leave each other\'s files alone')
+    args = parser.parse_args(argv[1:])
+
+    print('NEO-M8T GNSS RAWX Multi-Receiver Logger')
+    print()
+
+    if args.check:
+        failures = 0
+        for check, ok in shared_directory_check():
+            failures += not ok
+            print('%s: %s'%(check, 'ok' if ok else 'FAIL'))
+        print('%i checks failed'%failures if failures else 'All checks passed')
+        print('Bye!')
+        if failures: sys.exit(1)
+        return
+    if args.benchmark:
+        ok = run_benchmark()
+        print('Bye!')
+        if not ok: sys.exit(1)
+        return
+    if not args.ports:
+        parser.error('no serial ports given')
+
+    import serial
+
+    ports = []
+    capture = None
+
+    try:
+        profile = UBX_Profile.load_profile(args.p) # Check the profile before opening the ports
+
+        # Open all of the ports first, so a typo doesn't leave some receivers configured and some not
+        for arg in args.ports:
+            com_port, label = parse_port(arg)
+            try:
+                ser = serial.Serial(com_port, args.b, timeout=0.1)
+            except Exception:
+                raise NameError('COULD NOT OPEN SERIAL PORT %s!'%com_port)
+            ser.reset_input_buffer()
+            ports.append(UBX_Capture.CapturePort(ser, None, [UBX_Capture.EpochMonitor(profile['measRate'] / 1000.)], label))
+
+        # Configure all of the receivers at the same time (see UBX_Profile.py)
+        print('Configuring receivers:', ', '.join('%s %s'%(k, profile[k]) for k in ('dynModel', 'measRate', 'timeRef')),
+              '+'.join(profile['constellations']))
+        for port, results in zip(ports, run_all(lambda port: UBX_Profile.apply_profile(port.ser, profile), ports)):
+            if isinstance(results, Exception): raise results
+            ok = all(result.ok() for result in results)
+            print('%s: %i messages, %s'%(port.label, len(results), 'all acknowledged' if ok else
+                  'WARNING: not all of the configuration messages were acknowledged!'))
+
+        # Tidy up after any previous crash
+        for filename, removed in UBX_Capture.recover_partial():
+            print('Recovered', filename, '(removed %i bytes of incomplete frame)'%removed)
+
+        # Each port gets its own files. With align they are all cut on the receivers' time
+        for port in ports:
+            port.fp = UBX_Capture.RotatingLogFile(prefix='GNSS_RAWX_Log_%s_'%port.label,
+                                                  max_bytes=None if args.s is None else int(args.s * 1e6),
+                                                  max_seconds=None if args.t is None else args.t * 60.,
+                                                  fsync_interval=args.fsync, compress=args.z, align=not args.no_align)
+        filenames = dict((port.label, None) for port in ports)
+        print()
+        print('Press CTRL+C to stop logging')
+        print()
+
+        capture = UBX_Capture.SelectorCapture(ports)
+        capture.start()
+
+        # The main thread only reports progress (and waits for CTRL+C)
+        while capture.running():
+            time.sleep(1)
+            if args.q: continue
+            for port in ports:
+                monitor = port.sinks[0]
+                if port.fp.filename != filenames[port.label]:
+                    filenames[port.label] = port.fp.filename
+                    print('%s: logging data to %s'%(port.label, port.fp.filename))
+                for event in monitor.pop_events(): print('%s: %s'%(port.label, event))
+                print('%s: %s'%(port.label, monitor.summary()) if port.running() else port.summary())
+            print(capture.summary())
+        if capture.error is not None:
+            raise capture.error
+
+    except KeyboardInterrupt:
+        print()
+        print('CTRL+C received...')
+        if capture is None: return # Logging hadn't started
+        capture.stop() # Stop the threads. Everything read so far is written to disk
+        print(capture.summary())
+        for port in ports:
+            monitor = port.sinks[0]
+            for event in monitor.pop_events(): print('%s: %s'%(port.label, event))
+            print('%s: %s'%(port.label, monitor.summary()))
+            if not port.running(): print(port.summary())
+        print()
+        print('Disabling messages...')
+        # On all of the receivers at once. Any data still arriving is written to disk; the acknowledgements are not
+        def disable(port):
+            import UBX_Command
+            commands = [UBX_Command.Command.from_frame(msg) for msg in UBX_Profile.disable_frames(profile)]
+            return UBX_Command.UBXCommander(port.ser, on_data=port.fp.write).run(commands)
+        for port, results in zip(ports, run_all(disable, ports)):
+            if isinstance(results, Exception):
+                print('%s: %s'%(port.label, results))
+            elif not all(result.ok() for result in results):
+                print('%s: WARNING: not all of the messages were disabled!'%port.label)
+
+    finally:
+        if capture is not None: capture.stop()
+        for port in ports:
+            port.ser.close() # Close the serial port
+            if port.fp is not None:
+                port.fp.close() # Finish the last file (and wait for any compression)
+        if any(port.fp is not None for port in ports): print()
+        for port in ports:
+            if port.fp is None: continue
+            for filename in port.fp.finished: print('Logged data to', filename)
+            if port.fp.compressor is not None:
+                for filename in port.fp.compressor.compressed: print('Compressed to', filename)
+        print()
+        print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,236 @@
+# Receiver profiles for the NEO-M8T
+
+# A profile describes how the receiver should be set up: dynamic model, constellations,
+# measurement rate, time reference, the UBX messages to enable and the NMEA sentences to disable.
+# Profiles are JSON files, e.g.:
+#
+# {
+#     "dynModel": "stationary",
+#     "constellations": ["GPS", "Galileo", "GLONASS", "SBAS"],
+#     "measRate": 250,
+#     "timeRef": "UTC",
+#     "messages": {"RXM-RAWX": 1, "RXM-SFRBX": 1, "TIM-TM2": 1},
+#     "nmeaTalker": "GP",
+#     "disableNMEA": ["GLL", "ZDA", "VTG", "GSV", "GSA", "RMC", "GGA"]
+# }
+#
+# Missing fields take their values from DEFAULT_PROFILE (the configuration the logger has always
+# used). A profile is compiled into a blob: the PUBX,40 sentences followed by the checksummed UBX
+# frames, ready to go to the receiver in a single write. Blobs are cached on disk, named by a hash
+# of the profile, so the frames are only built once: a cached blob is checked once and its bytes are
+# sent as they are.
+
+# Usage: python UBX_Profile.py [profile.json]
+# Compiles the profile (or the default profile) and prints the frames in Python hex syntax
+
+import sys
+import os
+import json
+import struct
+import hashlib
+
+import UBX_Checker
+import UBX_Command
+
+# Bump this whenever the compiler output changes, so old cache files are not used
+COMPILER_VERSION = 1
+
+DEFAULT_PROFILE = {
+    'dynModel': 'stationary',
+    'constellations': ['GPS', 'Galileo', 'GLONASS', 'SBAS'],
+    'measRate': 250, # ms
+    'navRate': 1, # measurements per navigation solution
+    'timeRef': 'UTC',
+    'messages': {'RXM-RAWX': 1, 'RXM-SFRBX': 1, 'TIM-TM2': 1}, # Rate (per measurement), current port
+    'nmeaTalker': 'GP', # 'GP' avoids having to modify TinyGPS
+    'disableNMEA': ['GLL', 'ZDA', 'VTG', 'GSV', 'GSA', 'RMC', 'GGA'],
+}
+
+DYN_MODELS = {'portable': 0, 'stationary': 2, 'pedestrian': 3, 'automotive': 4, 'sea': 5,
+              'airborne1g': 6, 'airborne2g': 7, 'airborne4g': 8, 'wrist': 9}
+
+TIME_REFS = {'UTC': 0, 'GPS': 1, 'GLONASS': 2, 'BeiDou': 3, 'Galileo': 4}
+
+NMEA_TALKERS = {'GP': 1, 'GL': 2, 'GN': 3, 'GA': 4, 'GB': 5}
+
+# CFG-GNSS configuration blocks: name -> (gnssId, resTrkCh, maxTrkCh, flags without the enable bit)
+GNSS_BLOCKS = [('GPS', (0, 8, 16, 0x01010000)), ('SBAS', (1, 1, 3, 0x01010000)), ('Galileo', (2, 4, 8, 0x01010000)),
+               ('BeiDou', (3, 8, 16, 0x01010000)), ('IMES', (4, 0, 8, 0x03010000)), ('QZSS', (5, 0, 3, 0x05010000)),
+               ('GLONASS', (6, 8, 14, 0x01010000))]
+
+# Message names for CFG-MSG
+MESSAGES = dict((name, key) for key, name in UBX_Checker.MESSAGE_NAMES.items())
+
+CFG_NAV5 = struct.Struct('<HBBiIbBHHHHBBBBHHB5x')
+CFG_RATE = struct.Struct('<HHH')
+CFG_NMEA = struct.Struct('<BBBBIBBBBH6x')
+CFG_GNSS_HEADER = struct.Struct('<BBBB')
+CFG_GNSS_BLOCK = struct.Struct('<BBBBI')
+
+# Default: \xb5\x62\x06\x24\x24\x00\xff\xff\x02\x03\x00\x00\x00\x00\x10\x27\x00\x00\x05\x00\xfa\x00\xfa\x00\x64\x00\x5e\x01\x00\x3c\x00\x00\x00\x00\x00\x00\x03\x00\x00\x00\x00\x00
+# The logger sets tAcc to 350, dgnssTimeout to zero and utcStandard to UTC
+def cfg_nav5(dynModel):
+    # mask, dynModel, fixMode, fixedAlt, fixedAltVar, minElev, drLimit, pDop, tDop, pAcc, tAcc,
+    # staticHoldThresh, dgnssTimeout, cnoThreshNumSVs, cnoThresh, reserved, staticHoldMaxDist, utcStandard
+    return UBX_Checker.ubx_frame(0x06, 0x24, CFG_NAV5.pack(0xFFFF, DYN_MODELS[dynModel], 3, 0, 10000, 5, 0,
+                                                            250, 250, 100, 350, 0, 0, 0, 0, 0, 0, 3))
+
+# Default: \xb5\x62\x06\x17\x14\x00\x00\x40\x00\x02\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00
+# The logger sets trackFilt so course (COG) is always output
+def cfg_nmea(talker):
+    # filter, nmeaVersion, numSV, flags, gnssToFilter, svNumbering, mainTalkerId, gsvTalkerId, version, bdsTalkerId
+    return UBX_Checker.ubx_frame(0x06, 0x17, CFG_NMEA.pack(0x20, 0x40, 0, 0x02, 0, 0, NMEA_TALKERS[talker], 1, 1, 0))
+
+# Default (GPS + QZSS + GLONASS): \xb5\x62\x06\x3e\x3c\x00\x00\x20\x20\x07\x00\x08\x10\x00\x01\x00\x01\x01\x01\x01\x03\x00\x00\x00\x01\x01\x02\x04\x08\x00\x00\x00\x01\x01\x03\x08\x10\x00\x00\x00\x01\x01\x04\x00\x08\x00\x00\x00\x01\x03\x05\x00\x03\x00\x01\x00\x01\x05\x06\x08\x0e\x00\x01\x00\x01\x01
+def cfg_gnss(constellations):
+    payload = CFG_GNSS_HEADER.pack(0, 0x20, 0x20, len(GNSS_BLOCKS))
+    for name, (gnssId, resTrkCh, maxTrkCh, flags) in GNSS_BLOCKS:
+        enable = 1 if name in constellations else 0
+        payload += CFG_GNSS_BLOCK.pack(gnssId, resTrkCh, maxTrkCh, 0, flags | enable)
+    return UBX_Checker.ubx_frame(0x06, 0x3E, payload)
+
+# Default: \xb5\x62\x06\x08\x06\x00\xe8\x03\x01\x00\x01\x00
+def cfg_rate(measRate, navRate, timeRef):
+    return UBX_Checker.ubx_frame(0x06, 0x08, CFG_RATE.pack(measRate, navRate, TIME_REFS[timeRef]))
+
+# Set the rate of a message on the current port
+def cfg_msg(name, rate):
+    msg_class, msg_id = MESSAGES[name]
+    return UBX_Checker.ubx_frame(0x06, 0x01, bytes((msg_class, msg_id, rate)))
+
+# PUBX,40 sentence which disables an NMEA message on all ports
+def nmea_sentence(msg):
+    csum = 0
+    for c in msg: csum ^= ord(c)
+    return ('$%s*%02X\r\n'%(msg, csum)).encode('ascii')
+
+def pubx_disable(sentence):
+    return nmea_sentence('PUBX,40,%s,0,0,0,0'%sentence)
+
+# True if text is nothing but complete NMEA sentences with good checksums
+def valid_sentences(text):
+    lines = text.split(b'\r\n')
+    if lines[-1] != b'': return False
+    for line in lines[:-1]:
+        try:
+            if nmea_sentence(line[1:-3].decode('ascii')) != line + b'\r\n': return False
+        except UnicodeDecodeError:
+            return False
+    return True
+
+def load_profile(filename=None):
+    ''' Read a profile from a JSON file (or just the defaults), fill in the missing fields and check it '''
+    profile = dict(DEFAULT_PROFILE)
+    if filename is not None:
+        with open(filename, 'r') as fi:
+            profile.update(json.load(fi))
+    return check_profile(profile)
+
+def check_profile(profile):
+    ''' Check the profile fields. Raises ValueError for anything the compiler can't handle '''
+    profile = dict(DEFAULT_PROFILE, **profile)
+    unknown = set(profile) - set(DEFAULT_PROFILE)
+    if unknown: raise ValueError('Unknown profile fields: ' + ', '.join(sorted(unknown)))
+    if profile['dynModel'] not in DYN_MODELS: raise ValueError('Unknown dynModel: %s'%profile['dynModel'])
+    for name in profile['constellations']:
+        if name not in dict(GNSS_BLOCKS): raise ValueError('Unknown constellation: %s'%name)
+    if not (25 <= int(profile['measRate']) <= 65535): raise ValueError('measRate must be 25 - 65535 ms')
+    if not (1 <= int(profile['navRate']) <= 127): raise ValueError('navRate must be 1 - 127')
+    if profile['timeRef'] not in TIME_REFS: raise ValueError('Unknown timeRef: %s'%profile['timeRef'])
+    for name, rate in profile['messages'].items():
+        if name not in MESSAGES: raise ValueError('Unknown message: %s'%name)
+        if not (0 <= int(rate) <= 255): raise ValueError('Message rate must be 0 - 255')
+    if profile['nmeaTalker'] not in NMEA_TALKERS: raise ValueError('Unknown nmeaTalker: %s'%profile['nmeaTalker'])
+    return profile
+
+def profile_hash(profile):
+    ''' Content hash of the (complete) profile and the compiler version '''
+    text = json.dumps([COMPILER_VERSION, profile], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def compile_profile(profile):
+    ''' Compile the profile into a blob: the PUBX,40 sentences followed by the UBX frames '''
+    profile = check_profile(profile)
+    blob = b''.join(pubx_disable(sentence) for sentence in profile['disableNMEA'])
+    blob += cfg_nav5(profile['dynModel'])
+    blob += cfg_nmea(profile['nmeaTalker'])
+    blob += cfg_gnss(profile['constellations'])
+    blob += cfg_rate(int(profile['measRate']), int(profile['navRate']), profile['timeRef'])
+    for name, rate in sorted(profile['messages'].items()):
+        blob += cfg_msg(name, int(rate))
+    return blob
+
+def split_blob(blob):
+    ''' Split a blob into its NMEA sentences (bytes) and a Command for each UBX frame.
+    The commands send the blob's own (already checksummed) frames. Returns None if any of the sentences or frames are corrupt '''
+    start = blob.find(UBX_Checker.SYNC)
+    if start < 0: start = len(blob)
+    if not valid_sentences(blob[:start]): return None
+    commands = []
+    def on_frame(offset, msg_class, msg_id, payload):
+        end = start + offset + len(payload) + UBX_Checker.OVERHEAD
+        commands.append(UBX_Command.Command(msg_class, msg_id, payload, frame=blob[start + offset:end]))
+    parser = UBX_Checker.UBXStreamParser(on_frame=on_frame)
+    parser.feed(blob[start:])
+    parser.finish()
+    if len(parser.stats.bad_regions) > 0: return None
+    return blob[:start], commands
+
+def cache_directory():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'ubx_profiles')
+
+def cached_blob(profile, directory=None):
+    ''' The compiled blob for profile, from the cache if it's there.
+    Returns (blob, filename, (preamble, commands)): the blob split by split_blob '''
+    profile = check_profile(profile)
+    if directory is None: directory = cache_directory()
+    filename = os.path.join(directory, profile_hash(profile) + '.ubx')
+    try:
+        with open(filename, 'rb') as fi:
+            blob = fi.read()
+        parts = split_blob(blob) # Checks the cached frames too
+        if parts is not None:
+            return blob, filename, parts
+    except (IOError, OSError):
+        pass
+    blob = compile_profile(profile)
+    parts = split_blob(blob)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        temp = filename + '.tmp'
+        with open(temp, 'wb') as fo:
+            fo.write(blob)
+        os.replace(temp, filename)
+    except (IOError, OSError):
+        filename = None # Read-only home directory? Carry on without the cache
+    return blob, filename, parts
+
+def disable_frames(profile):
+    ''' CFG-MSG frames which turn off the messages the profile enables '''
+    return [cfg_msg(name, 0) for name, rate in sorted(check_profile(profile)['messages'].items()) if int(rate) > 0]
+
+def apply_profile(ser, profile, timeout=0.5, retries=2, directory=None):
+    ''' Configure the receiver: the whole blob goes out in one write and the ACKs are matched
+    as they come back. Returns a CommandResult for each UBX frame '''
+    blob, filename, (preamble, commands) = cached_blob(profile, directory)
+    commander = UBX_Command.UBXCommander(ser, timeout=timeout, retries=retries, window=len(commands))
+    return commander.run(commands, preamble)
+
+def main(argv):
+    print('UBX Profile Compiler')
+
+    filename = argv[1] if len(argv) > 1 else None
+    profile = load_profile(filename)
+    print(json.dumps(profile, indent=4, sort_keys=True))
+
+    blob, cachefile, (preamble, commands) = cached_blob(profile)
+    print()
+    for sentence in preamble.splitlines(): print(sentence.decode('ascii'))
+    for command in commands:
+        print('%-24s'%command.name(), "\\x" + "\\x".join("{:02x}".format(c) for c in command.frame))
+    print()
+    print('%i bytes. Cached as %s'%(len(blob), cachefile))
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,144 @@
+# Decodes the RXM-RAWX messages in a u-blox binary file into numpy structured arrays
+
+# epochs has one row per RXM-RAWX message: rcvTow, week, leapS, numMeas, recStat, the file offset
+# of the frame and the row of its first measurement in meas.
+# meas has one row per measurement: the epoch row it belongs to, prMes, cpMes, doMes, gnssId, svId,
+# freqId, locktime, cno, the standard deviations (decoded to m, cycles and Hz) and trkStat.
+#
+# The frames are found through the .ubxidx sidecar (UBX_Index.py). The log is memory-mapped and
+# viewed as an array of 32-byte measurement records (np.frombuffer) once for each of the 32
+# possible alignments; every measurement is then picked out of the view which matches its
+# alignment with one fancy-index per alignment. No Python code runs per measurement.
+
+# Usage: python UBX_RAWX.py filename.bin [output.npz]
+
+import sys
+import mmap
+import time
+
+import numpy as np
+
+import UBX_Checker
+import UBX_Index
+
+# RXM-RAWX payload header and measurement block, exactly as they are in the file
+RAWX_HEADER_DTYPE = np.dtype([('rcvTow', '<f8'), ('week', '<u2'), ('leapS', 'i1'), ('numMeas', 'u1'),
+                              ('recStat', 'u1'), ('version', 'u1'), ('reserved1', 'u1', 2)])
+RAWX_MEAS_DTYPE = np.dtype([('prMes', '<f8'), ('cpMes', '<f8'), ('doMes', '<f4'), ('gnssId', 'u1'),
+                            ('svId', 'u1'), ('reserved2', 'u1'), ('freqId', 'u1'), ('locktime', '<u2'),
+                            ('cno', 'u1'), ('prStdev', 'u1'), ('cpStdev', 'u1'), ('doStdev', 'u1'),
+                            ('trkStat', 'u1'), ('reserved3', 'u1')])
+
+EPOCH_DTYPE = np.dtype([('rcvTow', '<f8'), ('week', '<u2'), ('leapS', 'i1'), ('numMeas', 'u1'), ('recStat', 'u1'),
+                        ('offset', '<u8'), ('first', '<u8')])
+MEAS_DTYPE = np.dtype([('epoch', '<u4'), ('prMes', '<f8'), ('cpMes', '<f8'), ('doMes', '<f4'), ('gnssId', 'u1'),
+                       ('svId', 'u1'), ('freqId', 'u1'), ('locktime', '<u2'), ('cno', 'u1'), ('prStdev', '<f4'),
+                       ('cpStdev', '<f4'), ('doStdev', '<f4'), ('trkStat', 'u1')])
+
+GNSS_NAMES = {0: 'GPS', 1: 'SBAS', 2: 'Galileo', 3: 'BeiDou', 4: 'IMES', 5: 'QZSS', 6: 'GLONASS'}
+
+# trkStat bits
+PR_VALID = 0x01
+CP_VALID = 0x02
+HALF_CYC = 0x04
+SUB_HALF_CYC = 0x08
+
+# Pick records of dtype out of buf at the byte offsets: one np.frombuffer view per alignment
+def records_at(buf, offsets, dtype):
+    out = np.empty(len(offsets), dtype=dtype)
+    size = dtype.itemsize
+    alignment = offsets % size
+    for a in np.unique(alignment):
+        sel = np.nonzero(alignment == a)[0]
+        view = np.frombuffer(buf, dtype=dtype, count=(len(buf) - int(a)) // size, offset=int(a))
+        out[sel] = view[(offsets[sel] - a) // size]
+        del view
+    return out
+
+def decode_frames(buf, offsets, lengths):
+    ''' Decode the RXM-RAWX frames which start at offsets in buf. Returns (epochs, meas).
+    Frames whose length doesn't match numMeas are left out '''
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    keep = lengths >= RAWX_HEADER_DTYPE.itemsize
+    offsets = offsets[keep]
+    lengths = lengths[keep]
+    payloads = offsets + UBX_Checker.HEADER_LEN
+    headers = records_at(buf, payloads, RAWX_HEADER_DTYPE)
+    keep = lengths == RAWX_HEADER_DTYPE.itemsize + (headers['numMeas'].astype(np.int64) * RAWX_MEAS_DTYPE.itemsize)
+    headers = headers[keep]
+    offsets = offsets[keep]
+    payloads = payloads[keep]
+
+    num_meas = headers['numMeas'].astype(np.int64)
+    first = np.zeros(len(headers), dtype=np.int64)
+    np.cumsum(num_meas[:-1], out=first[1:])
+    epochs = np.empty(len(headers), dtype=EPOCH_DTYPE)
+    for name in ('rcvTow', 'week', 'leapS', 'numMeas', 'recStat'):
+        epochs[name] = headers[name]
+    epochs['offset'] = offsets
+    epochs['first'] = first
+
+    # Byte offset of every measurement block: the epoch's first block plus 32 * its position in the epoch
+    total = int(num_meas.sum())
+    epoch = np.repeat(np.arange(len(headers)), num_meas)
+    position = np.arange(total) - first[epoch]
+    blocks = records_at(buf, payloads[epoch] + RAWX_HEADER_DTYPE.itemsize + (position * RAWX_MEAS_DTYPE.itemsize),
+                        RAWX_MEAS_DTYPE)
+
+    meas = np.empty(total, dtype=MEAS_DTYPE)
+    meas['epoch'] = epoch
+    for name in ('prMes', 'cpMes', 'doMes', 'gnssId', 'svId', 'freqId', 'locktime', 'cno', 'trkStat'):
+        meas[name] = blocks[name]
+    # Standard deviations: prStdev 0.01 * 2^n m, cpStdev 0.004 * n cycles, doStdev 0.002 * 2^n Hz (4 bits each)
+    meas['prStdev'] = 0.01 * np.exp2((blocks['prStdev'] & 0x0F).astype(np.float64))
+    meas['cpStdev'] = 0.004 * (blocks['cpStdev'] & 0x0F)
+    meas['doStdev'] = 0.002 * np.exp2((blocks['doStdev'] & 0x0F).astype(np.float64))
+    return epochs, meas
+
+def load_rawx(filename, start=None, end=None, index=None):
+    ''' Decode the RXM-RAWX messages in filename (optionally only those with start <= GPS time < end).
+    Creates or updates the .ubxidx sidecar if needed. Returns (epochs, meas) '''
+    if index is None: index = UBX_Index.UBXIndex(filename)
+    records = index.select(0x02, 0x15, start, end)
+    if len(records) == 0:
+        return np.zeros(0, dtype=EPOCH_DTYPE), np.zeros(0, dtype=MEAS_DTYPE)
+    with open(filename, 'rb') as fi:
+        mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return decode_frames(mm, records['offset'].astype(np.int64), records['length'])
+        finally:
+            mm.close()
+
+def gps_seconds(epochs):
+    ''' Continuous GPS time (seconds) of each epoch '''
+    return UBX_Index.gps_seconds(epochs['week'], epochs['rcvTow'])
+
+def main(argv):
+    print('UBX RXM-RAWX Decoder')
+
+    filename = ''
+    if len(argv) > 1: filename = argv[1]
+    firstfile = UBX_Checker.find_first_file()
+    if filename == '': filename = input('Enter the bin filename (default: ' + firstfile + '): ') # Get the filename
+    if filename == '': filename = firstfile
+
+    start = time.perf_counter()
+    epochs, meas = load_rawx(filename)
+    elapsed = time.perf_counter() - start
+    print('Decoded %i epochs and %i measurements in %.3f s'%(len(epochs), len(meas), elapsed))
+    if len(epochs) > 0:
+        print('GPS week %i TOW %.3f to GPS week %i TOW %.3f'%(epochs['week'][0], epochs['rcvTow'][0],
+                                                             epochs['week'][-1], epochs['rcvTow'][-1]))
+        gnss, counts = np.unique(meas['gnssId'], return_counts=True)
+        for g, n in zip(gnss, counts):
+            print('%-8s %10i measurements'%(GNSS_NAMES.get(int(g), str(g)), n))
+
+    if len(argv) > 2:
+        np.savez(argv[2], epochs=epochs, meas=meas)
+        print('Saved', argv[2])
+
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
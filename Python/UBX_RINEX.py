@@ -0,0 +1,450 @@
+# Converts u-blox binary files to RINEX 3.03 observation (.obs) and navigation (.nav) files
+
+# The log is read once: RXM-RAWX messages become observation epochs and RXM-SFRBX subframes are
+# assembled into ephemerides. The file is memory-mapped and scanned a window at a time (the same
+# scan as UBX_Checker.py); the RXM-RAWX messages in each window are decoded in one go with
+# UBX_RAWX.py, so memory use doesn't depend on the size of the log.
+#
+# Observations: C (pseudorange), L (carrier phase), D (Doppler) and S (C/N0) for GPS L1C/A,
+# GLONASS L1OF, Galileo E1, BeiDou B1I, QZSS L1C/A and SBAS L1. LLI bit 0 is set when the lock
+# time goes backwards (cycle slip), bit 1 while the half-cycle ambiguity is unresolved.
+# Navigation: GPS and QZSS LNAV ephemerides (subframes 1 - 3). The other systems' navigation
+# messages are counted but not converted.
+#
+# The header lines which depend on the whole file (time of first and last observation, GLONASS
+# frequency channels) are written as fixed-width placeholders and filled in when the file is closed.
+#
+# With -s hour (or -s day) the log is split into one pair of files per hour (day) of GPS time using
+# the .ubxidx frame index (UBX_Index.py), and the pieces are converted in parallel.
+
+# Usage: python UBX_RINEX.py [-s hour|day] [-p processes] [-m marker] [-o directory] filename.bin [filename.bin ...]
+
+import sys
+import os
+import mmap
+import time
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import UBX_Checker
+import UBX_Index
+import UBX_RAWX
+
+RINEX_VERSION = 3.03
+PROGRAM = 'UBX_RINEX.py'
+GPS_EPOCH = datetime.datetime(1980, 1, 6)
+SECONDS_PER_WEEK = 604800
+SHARD_SECONDS = {'hour': 3600, 'day': 86400}
+
+# u-blox gnssId -> RINEX system letter, and the observation codes for the NEO-M8T's signal
+SYSTEMS = {0: 'G', 1: 'S', 2: 'E', 3: 'C', 5: 'J', 6: 'R'}
+SIGNALS = {'G': '1C', 'R': '1C', 'E': '1X', 'C': '2I', 'J': '1C', 'S': '1C'}
+SYSTEM_ORDER = 'GRECJS'
+
+# GPS URA index -> metres
+URA_VALUES = [2.4, 3.4, 4.85, 6.85, 9.65, 13.65, 24.0, 48.0, 96.0, 192.0, 384.0, 768.0, 1536.0, 3072.0, 6144.0, 6144.0]
+
+# RINEX satellite number for a u-blox gnssId and svId. Returns None for satellites RINEX can't describe
+def satellite(gnssId, svId):
+    system = SYSTEMS.get(gnssId)
+    if system is None: return None
+    if system == 'S': svId -= 100 # SBAS PRN 120 - 158 is S20 - S58
+    elif system == 'R' and svId > 32: return None # Unknown GLONASS slot (255)
+    if not (1 <= svId <= 99): return None
+    return '%s%02d'%(system, svId)
+
+# satellite() for every gnssId (0 - 7) and svId (0 - 255), to save a function call per measurement
+SATELLITES = [[satellite(g, sv) for sv in range(256)] for g in range(8)]
+
+# Calendar time for GPS week and time of week. tow is rounded to the decimals the seconds are
+# printed with first, so e.g. 59.99999999 carries into the minute rather than printing as 60.0000000
+def gps_calendar(week, tow, decimals=7):
+    tow = round(float(tow), decimals)
+    seconds = np.floor(tow)
+    t = GPS_EPOCH + datetime.timedelta(days=7 * int(week), seconds=int(seconds))
+    return t, t.second + (tow - seconds)
+
+def header_line(content, label):
+    return '%-60s%-20s\n'%(content, label)
+
+# Full GPS week for a 10-bit week number, using a full week which is close in time
+def full_week(week10, near):
+    return week10 + 1024 * int(round((near - week10) / 1024.))
+
+class RINEXObsWriter(object):
+    ''' Writes a RINEX 3.03 observation file, a batch of epochs at a time '''
+
+    GLONASS_LINES = 4 # Room for 32 GLONASS slots
+
+    def __init__(self, filename, marker='UBX', receiver='NEO-M8T'):
+        self.filename = filename
+        self.fo = open(filename, 'wb', buffering=1<<20) # Binary, so the header placeholders have a known offset
+        self.epochs = 0
+        self.first = None
+        self.last = None
+        self.glonass = {} # slot -> frequency channel
+        self.locktime = {} # satellite -> last lock time (ms)
+        self._write_header(marker, receiver)
+
+    def _write_header(self, marker, receiver):
+        run = datetime.datetime.utcnow().strftime('%Y%m%d %H%M%S UTC')
+        lines = [header_line('%9.2f%11s%-20s%-20s'%(RINEX_VERSION, '', 'OBSERVATION DATA', 'M: Mixed'), 'RINEX VERSION / TYPE'),
+                 header_line('%-20s%-20s%-20s'%(PROGRAM, '', run), 'PGM / RUN BY / DATE'),
+                 header_line(marker[:60], 'MARKER NAME'),
+                 header_line('%-20s%-40s'%('', ''), 'OBSERVER / AGENCY'),
+                 header_line('%-20s%-20s%-20s'%('', 'U-BLOX ' + receiver, ''), 'REC # / TYPE / VERS'),
+                 header_line('%-20s%-20s'%('', ''), 'ANT # / TYPE'),
+                 header_line('%14.4f%14.4f%14.4f'%(0, 0, 0), 'APPROX POSITION XYZ'),
+                 header_line('%14.4f%14.4f%14.4f'%(0, 0, 0), 'ANTENNA: DELTA H/E/N')]
+        for system in SYSTEM_ORDER:
+            signal = SIGNALS[system]
+            lines.append(header_line('%s  %3i %s %s %s %s'%(system, 4, 'C' + signal, 'L' + signal, 'D' + signal, 'S' + signal),
+                                     'SYS / # / OBS TYPES'))
+        lines.append(header_line('DBHZ', 'SIGNAL STRENGTH UNIT'))
+        self.header = ''.join(lines)
+        self._placeholders = len(self.header)
+        self.fo.write(self.header.encode('ascii'))
+        self.fo.write(self._reserved_lines(None, None, {}).encode('ascii'))
+
+    def _reserved_lines(self, first, last, glonass):
+        # The header lines which are only known at the end. Always the same length
+        lines = []
+        for label, t in (('TIME OF FIRST OBS', first), ('TIME OF LAST OBS', last)):
+            if t is None:
+                lines.append(header_line('', 'COMMENT'))
+            else:
+                c, s = t
+                lines.append(header_line('%6i%6i%6i%6i%6i%13.7f%5s%3s'%(c.year, c.month, c.day, c.hour, c.minute, s, '', 'GPS'), label))
+        for system in SYSTEM_ORDER:
+            lines.append(header_line('%s %3s'%(system, 'L' + SIGNALS[system]), 'SYS / PHASE SHIFT'))
+        slots = sorted(glonass.items())
+        for n in range(self.GLONASS_LINES):
+            part = slots[n * 8:(n + 1) * 8]
+            if (n > 0) and (len(part) == 0):
+                lines.append(header_line('', 'COMMENT'))
+                continue
+            content = ('%3i '%len(slots)) if n == 0 else '    '
+            content += ''.join('R%02i %2i '%(slot, fcn) for slot, fcn in part)
+            lines.append(header_line(content, 'GLONASS SLOT / FRQ #'))
+        lines.append(header_line(' C1C %8.3f C1P %8.3f C2C %8.3f C2P %8.3f'%(0, 0, 0, 0), 'GLONASS COD/PHS/BIS'))
+        lines.append(header_line('', 'END OF HEADER'))
+        return ''.join(lines)
+
+    def write_epochs(self, epochs, meas):
+        ''' Write the epochs and measurements decoded by UBX_RAWX.decode_frames '''
+        if len(epochs) == 0: return
+        out = []
+        weeks = epochs['week'].tolist()
+        tows = epochs['rcvTow'].tolist()
+        firsts = epochs['first'].tolist()
+        counts = epochs['numMeas'].tolist()
+        gnss = meas['gnssId'].tolist()
+        svs = meas['svId'].tolist()
+        ssis = np.clip(meas['cno'] // 6, 1, 9).tolist()
+        freqs = meas['freqId'].tolist()
+        prs = meas['prMes'].tolist()
+        cps = meas['cpMes'].tolist()
+        dos = meas['doMes'].tolist()
+        cnos = meas['cno'].tolist()
+        locks = meas['locktime'].tolist()
+        trks = meas['trkStat'].tolist()
+        locktime = self.locktime
+        satellites = SATELLITES
+        for week, tow, first, count in zip(weeks, tows, firsts, counts):
+            lines = []
+            seen = set()
+            for m in range(first, first + count):
+                sat = satellites[gnss[m] & 7][svs[m]]
+                if (sat is None) or (sat in seen): continue
+                seen.add(sat)
+                if sat[0] == 'R': self.glonass[int(sat[1:])] = freqs[m] - 7
+                trk = trks[m]
+                ssi = ssis[m]
+                line = sat
+                line += ('%14.3f %1i'%(prs[m], ssi)) if (trk & UBX_RAWX.PR_VALID) else (' ' * 16)
+                if (trk & UBX_RAWX.CP_VALID) and (cps[m] != 0.0):
+                    lli = 0
+                    previous = locktime.get(sat)
+                    if (previous is not None) and (locks[m] < previous): lli |= 1 # Lock time went backwards: cycle slip
+                    if not (trk & UBX_RAWX.HALF_CYC): lli |= 2 # Half cycle ambiguity
+                    line += '%14.3f%1s%1i'%(cps[m], str(lli) if lli else ' ', ssi)
+                else:
+                    line += ' ' * 16
+                locktime[sat] = locks[m]
+                line += '%14.3f  %14.3f'%(dos[m], cnos[m])
+                lines.append(line)
+            t = gps_calendar(week, tow)
+            if self.first is None: self.first = t
+            self.last = t
+            c, s = t
+            out.append('> %04i %02i %02i %02i %02i%11.7f  0%3i\n'%(c.year, c.month, c.day, c.hour, c.minute, s, len(lines)))
+            if lines:
+                out.append('\n'.join(lines))
+                out.append('\n')
+        self.epochs += len(epochs)
+        self.fo.write(''.join(out).encode('ascii'))
+
+    def close(self):
+        self.fo.flush()
+        self.fo.seek(self._placeholders)
+        self.fo.write(self._reserved_lines(self.first, self.last, self.glonass).encode('ascii'))
+        self.fo.close()
+
+class LNAVDecoder(object):
+    ''' Assembles GPS / QZSS LNAV subframes 1 - 3 into ephemerides '''
+
+    def __init__(self):
+        self.subframes = {} # satellite -> {subframe id: 240 bit subframe}
+        self.latest = {} # satellite -> (IODE, toe) of the last ephemeris
+
+    def add(self, sat, words, week):
+        ''' Add a subframe (ten 30-bit words). week is a nearby full GPS week.
+        Returns an ephemeris dictionary when a new one is complete, otherwise None '''
+        data = 0
+        for word in words[:10]:
+            data = (data << 24) | ((word >> 6) & 0xFFFFFF) # Drop the parity bits
+        subframe = getbitu(data, 43, 3)
+        if not (1 <= subframe <= 3): return None
+        frames = self.subframes.setdefault(sat, {})
+        frames[subframe] = data
+        if len(frames) < 3: return None
+        # Quick check that all three subframes have the same issue of data before decoding them
+        iode = getbitu(frames[2], 48, 8)
+        if (getbitu(frames[3], 216, 8) != iode) or (getbitu(frames[1], 168, 8) != iode): return None
+        eph = decode_lnav(frames[1], frames[2], frames[3], week)
+        if eph is None: return None
+        key = (eph['iode'], eph['toe'])
+        if self.latest.get(sat) == key: return None
+        self.latest[sat] = key
+        eph['sat'] = sat
+        return eph
+
+# Unsigned / signed bit fields from a 240 bit subframe. pos counts from the first (most significant) bit
+def getbitu(data, pos, length):
+    return (data >> (240 - pos - length)) & ((1 << length) - 1)
+
+def getbits(data, pos, length):
+    value = getbitu(data, pos, length)
+    if value & (1 << (length - 1)): value -= (1 << length)
+    return value
+
+# Decode LNAV subframes 1, 2 and 3 (24 data bits per word, parity removed). Returns None unless
+# the three subframes belong to the same issue of data
+def decode_lnav(sf1, sf2, sf3, week_near):
+    P2_5 = 2.0**-5; P2_19 = 2.0**-19; P2_29 = 2.0**-29; P2_31 = 2.0**-31
+    P2_33 = 2.0**-33; P2_43 = 2.0**-43; P2_55 = 2.0**-55
+    SC2RAD = np.pi
+    eph = {}
+    # Subframe 1
+    eph['ttr'] = getbitu(sf1, 24, 17) * 6.0 # Transmission time (time of week)
+    i = 48
+    week = getbitu(sf1, i, 10); i += 10
+    eph['code'] = getbitu(sf1, i, 2); i += 2
+    eph['sva'] = getbitu(sf1, i, 4); i += 4
+    eph['svh'] = getbitu(sf1, i, 6); i += 6
+    iodc0 = getbitu(sf1, i, 2); i += 2
+    eph['flag'] = getbitu(sf1, i, 1); i += 1 + 87
+    tgd = getbits(sf1, i, 8); i += 8
+    iodc1 = getbitu(sf1, i, 8); i += 8
+    eph['toc'] = getbitu(sf1, i, 16) * 16.0; i += 16
+    eph['f2'] = getbits(sf1, i, 8) * P2_55; i += 8
+    eph['f1'] = getbits(sf1, i, 16) * P2_43; i += 16
+    eph['f0'] = getbits(sf1, i, 22) * P2_31
+    eph['tgd'] = 0.0 if tgd == -128 else tgd * P2_31
+    eph['iodc'] = (iodc0 << 8) + iodc1
+    eph['week'] = full_week(week, week_near)
+    # Subframe 2
+    i = 48
+    eph['iode'] = getbitu(sf2, i, 8); i += 8
+    eph['crs'] = getbits(sf2, i, 16) * P2_5; i += 16
+    eph['deln'] = getbits(sf2, i, 16) * P2_43 * SC2RAD; i += 16
+    eph['M0'] = getbits(sf2, i, 32) * P2_31 * SC2RAD; i += 32
+    eph['cuc'] = getbits(sf2, i, 16) * P2_29; i += 16
+    eph['e'] = getbitu(sf2, i, 32) * P2_33; i += 32
+    eph['cus'] = getbits(sf2, i, 16) * P2_29; i += 16
+    eph['sqrtA'] = getbitu(sf2, i, 32) * P2_19; i += 32
+    eph['toe'] = getbitu(sf2, i, 16) * 16.0; i += 16
+    eph['fit'] = 0.0 if getbitu(sf2, i, 1) else 4.0
+    # Subframe 3
+    i = 48
+    eph['cic'] = getbits(sf3, i, 16) * P2_29; i += 16
+    eph['OMG0'] = getbits(sf3, i, 32) * P2_31 * SC2RAD; i += 32
+    eph['cis'] = getbits(sf3, i, 16) * P2_29; i += 16
+    eph['i0'] = getbits(sf3, i, 32) * P2_31 * SC2RAD; i += 32
+    eph['crc'] = getbits(sf3, i, 16) * P2_5; i += 16
+    eph['omg'] = getbits(sf3, i, 32) * P2_31 * SC2RAD; i += 32
+    eph['OMGd'] = getbits(sf3, i, 24) * P2_43 * SC2RAD; i += 24
+    iode3 = getbitu(sf3, i, 8); i += 8
+    eph['idot'] = getbits(sf3, i, 14) * P2_43 * SC2RAD
+    if (iode3 != eph['iode']) or ((eph['iodc'] & 0xFF) != eph['iode']):
+        return None
+    return eph
+
+# RINEX 3 navigation data fields: D19.12 with an E exponent
+def nav_fields(values):
+    return ''.join('%19.12E'%v for v in values)
+
+class RINEXNavWriter(object):
+    ''' Writes a RINEX 3.03 navigation file from RXM-SFRBX subframes '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fo = open(filename, 'wb', buffering=1<<16)
+        self.decoder = LNAVDecoder()
+        self.ephemerides = 0
+        self.subframes = {} # RINEX system letter -> number of subframes
+        run = datetime.datetime.utcnow().strftime('%Y%m%d %H%M%S UTC')
+        header = [header_line('%9.2f%11s%-20s%-20s'%(RINEX_VERSION, '', 'N: GNSS NAV DATA', 'M: Mixed'), 'RINEX VERSION / TYPE'),
+                  header_line('%-20s%-20s%-20s'%(PROGRAM, '', run), 'PGM / RUN BY / DATE'),
+                  header_line('', 'END OF HEADER')]
+        self.fo.write(''.join(header).encode('ascii'))
+
+    def add_sfrbx(self, payload, week):
+        ''' Add an RXM-SFRBX payload. week is the GPS week of the surrounding RXM-RAWX epochs '''
+        if len(payload) < 8: return
+        gnssId, svId, numWords = payload[0], payload[1], payload[4]
+        sat = satellite(gnssId, svId)
+        if sat is None: return
+        self.subframes[sat[0]] = self.subframes.get(sat[0], 0) + 1
+        if (sat[0] not in 'GJ') or (numWords < 10) or (len(payload) < 8 + 40): return
+        words = np.frombuffer(payload, dtype='<u4', count=10, offset=8).tolist()
+        eph = self.decoder.add(sat, words, week)
+        if eph is not None: self.write(eph)
+
+    def write(self, eph):
+        # Clock epoch (toc) in the ephemeris week, allowing for the week changing between toc and ttr
+        toc_week = eph['week']
+        if eph['toc'] - eph['ttr'] < -302400: toc_week += 1
+        elif eph['toc'] - eph['ttr'] > 302400: toc_week -= 1
+        c, s = gps_calendar(toc_week, eph['toc'])
+        lines = ['%-3s %04i %02i %02i %02i %02i %02i'%(eph['sat'], c.year, c.month, c.day, c.hour, c.minute, int(s)) +
+                 nav_fields([eph['f0'], eph['f1'], eph['f2']])]
+        for values in ([eph['iode'], eph['crs'], eph['deln'], eph['M0']],
+                       [eph['cuc'], eph['e'], eph['cus'], eph['sqrtA']],
+                       [eph['toe'], eph['cic'], eph['OMG0'], eph['cis']],
+                       [eph['i0'], eph['crc'], eph['omg'], eph['OMGd']],
+                       [eph['idot'], eph['code'], eph['week'], eph['flag']],
+                       [URA_VALUES[eph['sva']], eph['svh'], eph['tgd'], eph['iodc']],
+                       [eph['ttr'], eph['fit']]):
+            lines.append('    ' + nav_fields(values))
+        self.fo.write(('\n'.join(lines) + '\n').encode('ascii'))
+        self.ephemerides += 1
+
+    def close(self):
+        self.fo.close()
+
+def convert_range(task):
+    ''' Convert the frames which start in [start, stop) of a log. task is a tuple of
+    (filename, start, stop, obsfile, navfile, marker). Returns a summary dictionary '''
+    filename, start, stop, obsfile, navfile, marker = task
+    stats = UBX_Checker.UBXStats()
+    obs = RINEXObsWriter(obsfile, marker)
+    nav = RINEXNavWriter(navfile)
+    week = None
+    with open(filename, 'rb') as fi:
+        mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            def on_frames(frames):
+                nonlocal week
+                starts = frames[:,0]
+                rawx = (frames[:,1] == 0x02) & (frames[:,2] == 0x15)
+                sfrbx = np.nonzero((frames[:,1] == 0x02) & (frames[:,2] == 0x13))[0]
+                epochs, meas = UBX_RAWX.decode_frames(mm, starts[rawx], frames[rawx,3])
+                obs.write_epochs(epochs, meas)
+                if len(sfrbx) == 0: return
+                # Each subframe uses the week of the RXM-RAWX epoch before it
+                epoch_weeks = np.full(len(frames), -1, dtype=np.int64)
+                epoch_weeks[np.searchsorted(starts, epochs['offset'])] = epochs['week']
+                latest = np.maximum.accumulate(np.where(epoch_weeks < 0, -1, np.arange(len(frames))))
+                for n in sfrbx.tolist():
+                    if latest[n] >= 0: week = int(epoch_weeks[latest[n]])
+                    if week is None: continue # No week number yet
+                    begin = int(starts[n]) + UBX_Checker.HEADER_LEN
+                    nav.add_sfrbx(mm[begin:begin + int(frames[n,3])], week)
+            UBX_Checker.scan_buffer(mm, stats, start=start, stop=stop, on_frames=on_frames, print_errors=False)
+            del on_frames
+        finally:
+            mm.close()
+    obs.close()
+    nav.close()
+    return {'obsfile': obsfile, 'navfile': navfile, 'bytes': stop - start, 'epochs': obs.epochs,
+            'ephemerides': nav.ephemerides, 'subframes': nav.subframes, 'bad_regions': len(stats.bad_regions)}
+
+# Split a log into (start, stop, GPS time) byte ranges, one per hour or day of GPS time
+def shard_ranges(filename, seconds):
+    index = UBX_Index.UBXIndex(filename)
+    filesize = os.path.getsize(filename)
+    if len(index) == 0: return [(0, filesize, None)]
+    times = index.times()
+    shard = np.floor(times / seconds)
+    finite = np.isfinite(shard)
+    if not finite.any(): return [(0, filesize, None)]
+    shard[~finite] = shard[finite][0] # Frames before the first timed frame go into the first shard
+    boundaries = np.nonzero(np.diff(shard) != 0)[0] + 1
+    starts = [0] + index.frames['offset'][boundaries].astype(np.int64).tolist()
+    stops = starts[1:] + [filesize]
+    shards = [shard[0]] + shard[boundaries].tolist()
+    return [(a, b, s * seconds) for a, b, s in zip(starts, stops, shards)]
+
+# Output filenames for a log (or for the part of it starting at GPS time t), next to the log or in directory
+def rinex_filenames(filename, t=None, directory=None):
+    stem = filename[:-4]
+    if directory is not None: stem = os.path.join(directory, os.path.basename(stem))
+    if t is not None:
+        c = GPS_EPOCH + datetime.timedelta(seconds=t)
+        stem += '_%04i%03i%02i%02i'%(c.year, c.timetuple().tm_yday, c.hour, c.minute)
+    return stem + '.obs', stem + '.nav'
+
+def convert_files(filenames, shard=None, processes=None, marker=None, directory=None):
+    ''' Convert the logs to RINEX. shard is None (one pair of files per log), 'hour' or 'day'.
+    The RINEX files go next to the logs unless directory is given. Returns a list of convert_range summaries '''
+    tasks = []
+    for filename in filenames:
+        name = marker if marker is not None else os.path.basename(filename)[:-4]
+        if shard is None:
+            obsfile, navfile = rinex_filenames(filename, None, directory)
+            tasks.append((filename, 0, os.path.getsize(filename), obsfile, navfile, name))
+        else:
+            for start, stop, t in shard_ranges(filename, SHARD_SECONDS[shard]):
+                obsfile, navfile = rinex_filenames(filename, t, directory)
+                tasks.append((filename, start, stop, obsfile, navfile, name))
+    if (processes == 1) or (len(tasks) == 1):
+        return [convert_range(task) for task in tasks]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(convert_range, tasks))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='UBX to RINEX 3.03 converter')
+    parser.add_argument('filenames', nargs='*', help='u-blox binary files')
+    parser.add_argument('-s', choices=['hour', 'day'], default=None, help='one pair of RINEX files per hour / day')
+    parser.add_argument('-p', type=int, default=None, metavar='PROCESSES', help='number of processes (default: one per core)')
+    parser.add_argument('-m', default=None, metavar='MARKER', help='marker name (default: the log file name)')
+    parser.add_argument('-o', default=None, metavar='DIRECTORY', help='write the RINEX files to DIRECTORY')
+    args = parser.parse_args(argv[1:])
+
+    print('UBX to RINEX Converter')
+    filenames = args.filenames
+    if len(filenames) == 0:
+        firstfile = UBX_Checker.find_first_file()
+        filename = input('Enter the bin filename (default: ' + firstfile + '): ') # Get the filename
+        if filename == '': filename = firstfile
+        filenames = [filename]
+
+    start = time.perf_counter()
+    results = convert_files(filenames, args.s, args.p, args.m, args.o)
+    elapsed = time.perf_counter() - start
+    total = 0
+    for result in results:
+        total += result['bytes']
+        subframes = '  '.join('%s %i'%(k, v) for k, v in sorted(result['subframes'].items()))
+        print('%s  %i epochs' % (result['obsfile'], result['epochs']))
+        print('%s  %i ephemerides (subframes: %s)' % (result['navfile'], result['ephemerides'], subframes))
+        if result['bad_regions'] > 0: print('  Skipped %i corrupt regions'%result['bad_regions'])
+    print('Converted %i bytes in %.3f s = %.2f MB/s'%(total, elapsed, (total / 1.0e6) / max(elapsed, 1e-9)))
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,339 @@
+# TCP relay for the live UBX stream from the NEO-M8T GNSS RAWX Logger
+
+# Only the logger can read the serial port, so the relay republishes what it captures over TCP
+# for RTKNAVI (TCP Client input), dashboards, a second archive etc. A RelayServer is a capture
+# sink (see UBX_Capture.SerialCapture): each endpoint sends either the exact byte stream or only
+# the UBX frames of the message types it asks for (e.g. RXM-RAWX and RXM-SFRBX for RTKNAVI).
+
+# The capture must never wait for a client. Sends are non-blocking: whatever a client's socket
+# won't take straight away is queued for that client and sent by the relay's own thread when the
+# socket is writable. Each client's queue is limited to max_queue bytes; a client which falls that
+# far behind is disconnected (it can reconnect) rather than slowing down the logging.
+
+# Usage: python UBX_Relay.py
+# Relays a synthetic log to localhost clients (including one which never reads) and checks
+# what each of them receives. Exits with status 1 if any check fails
+
+import sys
+import time
+import socket
+import selectors
+import threading
+import collections
+
+import UBX_Checker
+
+# [HOST:]PORT[/MSG,MSG...] -> (host, port, set of (class, ID) or None for everything)
+# e.g. 5000 relays everything; 0.0.0.0:5001/RXM-RAWX,RXM-SFRBX relays just those frames to the network
+def parse_endpoint(text, host='127.0.0.1'):
+    address, sep, names = text.partition('/')
+    if ':' in address: host, sep, address = address.rpartition(':')
+    messages = None
+    if names:
+        keys = dict((name, key) for key, name in UBX_Checker.MESSAGE_NAMES.items())
+        messages = set()
+        for name in names.split(','):
+            if name not in keys: raise ValueError('Unknown message: %s'%name)
+            messages.add(keys[name])
+    return host, int(address), messages
+
+class RelayClient(object):
+    ''' One connected client: its socket and the data queued for it '''
+
+    def __init__(self, sock, address, endpoint):
+        self.sock = sock
+        self.address = address
+        self.endpoint = endpoint
+        self.queue = collections.deque() # Chunks which the socket hasn't taken yet
+        self.queued = 0 # Bytes in queue
+        self.offset = 0 # Bytes of queue[0] already sent
+        self.bytes_sent = 0
+        self.max_queued = 0
+        self.connected_at = time.time()
+
+    def name(self):
+        return '%s:%i'%self.address[:2]
+
+class Endpoint(object):
+    ''' A listening socket and the messages it relays (None means the exact byte stream) '''
+
+    def __init__(self, host, port, messages=None):
+        self.messages = messages
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(8)
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.clients = []
+
+    def describe(self):
+        what = 'everything' if self.messages is None else ', '.join(sorted(UBX_Checker.message_name(*key) for key in self.messages))
+        return '%s:%i (%s)'%(self.address[0], self.address[1], what)
+
+class RelayServer(object):
+    ''' Capture sink which relays the data to TCP clients
+
+    endpoints is a list of (host, port, messages) (see parse_endpoint). Call it with each chunk
+    of data (from the capture's writer thread): it never blocks. A client whose queue would grow
+    past max_queue bytes is dropped. dropped holds (address, reason) of the clients which were
+    dropped or went away. '''
+
+    def __init__(self, endpoints, max_queue=1<<20, sndbuf=None):
+        self.max_queue = max_queue
+        self.sndbuf = sndbuf # Socket send buffer size for new clients (None: the system default)
+        self.endpoints = [Endpoint(*endpoint) for endpoint in endpoints]
+        self.filtered = [endpoint for endpoint in self.endpoints if endpoint.messages is not None]
+        self.parser = UBX_Checker.UBXStreamParser(on_frame=self._on_frame) if self.filtered else None
+        self.bytes_in = 0
+        self.clients_accepted = 0
+        self.dropped = []
+        self.error = None # Exception which stopped the relay thread
+        self._frames = {} # Frames for each filtered endpoint in the data being relayed
+        self._lock = threading.Lock() # Clients and their queues
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='UBX relay')
+        self._thread.daemon = True
+
+    def start(self):
+        for endpoint in self.endpoints:
+            self._selector.register(endpoint.sock, selectors.EVENT_READ, endpoint)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        ''' Close every client and the listening sockets '''
+        self._stop.set()
+        self._wake()
+        self._thread.join(timeout)
+
+    def clients(self):
+        with self._lock:
+            return [client for endpoint in self.endpoints for client in endpoint.clients]
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass # Already has a wake-up pending
+
+    def _on_frame(self, offset, msg_class, msg_id, payload):
+        key = (msg_class, msg_id)
+        frame = None
+        for endpoint in self.filtered:
+            if key in endpoint.messages:
+                if frame is None:
+                    start = offset - self.parser.offset # The whole frame is still in the parser's buffer
+                    frame = bytes(self.parser.buffer[start:start + len(payload) + UBX_Checker.OVERHEAD])
+                self._frames[endpoint].append(frame)
+
+    def __call__(self, data):
+        self.bytes_in += len(data)
+        chunks = {}
+        if self.parser is not None:
+            for endpoint in self.filtered: self._frames[endpoint] = []
+            self.parser.feed(data)
+            for endpoint in self.filtered:
+                if self._frames[endpoint]: chunks[endpoint] = b''.join(self._frames[endpoint])
+        raw = None
+        wake = False
+        with self._lock:
+            for endpoint in self.endpoints:
+                if not endpoint.clients: continue
+                if endpoint.messages is None:
+                    if raw is None: raw = bytes(data)
+                    chunk = raw
+                else:
+                    chunk = chunks.get(endpoint)
+                    if chunk is None: continue
+                for client in list(endpoint.clients):
+                    if client.queued == 0:
+                        # Send what the socket will take now; queue the rest for the relay thread
+                        try:
+                            sent = client.sock.send(chunk)
+                        except (BlockingIOError, InterruptedError):
+                            sent = 0
+                        except OSError as e:
+                            self._drop(client, str(e))
+                            continue
+                        client.bytes_sent += sent
+                        if sent == len(chunk): continue
+                        rest = chunk[sent:]
+                        wake = True
+                    else:
+                        rest = chunk
+                    if client.queued + len(rest) > self.max_queue:
+                        self._drop(client, 'too slow: more than %i bytes queued'%self.max_queue)
+                        continue
+                    client.queue.append(rest)
+                    client.queued += len(rest)
+                    if client.queued > client.max_queued: client.max_queued = client.queued
+        if wake: self._wake()
+
+    def _drop(self, client, reason):
+        # Called with the lock held
+        client.endpoint.clients.remove(client)
+        self.dropped.append((client.name(), reason))
+        try:
+            self._selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def _accept(self, endpoint):
+        try:
+            sock, address = endpoint.sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.sndbuf is not None: sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        client = RelayClient(sock, address, endpoint)
+        with self._lock:
+            endpoint.clients.append(client)
+            self._selector.register(sock, selectors.EVENT_READ, client)
+            self.clients_accepted += 1
+
+    def _service(self, client, events):
+        # Called with the lock held
+        if events & selectors.EVENT_READ:
+            # Clients have nothing to say: anything they send is discarded. An empty read means they have gone
+            try:
+                data = client.sock.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError as e:
+                self._drop(client, str(e))
+                return
+            if data == b'':
+                self._drop(client, 'disconnected')
+                return
+        while client.queue:
+            chunk = client.queue[0]
+            try:
+                sent = client.sock.send(memoryview(chunk)[client.offset:])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self._drop(client, str(e))
+                return
+            client.bytes_sent += sent
+            client.queued -= sent
+            client.offset += sent
+            if client.offset < len(chunk): break
+            client.queue.popleft()
+            client.offset = 0
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                # Only the clients with something queued need to know when they are writable
+                with self._lock:
+                    for endpoint in self.endpoints:
+                        for client in endpoint.clients:
+                            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.queued else 0)
+                            if self._selector.get_key(client.sock).events != events:
+                                self._selector.modify(client.sock, events, client)
+                for key, events in self._selector.select(1.0):
+                    if key.data is None:
+                        try:
+                            while self._wake_r.recv(4096): pass
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                    elif isinstance(key.data, Endpoint):
+                        self._accept(key.data)
+                    else:
+                        with self._lock:
+                            if key.data in key.data.endpoint.clients: self._service(key.data, events)
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._lock:
+                for endpoint in self.endpoints:
+                    for client in list(endpoint.clients): self._drop(client, 'relay stopped')
+                    endpoint.sock.close()
+            self._selector.close()
+            self._wake_r.close()
+            self._wake_w.close()
+
+    def summary(self):
+        ''' One line summary of the clients '''
+        clients = self.clients()
+        queued = sum(client.queued for client in clients)
+        return 'Relay: %i client%s (%i bytes queued)  %i dropped'%(len(clients), '' if len(clients) == 1 else 's',
+                                                                 queued, len(self.dropped))
+
+# Self check: relay a synthetic log to localhost clients as fast as possible. A raw client and a
+# filtered client read everything; a stuck client never reads and must be dropped without slowing
+# the relay down. Returns a list of (check, ok, detail)
+def relay_check(num_epochs=2000, chunk=4096, max_queue=1<<18):
+    import UBX_Benchmark
+
+    frames = list(UBX_Benchmark.synthetic_frames(num_epochs))
+    data = b''.join(frames)
+    wanted = set([(0x02, 0x15), (0x02, 0x13)])
+    filtered = b''.join(frame for frame in frames if (frame[2], frame[3]) in wanted)
+
+    relay = RelayServer([('127.0.0.1', 0, None), ('127.0.0.1', 0, wanted)], max_queue=max_queue, sndbuf=1<<14)
+    relay.start()
+    received = {}
+    def read_all(name, address):
+        sock = socket.create_connection(address)
+        received[name] = bytearray()
+        while True:
+            d = sock.recv(1<<16)
+            if not d: break
+            received[name] += d
+        sock.close()
+
+    readers = [threading.Thread(target=read_all, args=('raw', relay.endpoints[0].address)),
+               threading.Thread(target=read_all, args=('filtered', relay.endpoints[1].address))]
+    for reader in readers: reader.start()
+    stuck = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    stuck.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1<<12)
+    stuck.connect(relay.endpoints[0].address)
+    deadline = time.time() + 5.
+    while relay.clients_accepted < 3 and time.time() < deadline: time.sleep(0.01)
+
+    # Feed the relay like the capture's writer thread and time every call
+    worst = 0.
+    start = time.perf_counter()
+    for i in range(0, len(data), chunk):
+        t = time.perf_counter()
+        relay(memoryview(data)[i:i + chunk])
+        worst = max(worst, time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+
+    # Wait for the readers' queues to empty, then close the clients
+    deadline = time.time() + 10.
+    while any(client.queued for client in relay.clients()) and time.time() < deadline: time.sleep(0.01)
+    relay.stop()
+    for reader in readers: reader.join(10.)
+    stuck.close()
+
+    dropped = [reason for name, reason in relay.dropped if reason.startswith('too slow')]
+    return [('Raw client received the exact byte stream', received.get('raw') == data,
+             '%i of %i bytes'%(len(received.get('raw', b'')), len(data))),
+            ('Filtered client received just RXM-RAWX and RXM-SFRBX', received.get('filtered') == filtered,
+             '%i of %i bytes'%(len(received.get('filtered', b'')), len(filtered))),
+            ('Stuck client was dropped', len(dropped) == 1, '; '.join(dropped) or 'not dropped'),
+            ('The relay never held up the capture', worst < 0.05,
+             '%.0f bytes/s, slowest call %.2f ms'%(len(data) / elapsed, worst * 1e3))]
+
+def main(argv):
+    print('UBX Relay Check')
+    failures = 0
+    for check, ok, detail in relay_check():
+        failures += not ok
+        print('%s: %s (%s)'%(check, 'ok' if ok else 'FAIL', detail))
+    print('%i checks failed'%failures if failures else 'All checks passed')
+    print('Bye!')
+    if failures: sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,515 @@
+# Replays a GNSS_RAWX_Log_*.bin as if it were coming from the NEO-M8T, so the logger, the capture
+# pipeline and the parsers can be tested and benchmarked without the hardware
+
+# The frames are found through the .ubxidx sidecar (UBX_Index.py) and are sent with the timing of
+# the log: each epoch starts at its GPS time and, at a given baud rate, each frame is delivered when
+# its last byte would have arrived (10 bits per byte), so the bursts after each epoch are as long as
+# they would be on the real serial port. speed replays faster (time and baud rate both scaled);
+# speed 0 sends everything as fast as the target takes it.
+#
+# Targets:
+#   pty:    UBX_Command.SimulatedReceiver - a pseudo-terminal any serial program can open (POSIX)
+#   tcp:    SocketTarget - a TCP server; connect with SocketSerial (or serial.serial_for_url('socket://host:port'),
+#           but its in_waiting is only ever 0 or 1, so SerialCapture would read one byte at a time)
+#   fake:   FakeSerial - an in-process stand-in for serial.Serial, no operating system buffers at all
+# All three answer CFG messages with ACK-ACK / ACK-NAK (UBX_Command.CommandResponder), so the
+# logger's start-up configuration works as it does with the receiver.
+#
+# Faults can be injected on a schedule: drop-outs (nothing is sent for a while) and corruption
+# (one byte of the frame is changed), in windows of log time and / or every Nth frame.
+#
+# benchmark_capture() replays a log into UBX_Capture.SerialCapture and reports the sustained
+# bytes/s, the latency of each frame from the moment it is sent to the moment the capture has
+# written it to the log, and the bytes and frames lost.
+
+# Usage: python UBX_Replay.py [-t pty|tcp] [-b baud] [-s speed] [--port PORT] [--drop START:LENGTH]
+#                             [--corrupt START:LENGTH] [--corrupt-every N] [filename.bin]
+#        python UBX_Replay.py --benchmark [-b baud] [-s speed] [filename.bin]
+# Without --benchmark the log is replayed to a pty (the device name is printed) or a TCP port
+# until it ends or Ctrl-C is pressed. Without a filename, --benchmark uses a synthetic log
+
+import sys
+import os
+import io
+import mmap
+import time
+import socket
+import select
+import struct
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+import UBX_Checker
+import UBX_Index
+import UBX_Command
+
+DROP = 'drop'
+CORRUPT = 'corrupt'
+
+class FakeSerial(object):
+    ''' An in-process stand-in for serial.Serial. The replay inject()s data which read() and readinto()
+    return; commands written to it are answered (through a UBX_Command.CommandResponder) '''
+
+    def __init__(self, timeout=0.1, nak=(), drop=0):
+        self.timeout = timeout
+        self.port = 'fake'
+        self.is_open = True
+        self.responder = UBX_Command.CommandResponder(nak, drop)
+        self._buffer = bytearray()
+        self._ready = threading.Condition()
+
+    def inject(self, data):
+        ''' Data from the receiver '''
+        with self._ready:
+            self._buffer += data
+            self._ready.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self._buffer)
+
+    def _wait(self):
+        # Wait up to timeout for data. Returns the number of bytes waiting
+        with self._ready:
+            if len(self._buffer) == 0 and self.is_open:
+                self._ready.wait(self.timeout)
+            return len(self._buffer)
+
+    def read(self, size=1):
+        self._wait()
+        with self._ready:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def readinto(self, b):
+        self._wait()
+        with self._ready:
+            num_bytes = min(len(b), len(self._buffer))
+            b[:num_bytes] = self._buffer[:num_bytes]
+            del self._buffer[:num_bytes]
+        return num_bytes
+
+    def write(self, data):
+        replies = self.responder.feed(data)
+        if replies: self.inject(b''.join(replies))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._ready:
+            del self._buffer[:]
+
+    def close(self):
+        with self._ready:
+            self.is_open = False
+            self._ready.notify_all()
+
+class SocketTarget(object):
+    ''' A TCP server which sends the replayed data to one client at a time and answers its commands.
+    Data written while no client is connected is discarded (and counted in discarded) '''
+
+    def __init__(self, host='127.0.0.1', port=0, nak=(), drop=0):
+        self.responder = UBX_Command.CommandResponder(nak, drop)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.address = self.server.getsockname()
+        self.url = 'socket://%s:%i'%self.address
+        self.client = None
+        self.discarded = 0
+        self._connected = threading.Event()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='SocketTarget', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            sockets = [self.server] if self.client is None else [self.server, self.client]
+            ready, _, _ = select.select(sockets, [], [], 0.05)
+            if self.server in ready:
+                client, address = self.server.accept()
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with self._write_lock:
+                    if self.client is not None: self.client.close()
+                    self.client = client
+                self._connected.set()
+            elif self.client is not None and self.client in ready:
+                try:
+                    data = self.client.recv(4096)
+                except OSError:
+                    data = b''
+                if len(data) == 0:
+                    with self._write_lock:
+                        self.client.close()
+                        self.client = None
+                    self._connected.clear()
+                    continue
+                for reply in self.responder.feed(data):
+                    self.write(reply)
+
+    def wait_for_client(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def write(self, data):
+        with self._write_lock:
+            if self.client is None:
+                self.discarded += len(data)
+                return
+            try:
+                self.client.sendall(data)
+            except OSError:
+                self.discarded += len(data)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        with self._write_lock:
+            if self.client is not None: self.client.close()
+        self.server.close()
+
+class SocketSerial(object):
+    ''' The client end of a SocketTarget, with the parts of the serial.Serial interface that
+    UBX_Capture.SerialCapture and UBX_Command.UBXCommander use. in_waiting is the number of bytes
+    the socket has received (FIONREAD), so the capture can read them all at once '''
+
+    def __init__(self, address, timeout=0.1):
+        self.timeout = timeout
+        self.port = '%s:%i'%tuple(address)
+        self.socket = socket.create_connection(address)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        try:
+            import fcntl
+            import termios
+            return struct.unpack('i', fcntl.ioctl(self.socket.fileno(), termios.FIONREAD, b'\0\0\0\0'))[0]
+        except (ImportError, OSError):
+            ready, _, _ = select.select([self.socket], [], [], 0)
+            return len(ready)
+
+    def _wait(self):
+        ready, _, _ = select.select([self.socket], [], [], self.timeout)
+        return len(ready) > 0
+
+    def read(self, size=1):
+        if not self._wait(): return b''
+        return self.socket.recv(size)
+
+    def readinto(self, b):
+        if not self._wait(): return 0
+        return self.socket.recv_into(b, len(b))
+
+    def write(self, data):
+        self.socket.sendall(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self.socket.close()
+
+# (kind, start, length) faults from 'START:LENGTH' strings (seconds of log time)
+def parse_faults(kind, windows):
+    faults = []
+    for window in windows:
+        start, length = window.split(':')
+        faults.append((kind, float(start), float(length)))
+    return faults
+
+def delivery_times(times, sizes, speed=1., baud=None):
+    ''' Seconds from the start of the replay at which each frame has been completely sent.
+    times are the GPS times of the frames (their epoch start), sizes their lengths in bytes.
+    At baud, frame i starts at max(its epoch start, the end of frame i - 1):
+    end[i] = D[i+1] + max over j <= i of (t[j] - D[j]), with D the cumulative transmission time '''
+    if speed is None or speed <= 0:
+        return np.zeros(len(sizes))
+    start = (times - times[0]) / speed if len(times) > 0 else times
+    if baud is None:
+        return start
+    duration = sizes * 10. / (baud * speed)
+    D = np.concatenate(([0.], np.cumsum(duration)))
+    return D[1:] + np.maximum.accumulate(start - D[:-1])
+
+class Replay(object):
+    ''' Replays the valid frames of filename through send(data) (e.g. SimulatedReceiver.write,
+    SocketTarget.write or FakeSerial.inject) with the timing of the log (see delivery_times).
+    faults are (DROP or CORRUPT, start, length) windows in seconds of log time; corrupt_every
+    corrupts every Nth frame as well. Frames due at the same moment are sent in one call (of up to
+    max_chunk bytes).
+    After run(), frame_end holds the stream offset of the end of each sent frame and sent_at its
+    time.perf_counter() when it was sent; sent, dropped and corrupted are masks of the frames '''
+
+    def __init__(self, filename, send, speed=1., baud=None, faults=(), corrupt_every=0, seed=1, spin=0.0005,
+                 max_chunk=4096):
+        self.filename = filename
+        self.send = send
+        self.speed = speed
+        self.baud = baud
+        self.max_chunk = max_chunk
+        self.spin = spin # Busy-wait the last spin seconds before each frame rather than sleep
+        index = UBX_Index.UBXIndex(filename)
+        self.frames = np.array(index.frames)
+        times = index.times()
+        timed = np.isfinite(times)
+        times = np.where(timed, times, times[timed][0] if np.any(timed) else 0.)
+        self.log_time = times - times[0] if len(times) > 0 else times # Seconds since the first frame
+        self.sizes = self.frames['length'].astype(np.int64) + UBX_Checker.OVERHEAD
+        self.due = delivery_times(times, self.sizes, speed, baud)
+
+        # The fault schedule
+        n = len(self.frames)
+        self.dropped = np.zeros(n, dtype=bool)
+        self.corrupted = np.zeros(n, dtype=bool)
+        for kind, start, length in faults:
+            window = (self.log_time >= start) & (self.log_time < start + length)
+            if kind == DROP:
+                self.dropped |= window
+            elif kind == CORRUPT:
+                self.corrupted |= window
+            else:
+                raise ValueError('Unknown fault: %s'%kind)
+        if corrupt_every > 0:
+            self.corrupted[corrupt_every - 1::corrupt_every] = True
+        self.corrupted &= ~self.dropped
+        self.sent = ~self.dropped
+        # Which byte of each corrupted frame is changed (and how), chosen up front so runs are repeatable
+        rng = np.random.default_rng(seed)
+        self.corrupt_at = (rng.random(n) * self.sizes).astype(np.int64)
+        self.corrupt_xor = rng.integers(1, 256, n)
+
+        stream_sizes = np.where(self.sent, self.sizes, 0)
+        self.frame_end = np.cumsum(stream_sizes)
+        self.sent_at = np.full(n, np.nan)
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.start_time = None
+        self.end_time = None
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _wait_until(self, t):
+        while True:
+            delay = t - time.perf_counter()
+            if delay <= 0 or self._stop.is_set(): return
+            if delay > self.spin: time.sleep(min(delay - self.spin, 0.1))
+
+    def run(self):
+        ''' Send the frames (blocks until the end of the log or stop()) '''
+        frames = self.frames
+        offsets = frames['offset'].astype(np.int64)
+        with open(self.filename, 'rb') as fi:
+            mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.start_time = time.perf_counter()
+                i = 0
+                n = len(frames)
+                while i < n and not self._stop.is_set():
+                    self._wait_until(self.start_time + self.due[i])
+                    # Everything which is due now goes in one send
+                    last = int(np.searchsorted(self.due, time.perf_counter() - self.start_time, side='right'))
+                    last = min(max(last, i + 1), n)
+                    chunk = bytearray()
+                    j = i
+                    while j < last and len(chunk) < self.max_chunk:
+                        if not self.dropped[j]:
+                            start = len(chunk)
+                            chunk += mm[offsets[j]:offsets[j] + self.sizes[j]]
+                            if self.corrupted[j]: chunk[start + self.corrupt_at[j]] ^= int(self.corrupt_xor[j])
+                        j += 1
+                    # The send time is taken first: the reader can have the data before a (blocking) send returns
+                    self.sent_at[i:j] = time.perf_counter()
+                    if chunk:
+                        self.send(bytes(chunk))
+                        self.bytes_sent += len(chunk)
+                    self.frames_sent += int(np.count_nonzero(self.sent[i:j]))
+                    i = j
+                self.end_time = time.perf_counter()
+            finally:
+                mm.close()
+
+    def start(self):
+        ''' Run in a thread '''
+        self._thread = threading.Thread(target=self.run, name='Replay', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def summary(self):
+        elapsed = max((self.end_time or time.perf_counter()) - self.start_time, 1e-9)
+        return 'Sent %i frames (%i bytes) in %.3f s = %.0f bytes/s. Dropped %i, corrupted %i frames'%(self.frames_sent,
+               self.bytes_sent, elapsed, self.bytes_sent / elapsed, np.count_nonzero(self.dropped),
+               np.count_nonzero(self.corrupted))
+
+class ArrivalMonitor(object):
+    ''' Capture sink: the stream offset of the end of each valid frame and time.perf_counter() when it arrived '''
+
+    def __init__(self):
+        self.parser = UBX_Checker.UBXStreamParser(on_frame=self._on_frame)
+        self.frame_end = []
+        self.arrived_at = []
+        self._now = None
+
+    def __call__(self, data):
+        self._now = time.perf_counter()
+        self.parser.feed(data)
+
+    def _on_frame(self, offset, msg_class, msg_id, payload):
+        self.frame_end.append(offset + UBX_Checker.OVERHEAD + len(payload))
+        self.arrived_at.append(self._now)
+
+class CaptureBenchmark(object):
+    ''' Result of benchmark_capture '''
+    def __init__(self, transport, replay, capture, monitor, elapsed):
+        self.transport = transport
+        self.bytes_sent = replay.bytes_sent
+        self.bytes_captured = capture.bytes_written
+        self.elapsed = elapsed
+        self.bytes_per_second = self.bytes_captured / max(elapsed, 1e-9)
+        self.frames_sent = replay.frames_sent
+        self.frames_intact = int(np.count_nonzero(replay.sent & ~replay.corrupted))
+        self.frames_captured = len(monitor.frame_end)
+        # A frame's latency runs from its send to the capture sink; they are matched by stream offset
+        ends = np.asarray(monitor.frame_end, dtype=np.int64)
+        sent = np.nonzero(replay.sent)[0]
+        k = np.searchsorted(replay.frame_end[sent], ends)
+        matched = (k < len(sent)) & (replay.frame_end[sent[np.minimum(k, len(sent) - 1)]] == ends)
+        self.latency = np.asarray(monitor.arrived_at)[matched] - replay.sent_at[sent[k[matched]]]
+        self.frames_lost = self.frames_intact - int(np.count_nonzero(matched))
+        self.bad_regions = len(monitor.parser.stats.bad_regions)
+        self.capture_summary = capture.summary()
+
+    def __str__(self):
+        lines = ['%s: %i of %i bytes captured in %.3f s = %.0f bytes/s'%(self.transport, self.bytes_captured,
+                 self.bytes_sent, self.elapsed, self.bytes_per_second)]
+        if len(self.latency) > 0:
+            ms = self.latency * 1e3
+            lines.append('  latency: mean %.3f ms, median %.3f ms, 99%% %.3f ms, max %.3f ms'%(np.mean(ms),
+                         np.median(ms), np.percentile(ms, 99), np.max(ms)))
+        lines.append('  frames: %i sent (%i intact), %i captured, %i lost, %i bad regions'%(self.frames_sent,
+                     self.frames_intact, self.frames_captured, self.frames_lost, self.bad_regions))
+        return '\n'.join(lines)
+
+def benchmark_capture(filename, transport='fake', speed=0., baud=None, faults=(), corrupt_every=0,
+                      logfile=None, timeout=10.):
+    ''' Replay filename over transport ('fake', 'pty' or 'tcp') into UBX_Capture.SerialCapture, writing to
+    logfile (default: in memory). Returns a CaptureBenchmark '''
+    import UBX_Capture
+
+    target = None
+    if transport == 'fake':
+        ser = FakeSerial()
+        send = ser.inject
+    elif transport == 'pty':
+        import serial
+        target = UBX_Command.SimulatedReceiver(baud if baud is not None else 115200)
+        ser = serial.Serial(target.port, target.baud, timeout=0.1)
+        send = target.write
+    elif transport == 'tcp':
+        import serial
+        target = SocketTarget()
+        ser = SocketSerial(target.address)
+        target.wait_for_client(5.)
+        send = target.write
+    else:
+        raise ValueError('Unknown transport: %s'%transport)
+
+    fp = io.BytesIO() if logfile is None else open(logfile, 'wb')
+    monitor = ArrivalMonitor()
+    capture = UBX_Capture.SerialCapture(ser, fp, sinks=[monitor])
+    replay = Replay(filename, send, speed, baud, faults, corrupt_every)
+    try:
+        capture.start()
+        replay.run()
+        deadline = time.perf_counter() + timeout
+        while capture.bytes_written < replay.bytes_sent and capture.running() and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        elapsed = (monitor.arrived_at[-1] if monitor.arrived_at else time.perf_counter()) - replay.start_time
+    finally:
+        capture.stop()
+        ser.close()
+        if target is not None: target.close()
+        if logfile is not None: fp.close()
+    monitor.parser.finish()
+    return CaptureBenchmark(transport, replay, capture, monitor, elapsed)
+
+def main(argv):
+    print('UBX Log Replay')
+
+    parser = argparse.ArgumentParser(description='Replay a u-blox log as if it came from the receiver')
+    parser.add_argument('-t', default='pty', choices=('pty', 'tcp'), help='target (default: pty)')
+    parser.add_argument('-b', type=int, default=None, metavar='BAUD', help='line rate (default: no limit)')
+    parser.add_argument('-s', type=float, default=None, metavar='SPEED',
+                        help='replay speed: 1 = real time (the default), 0 = as fast as possible (the default for --benchmark)')
+    parser.add_argument('--port', type=int, default=0, help='TCP port (default: any free port)')
+    parser.add_argument('--drop', action='append', default=[], metavar='START:LENGTH',
+                        help='send nothing for LENGTH seconds from START seconds of log time')
+    parser.add_argument('--corrupt', action='append', default=[], metavar='START:LENGTH',
+                        help='corrupt every frame for LENGTH seconds from START seconds of log time')
+    parser.add_argument('--corrupt-every', type=int, default=0, metavar='N', help='corrupt every Nth frame')
+    parser.add_argument('--benchmark', action='store_true', help='benchmark the capture pipeline')
+    parser.add_argument('filename', nargs='?', default='')
+    args = parser.parse_args(argv[1:])
+    faults = parse_faults(DROP, args.drop) + parse_faults(CORRUPT, args.corrupt)
+
+    if args.benchmark:
+        import UBX_Benchmark
+        tempname = None
+        filename = args.filename
+        if filename == '':
+            tempname = os.path.join(tempfile.gettempdir(), 'UBX_Replay.bin')
+            filename = tempname
+            print('Generating synthetic log', filename)
+            UBX_Benchmark.write_synthetic_log(filename, 2000) # ~ 1.4MB, 500 seconds at 4Hz
+        try:
+            speed = 0. if args.s is None else args.s
+            print('Speed %s, baud %s'%('unlimited' if speed <= 0 else '%gx'%speed, 'unlimited' if args.b is None else args.b))
+            for transport in ('fake', 'pty', 'tcp'):
+                print(benchmark_capture(filename, transport, speed, args.b, faults, args.corrupt_every))
+            if not (faults or args.corrupt_every):
+                print('With a 20 s drop-out and every 100th frame corrupted:')
+                print(benchmark_capture(filename, 'fake', speed, args.b, [(DROP, 100., 20.)], 100))
+        finally:
+            if tempname is not None:
+                os.remove(tempname)
+                if os.path.exists(UBX_Index.index_filename(tempname)): os.remove(UBX_Index.index_filename(tempname))
+        print('Bye!')
+        return
+
+    filename = args.filename
+    firstfile = UBX_Checker.find_first_file()
+    if filename == '': filename = input('Enter the bin filename (default: ' + firstfile + '): ') # Get the filename
+    if filename == '': filename = firstfile
+
+    if args.t == 'pty':
+        target = UBX_Command.SimulatedReceiver(args.b if args.b is not None else 115200)
+        print('Open', target.port)
+    else:
+        target = SocketTarget('0.0.0.0', args.port)
+        print('Connect to socket://<this host>:%i'%target.address[1])
+        print('Waiting for a client...')
+        target.wait_for_client()
+    replay = Replay(filename, target.write, 1. if args.s is None else args.s, args.b, faults, args.corrupt_every)
+    try:
+        replay.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        target.close()
+    print(replay.summary())
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,281 @@
+# Extracts the TIM-TM2 (time mark) events from a u-blox binary file into a numpy structured array
+# and (optionally) interpolates the position of each event from an RTKLIB .pos file
+
+# events has one row per new edge on the EXTINT input: the channel, the edge (1 = rising, 0 = falling),
+# the rising edge count, week, towMs, towSubMs (ns), the continuous GPS time in seconds, the accuracy
+# estimate (ns), the time base (0 = receiver, 1 = GNSS, 2 = UTC), the UTC-available and time-valid flags
+# and the file offset of the frame. week and towMs are as the receiver sent them (in UTC with the
+# default timeRef); time is always GPST, so it lines up with read_pos. UTC time marks are moved on by
+# the leap seconds (RXM-RAWX leapS, if the log has it). Time marks in receiver time, or without the
+# time-valid flag, have no GPS time: their time is NaN.
+#
+# Each TIM-TM2 message reports the latest rising and the latest falling edge; the newRisingEdge and
+# newFallingEdge flags say which of them are new. Old edges are left out so each edge appears once.
+#
+# The frames are found through the .ubxidx sidecar (UBX_Index.py) and decoded with one
+# np.frombuffer view per alignment (UBX_RAWX.records_at). Positions are interpolated with
+# np.searchsorted on the sorted .pos times, so thousands of camera triggers take milliseconds.
+
+# Usage: python UBX_TIMTM2.py filename.bin [filename.pos] [output.csv | output.parquet]
+#        python UBX_TIMTM2.py --check : check the extractor on a synthetic log
+
+import sys
+import os
+import mmap
+import time
+import csv
+
+import numpy as np
+
+import POS_to_CSV
+import UBX_Checker
+import UBX_Index
+import UBX_RAWX
+
+# TIM-TM2 payload, exactly as it is in the file
+TIM_TM2_DTYPE = np.dtype([('ch', 'u1'), ('flags', 'u1'), ('count', '<u2'), ('wnR', '<u2'), ('wnF', '<u2'),
+                          ('towMsR', '<u4'), ('towSubMsR', '<u4'), ('towMsF', '<u4'), ('towSubMsF', '<u4'),
+                          ('accEst', '<u4')])
+
+EVENT_DTYPE = np.dtype([('ch', 'u1'), ('edge', 'u1'), ('count', '<u2'), ('week', '<u2'), ('towMs', '<u4'),
+                        ('towSubMs', '<u4'), ('time', '<f8'), ('accEst', '<u4'), ('timeBase', 'u1'),
+                        ('utc', 'u1'), ('valid', 'u1'), ('offset', '<u8')])
+
+RISING = 1
+FALLING = 0
+
+# flags bits
+NEW_FALLING_EDGE = 0x04
+TIME_BASE_SHIFT = 3
+TIME_BASE_MASK = 0x18
+UTC_AVAILABLE = 0x20
+TIME_VALID = 0x40
+NEW_RISING_EDGE = 0x80
+
+# timeBase
+TIME_BASE_RECEIVER = 0
+TIME_BASE_GNSS = 1
+TIME_BASE_UTC = 2
+
+# RXM-RAWX recStat bit
+LEAP_SEC_VALID = 0x01
+
+POS_COLUMNS = ('x', 'y', 'z') # ECEF; lat, lon, height for llh .pos files
+
+def decode_frames(buf, offsets, lengths, leap_seconds=POS_to_CSV.LEAP_SECONDS):
+    ''' Decode the TIM-TM2 frames which start at offsets in buf. Returns the events, in time order
+    (events without a GPS time last). UTC times are converted to GPS time with leap_seconds '''
+    offsets = np.asarray(offsets, dtype=np.int64)
+    offsets = offsets[np.asarray(lengths) == TIM_TM2_DTYPE.itemsize]
+    tm2 = UBX_RAWX.records_at(buf, offsets + UBX_Checker.HEADER_LEN, TIM_TM2_DTYPE)
+
+    rising = np.nonzero(tm2['flags'] & NEW_RISING_EDGE)[0]
+    falling = np.nonzero(tm2['flags'] & NEW_FALLING_EDGE)[0]
+    events = np.empty(len(rising) + len(falling), dtype=EVENT_DTYPE)
+    r = events[:len(rising)]
+    f = events[len(rising):]
+    for e, sel, edge, suffix in ((r, rising, RISING, 'R'), (f, falling, FALLING, 'F')):
+        rows = tm2[sel]
+        e['ch'] = rows['ch']
+        e['edge'] = edge
+        e['count'] = rows['count']
+        e['week'] = rows['wn' + suffix]
+        e['towMs'] = rows['towMs' + suffix]
+        e['towSubMs'] = rows['towSubMs' + suffix]
+        e['accEst'] = rows['accEst']
+        e['timeBase'] = (rows['flags'] & TIME_BASE_MASK) >> TIME_BASE_SHIFT
+        e['utc'] = (rows['flags'] & UTC_AVAILABLE) != 0
+        e['valid'] = (rows['flags'] & TIME_VALID) != 0
+        e['offset'] = offsets[sel]
+    # time is good to ~0.25 us (float64 at 1e9 s); towMs and towSubMs keep the full ns resolution
+    events['time'] = UBX_Index.gps_seconds(events['week'], events['towMs'] // 1000)
+    events['time'] += ((events['towMs'] % 1000) / 1.0e3) + (events['towSubMs'] / 1.0e9)
+    events['time'][events['timeBase'] == TIME_BASE_UTC] += leap_seconds
+    events['time'][(events['timeBase'] == TIME_BASE_RECEIVER) | (events['valid'] == 0)] = np.nan
+    return events[np.argsort(events['time'], kind='stable')]
+
+def log_leap_seconds(buf, index):
+    ''' GPST - UTC from the last RXM-RAWX in the log which has valid leap seconds (None if there isn't one) '''
+    records = index.select(0x02, 0x15)
+    records = records[records['length'] >= UBX_RAWX.RAWX_HEADER_DTYPE.itemsize]
+    if len(records) == 0: return None
+    headers = UBX_RAWX.records_at(buf, records['offset'].astype(np.int64) + UBX_Checker.HEADER_LEN,
+                                  UBX_RAWX.RAWX_HEADER_DTYPE)
+    valid = np.nonzero(headers['recStat'] & LEAP_SEC_VALID)[0]
+    if len(valid) == 0: return None
+    return int(headers['leapS'][valid[-1]])
+
+def load_events(filename, start=None, end=None, index=None, leap_seconds=None):
+    ''' Extract the TIM-TM2 events from filename (optionally only those in frames with start <= GPS time < end).
+    UTC times are converted to GPS time with leap_seconds: by default the RXM-RAWX leapS from the log,
+    or POS_to_CSV.LEAP_SECONDS if it has none. Creates or updates the .ubxidx sidecar if needed '''
+    if index is None: index = UBX_Index.UBXIndex(filename)
+    records = index.select(0x0D, 0x03, start, end)
+    if len(records) == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    with open(filename, 'rb') as fi:
+        mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if leap_seconds is None: leap_seconds = log_leap_seconds(mm, index)
+            if leap_seconds is None: leap_seconds = POS_to_CSV.LEAP_SECONDS
+            return decode_frames(mm, records['offset'].astype(np.int64), records['length'], leap_seconds)
+        finally:
+            mm.close()
+
+def read_pos(filename, leap_seconds=POS_to_CSV.LEAP_SECONDS):
+    ''' Read an RTKLIB .pos file (date/time or week/tow, GPST or UTC) with POS_to_CSV.read_pos. Returns
+    (time, positions, Q) where time is continuous GPS seconds and positions is an (n, 3) array of the
+    first three solution columns. UTC times are converted to GPS time with leap_seconds '''
+    header, solutions = POS_to_CSV.read_pos(filename)
+    names = POS_to_CSV.COORDINATES[header['coordinates']][0]
+    positions = np.column_stack([solutions[name] for name in names]).reshape(-1, 3)
+    return (POS_to_CSV.gps_time(solutions, header, leap_seconds), positions,
+            solutions['Q'].astype(np.int64))
+
+def interpolate_positions(events, pos_time, positions, max_gap=1.0):
+    ''' Linearly interpolate positions (n, 3) at pos_time to the time of each event.
+    Events outside the .pos time span, or between solutions more than max_gap seconds apart, get NaN '''
+    order = np.argsort(pos_time, kind='stable')
+    pos_time = pos_time[order]
+    positions = positions[order]
+    t = events['time']
+    out = np.full((len(t), positions.shape[1]), np.nan)
+    if len(pos_time) < 2: return out
+    # pos_time[left] <= t < pos_time[left + 1]
+    left = np.searchsorted(pos_time, t, side='right') - 1
+    ok = (left >= 0) & (t <= pos_time[-1])
+    left = np.clip(left, 0, len(pos_time) - 2)
+    right = left + 1
+    gap = pos_time[right] - pos_time[left]
+    fraction = (t - pos_time[left]) / np.where(gap > 0, gap, 1.)
+    # Events exactly on a solution don't need its neighbour, however far away it is
+    ok &= (gap <= max_gap) | (fraction == 0.) | (t == pos_time[right])
+    values = positions[left] + (fraction[:, np.newaxis] * (positions[right] - positions[left]))
+    out[ok] = values[ok]
+    return out
+
+# Column names and arrays of the events (plus positions, if given) for export
+def columns(events, positions=None):
+    cols = [(name, events[name]) for name in EVENT_DTYPE.names]
+    if positions is not None:
+        cols += [(name, positions[:, i]) for i, name in enumerate(POS_COLUMNS)]
+    return cols
+
+def write_csv(filename, events, positions=None):
+    cols = columns(events, positions)
+    with open(filename, 'w', newline='') as fo:
+        output = csv.writer(fo, delimiter=',')
+        output.writerow([name for name, values in cols])
+        # repr of a Python float keeps all the digits of time and the positions
+        output.writerows(zip(*[values.tolist() for name, values in cols]))
+
+def write_parquet(filename, events, positions=None):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception('Writing Parquet files needs pyarrow (pip install pyarrow)')
+    cols = columns(events, positions)
+    table = pyarrow.table({name: values for name, values in cols})
+    pyarrow.parquet.write_table(table, filename)
+
+# Check the extractor on a synthetic log: RXM-RAWX (leapS 18) plus TIM-TM2 with new rising and falling
+# edges timed in UTC, plus time marks in receiver time and without time-valid. Returns a list of (check, ok)
+def timtm2_check(num_epochs=40):
+    import struct
+    import tempfile
+    import UBX_Benchmark
+
+    frames = list(UBX_Benchmark.synthetic_frames(num_epochs))
+    rcvTow = np.array([struct.unpack_from('<d', f, UBX_Checker.HEADER_LEN)[0] for f in frames[0::3]])
+    gpst = UBX_Index.gps_seconds(1980, rcvTow)
+    def tm2(flags, count):
+        towMs = int(rcvTow[0] * 1000)
+        return UBX_Checker.ubx_frame(0x0D, 0x03, struct.pack('<BBHHHIIIII', 0, flags, count, 1980, 1980,
+                                                              towMs, 0, towMs, 0, 20))
+    receiver = tm2(NEW_RISING_EDGE | (TIME_BASE_RECEIVER << TIME_BASE_SHIFT) | TIME_VALID, 1000)
+    invalid = tm2(NEW_RISING_EDGE | (TIME_BASE_UTC << TIME_BASE_SHIFT) | UTC_AVAILABLE, 1001)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'check.bin')
+        with open(filename, 'wb') as fo: fo.write(b''.join(frames) + receiver + invalid)
+        events = load_events(filename)
+        rising = events[(events['edge'] == RISING) & (events['count'] < num_epochs)]
+        falling = events[events['edge'] == FALLING]
+        results.append(('%i rising and %i falling edges from %i epochs'%(len(rising), len(falling), num_epochs),
+                        (len(rising) == num_epochs) and (len(falling) == num_epochs)))
+        results.append(('UTC rising edges are at the RXM-RAWX GPS time (leapS from the log)',
+                        np.allclose(rising['time'], gpst, rtol=0., atol=1e-6)))
+        results.append(('UTC falling edges are 10 ms later', np.allclose(falling['time'], gpst + 0.01, rtol=0., atol=1e-6)))
+        shifted = load_events(filename, leap_seconds=17)
+        results.append(('leap_seconds overrides leapS',
+                        np.allclose(shifted['time'][:num_epochs] - events['time'][:num_epochs], -1., rtol=0., atol=1e-6)))
+        extra = events[events['count'] >= num_epochs]
+        results.append(('receiver time and invalid time marks have no time',
+                        (len(extra) == 2) and bool(np.all(np.isnan(extra['time'])))))
+        # A trajectory which is at x = GPS time: each event's position is its GPS time
+        pos_time = np.arange(gpst[0] - 1., gpst[-1] + 1., 0.2)
+        positions = np.column_stack((pos_time, np.zeros(len(pos_time)), np.zeros(len(pos_time))))
+        x = interpolate_positions(rising, pos_time, positions)[:, 0]
+        results.append(('positions are interpolated at the GPS time of each edge', np.allclose(x, gpst, rtol=0., atol=1e-6)))
+        with open(filename, 'wb') as fo: fo.write(b''.join(frames[2::3])) # TIM-TM2 only: no leapS
+        os.remove(UBX_Index.index_filename(filename))
+        events = load_events(filename)
+        results.append(('without RXM-RAWX, LEAP_SECONDS is used',
+                        np.allclose(events['time'][events['edge'] == RISING], gpst + POS_to_CSV.LEAP_SECONDS - 18, rtol=0., atol=1e-6)))
+    return results
+
+def main(argv):
+    print('UBX TIM-TM2 Event Extractor')
+
+    if argv[1:2] == ['--check']:
+        failures = 0
+        for check, ok in timtm2_check():
+            failures += not ok
+            print('%s: %s'%(check, 'ok' if ok else 'FAIL'))
+        print('%i checks failed'%failures if failures else 'All checks passed')
+        print('Bye!')
+        if failures: sys.exit(1)
+        return
+
+    filename = ''
+    if len(argv) > 1: filename = argv[1]
+    firstfile = UBX_Checker.find_first_file()
+    if filename == '': filename = input('Enter the bin filename (default: ' + firstfile + '): ') # Get the filename
+    if filename == '': filename = firstfile
+
+    start = time.perf_counter()
+    events = load_events(filename)
+    elapsed = time.perf_counter() - start
+    print('Extracted %i events in %.3f s'%(len(events), elapsed))
+    if len(events) > 0:
+        print('%i rising, %i falling edges'%(np.count_nonzero(events['edge'] == RISING),
+                                              np.count_nonzero(events['edge'] == FALLING)))
+        untimed = np.count_nonzero(np.isnan(events['time']))
+        if untimed > 0:
+            print('WARNING: %i events have no GPS time (receiver time base, or time not valid)'%untimed)
+        print('GPS week %i TOW %.9f to GPS week %i TOW %.9f'%(events['week'][0], events['towMs'][0] / 1.0e3,
+                                                             events['week'][-1], events['towMs'][-1] / 1.0e3))
+
+    positions = None
+    if len(argv) > 2:
+        posfile = argv[2]
+        pos_time, pos, quality = read_pos(posfile)
+        start = time.perf_counter()
+        positions = interpolate_positions(events, pos_time, pos)
+        elapsed = time.perf_counter() - start
+        print('Interpolated %i of %i positions from %s in %.3f s'%(np.count_nonzero(~np.isnan(positions[:, 0])),
+                                                                   len(events), posfile, elapsed))
+
+    outfile = filename[:-4] + '_events.csv'
+    if len(argv) > 3: outfile = argv[3]
+    if os.path.splitext(outfile)[1] == '.parquet':
+        write_parquet(outfile, events, positions)
+    else:
+        write_csv(outfile, events, positions)
+    print('Saved', outfile)
+
+    print('Bye!')
+
+if __name__ == '__main__':
+    main(sys.argv)